@@ -0,0 +1,19 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_script_environment():
+    """
+    Prepare the process for a benchmark run as a script: lambda code is put on the import path
+    the way runtests.py does it, tables get default names and metrics lines are turned off unless
+    METRICS_SAMPLE_RATE is set. Called before lambda modules are imported, importing a benchmark
+    module leaves the process untouched.
+    """
+    paths = [os.path.join(BASE_DIR, 'message'), os.path.join(BASE_DIR, 'shared')]
+    sys.path[:0] = [path for path in paths if path not in sys.path]
+    os.environ.setdefault('CONNECTION_TABLE_NAME', 'chat_connections')
+    os.environ.setdefault('MESSAGE_TABLE_NAME', 'chat_messages')
+    # Metrics lines are meant for CloudWatch, keep result tables readable
+    os.environ.setdefault('METRICS_SAMPLE_RATE', '0')
@@ -0,0 +1,444 @@
+"""
+In-memory stand-ins of the DynamoDB tables and the api gateway management api.
+
+They implement the subset of boto3 table resource and management client
+calls the chat functions make, including the expression syntax they use,
+and can inject latency and failures into every call. Register them with
+aws_resources.register_table / register_gateway_client before invoking
+handlers.
+"""
+import random
+import re
+import threading
+import time
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+_TOKEN = re.compile(r'\s*(<=|>=|<>|[=<>(),]|[#:]?[A-Za-z_][A-Za-z0-9_.]*)')
+
+
+def client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+def _tokenize(expression):
+    tokens, position = [], 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if not match:
+            raise ValueError('Cannot parse expression: {}'.format(expression))
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class _Expression:
+    """Parsed condition, key condition or filter expression"""
+
+    COMPARATORS = {'=': lambda a, b: a == b, '<>': lambda a, b: a != b,
+                   '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+                   '>': lambda a, b: a > b, '>=': lambda a, b: a >= b}
+
+    def __init__(self, expression, names=None, values=None):
+        self.tokens = _tokenize(expression)
+        self.names = names or {}
+        self.values = values or {}
+        self.position = 0
+        self.tree = self._or()
+        if self.position != len(self.tokens):
+            raise ValueError('Unexpected token {!r} in {}'.format(self.tokens[self.position], expression))
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _take(self, expected=None):
+        token = self._peek()
+        if expected is not None and (token or '').upper() != expected:
+            raise ValueError('Expected {} but got {}'.format(expected, token))
+        self.position += 1
+        return token
+
+    def _or(self):
+        node = self._and()
+        while (self._peek() or '').upper() == 'OR':
+            self._take()
+            node = ('or', node, self._and())
+        return node
+
+    def _and(self):
+        node = self._term()
+        while (self._peek() or '').upper() == 'AND':
+            self._take()
+            node = ('and', node, self._term())
+        return node
+
+    def _term(self):
+        token = self._take()
+        if token == '(':
+            node = self._or()
+            self._take(')')
+            return node
+        if token.upper() == 'NOT':
+            return ('not', self._term())
+        if token in ('attribute_exists', 'attribute_not_exists'):
+            self._take('(')
+            name = self._name(self._take())
+            self._take(')')
+            return (token, name)
+        name = self._name(token)
+        comparator = self._take()
+        if comparator.upper() == 'BETWEEN':
+            low = self._value(self._take())
+            self._take('AND')
+            return ('between', name, low, self._value(self._take()))
+        return ('compare', comparator, name, self._value(self._take()))
+
+    def _name(self, token):
+        return self.names.get(token, token)
+
+    def _value(self, token):
+        return self.values[token]
+
+    def evaluate(self, item, node=None):
+        node = self.tree if node is None else node
+        kind = node[0]
+        if kind == 'or':
+            return self.evaluate(item, node[1]) or self.evaluate(item, node[2])
+        if kind == 'and':
+            return self.evaluate(item, node[1]) and self.evaluate(item, node[2])
+        if kind == 'not':
+            return not self.evaluate(item, node[1])
+        if kind == 'attribute_exists':
+            return node[1] in item
+        if kind == 'attribute_not_exists':
+            return node[1] not in item
+        if kind == 'between':
+            return node[1] in item and node[2] <= item[node[1]] <= node[3]
+        return node[2] in item and self.COMPARATORS[node[1]](item[node[2]], node[3])
+
+    def key_values(self, hash_key):
+        """Value the hash key is compared to with '=' in a key condition"""
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            if node[0] == 'and':
+                stack.extend(node[1:])
+            elif node[0] == 'compare' and node[1] == '=' and node[2] == hash_key:
+                return node[3]
+        raise ValueError('Key condition does not fix {}'.format(hash_key))
+
+
+def _number(value):
+    return Decimal(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+
+
+def _store(item):
+    """Numbers come back from DynamoDB as Decimal"""
+    return {key: _number(value) for key, value in item.items()}
+
+
+class _Meta:
+
+    def __init__(self, client):
+        self.client = client
+
+
+class _BatchWriter:
+
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key=Key)
+
+
+class FakeTable:
+    """
+    Thread safe in-memory DynamoDB table.
+    Args:
+        name: str - table name
+        hash_key: str - partition key attribute
+        range_key: str or None - sort key attribute
+        indexes: dict - global secondary index name mapped to (hash key, range key)
+        latency: float - seconds every call sleeps
+        failure_rate: float - share of calls failing with ProvisionedThroughputExceededException
+        page_size: int - most items a query or scan page holds
+        partition_wcu: float or None - write units per second every partition key sustains,
+            writes above it fail with ProvisionedThroughputExceededException
+    """
+
+    def __init__(self, name, hash_key, range_key=None, indexes=None, latency=0.0, failure_rate=0.0,
+                 page_size=1000, partition_wcu=None, clock=time.monotonic):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.page_size = page_size
+        self.partition_wcu = partition_wcu
+        self.clock = clock
+        self.calls = {}
+        self.throttled = 0
+        self.meta = _Meta(self)
+        self._write_buckets = {}
+        self._partitions = {}
+        self._lock = threading.Lock()
+
+    # Helpers
+
+    def _call(self, operation, fail=True):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail and self.failure_rate and random.random() < self.failure_rate:
+            raise client_error('ProvisionedThroughputExceededException', operation)
+
+    def _consume_write(self, hash_value, operation):
+        """Take one write unit of the partition, bucket holds one second of capacity. Call with lock held"""
+        if self.partition_wcu is None:
+            return
+        now = self.clock()
+        tokens, updated = self._write_buckets.get(hash_value, (self.partition_wcu, now))
+        tokens = min(self.partition_wcu, tokens + (now - updated) * self.partition_wcu)
+        if tokens < 1:
+            self.throttled += 1
+            self._write_buckets[hash_value] = (tokens, now)
+            raise client_error('ProvisionedThroughputExceededException', operation)
+        self._write_buckets[hash_value] = (tokens - 1, now)
+
+    def _key(self, item):
+        return item[self.hash_key], item.get(self.range_key) if self.range_key else None
+
+    def _get(self, key):
+        hash_value, range_value = self._key(key)
+        return self._partitions.get(hash_value, {}).get(range_value)
+
+    def _check(self, item, condition, names, values, operation):
+        if condition and not _Expression(condition, names, values).evaluate(item or {}):
+            raise client_error('ConditionalCheckFailedException', operation)
+
+    def items(self):
+        """Returns copies of all stored items"""
+        with self._lock:
+            return [dict(item) for partition in self._partitions.values() for item in partition.values()]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(partition) for partition in self._partitions.values())
+
+    # Item calls
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **_):
+        self._call('PutItem')
+        item = _store(Item)
+        with self._lock:
+            hash_value, range_value = self._key(item)
+            self._consume_write(hash_value, 'PutItem')
+            self._check(self._get(item), ConditionExpression, ExpressionAttributeNames,
+                        ExpressionAttributeValues, 'PutItem')
+            self._partitions.setdefault(hash_value, {})[range_value] = item
+        return {}
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **_):
+        self._call('GetItem')
+        with self._lock:
+            item = self._get(Key)
+            if item is None:
+                return {}
+            return {'Item': self._project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def delete_item(self, Key, **_):
+        self._call('DeleteItem')
+        with self._lock:
+            hash_value, range_value = self._key(Key)
+            self._consume_write(hash_value, 'DeleteItem')
+            partition = self._partitions.get(hash_value, {})
+            partition.pop(range_value, None)
+            if not partition:
+                self._partitions.pop(hash_value, None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, ExpressionAttributeNames=None,
+                    ConditionExpression=None, ReturnValues='NONE', **_):
+        self._call('UpdateItem')
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            self._consume_write(self._key(Key)[0], 'UpdateItem')
+            current = self._get(Key)
+            self._check(current, ConditionExpression, names, values, 'UpdateItem')
+            item = dict(current or _store(Key))
+            updated = {}
+            for action, assignments in re.findall(r'(SET|ADD|REMOVE)\s+(.*?)(?=\s+(?:SET|ADD|REMOVE)\s|$)',
+                                                  UpdateExpression.strip()):
+                for assignment in assignments.split(','):
+                    parts = assignment.replace('=', ' ').split()
+                    name = names.get(parts[0], parts[0])
+                    if action == 'REMOVE':
+                        item.pop(name, None)
+                        continue
+                    value = _number(values[parts[1]])
+                    item[name] = item.get(name, 0) + value if action == 'ADD' else value
+                    updated[name] = item[name]
+            hash_value, range_value = self._key(item)
+            self._partitions.setdefault(hash_value, {})[range_value] = item
+        if ReturnValues == 'UPDATED_NEW':
+            return {'Attributes': updated}
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': dict(item)}
+        return {}
+
+    def batch_writer(self, **_):
+        return _BatchWriter(self)
+
+    def batch_write_item(self, RequestItems, **_):
+        """
+        Low level client call, the table serves as its own meta.client. Items are in
+        attribute value format, failed and throttled writes come back unprocessed.
+        """
+        self._call('BatchWriteItem', fail=False)
+        deserializer = TypeDeserializer()
+        unprocessed = []
+        for request in RequestItems.get(self.name, []):
+            if self.failure_rate and random.random() < self.failure_rate:
+                unprocessed.append(request)
+                continue
+            put = 'PutRequest' in request
+            item = request['PutRequest']['Item'] if put else request['DeleteRequest']['Key']
+            item = {key: deserializer.deserialize(value) for key, value in item.items()}
+            with self._lock:
+                hash_value, range_value = self._key(item)
+                try:
+                    self._consume_write(hash_value, 'BatchWriteItem')
+                except ClientError:
+                    unprocessed.append(request)
+                    continue
+                if put:
+                    self._partitions.setdefault(hash_value, {})[range_value] = _store(item)
+                elif range_value in self._partitions.get(hash_value, {}):
+                    del self._partitions[hash_value][range_value]
+        return {'UnprocessedItems': {self.name: unprocessed} if unprocessed else {}}
+
+    # Reads
+
+    @staticmethod
+    def _project(item, projection, names):
+        if not projection:
+            return dict(item)
+        names = names or {}
+        fields = [names.get(name.strip(), name.strip()) for name in projection.split(',')]
+        return {field: item[field] for field in fields if field in item}
+
+    def _page(self, candidates, Limit=None, ExclusiveStartKey=None, FilterExpression=None,
+              ProjectionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+              sort_keys=None, **_):
+        if ExclusiveStartKey is not None:
+            start = tuple(ExclusiveStartKey.get(key) for key in sort_keys)
+            candidates = candidates[next((i + 1 for i, item in enumerate(candidates)
+                                          if tuple(item.get(key) for key in sort_keys) == start),
+                                         len(candidates)):]
+        limit = min(Limit or self.page_size, self.page_size)
+        evaluated = candidates[:limit]
+        response = {'Count': 0, 'ScannedCount': len(evaluated)}
+        if len(candidates) > limit:
+            response['LastEvaluatedKey'] = {key: evaluated[-1][key] for key in sort_keys if key in evaluated[-1]}
+        if FilterExpression:
+            condition = _Expression(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            evaluated = [item for item in evaluated if condition.evaluate(item)]
+        response['Items'] = [self._project(item, ProjectionExpression, ExpressionAttributeNames)
+                             for item in evaluated]
+        response['Count'] = len(response['Items'])
+        return response
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues=None, ExpressionAttributeNames=None,
+              IndexName=None, ScanIndexForward=True, **kwargs):
+        self._call('Query')
+        hash_key, range_key = self.indexes[IndexName] if IndexName else (self.hash_key, self.range_key)
+        condition = _Expression(KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        hash_value = condition.key_values(hash_key)
+        with self._lock:
+            if IndexName:
+                candidates = [item for partition in self._partitions.values() for item in partition.values()
+                              if item.get(hash_key) == hash_value]
+            else:
+                candidates = list(self._partitions.get(hash_value, {}).values())
+        candidates = [item for item in candidates if condition.evaluate(item)]
+        if range_key:
+            candidates.sort(key=lambda item: item[range_key], reverse=not ScanIndexForward)
+        sort_keys = [key for key in (hash_key, range_key, self.hash_key, self.range_key) if key]
+        return self._page(candidates, ExpressionAttributeNames=ExpressionAttributeNames,
+                          ExpressionAttributeValues=ExpressionAttributeValues,
+                          sort_keys=list(dict.fromkeys(sort_keys)), **kwargs)
+
+    def scan(self, **kwargs):
+        self._call('Scan')
+        with self._lock:
+            candidates = [item for partition in self._partitions.values() for item in partition.values()]
+        sort_keys = [key for key in (self.hash_key, self.range_key) if key]
+        return self._page(candidates, sort_keys=sort_keys, **kwargs)
+
+
+class FakeGateway:
+    """
+    Thread safe api gateway management api.
+    Args:
+        latency: float - seconds every post sleeps
+        failure_rate: float - share of posts failing with LimitExceededException
+        gone: set - connection ids answered with GoneException
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, gone=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.gone = set(gone or ())
+        self.posts = 0
+        self.bytes = 0
+        self.received = {}
+        self.keep_frames = False
+        self._lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId, Data):
+        if self.latency:
+            time.sleep(self.latency)
+        if ConnectionId in self.gone:
+            raise client_error('GoneException', 'PostToConnection')
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise client_error('LimitExceededException', 'PostToConnection')
+        with self._lock:
+            self.posts += 1
+            self.bytes += len(Data)
+            if self.keep_frames:
+                self.received.setdefault(ConnectionId, []).append(Data)
+        return {}
+
+    def get_connection(self, ConnectionId):
+        if self.latency:
+            time.sleep(self.latency)
+        if ConnectionId in self.gone:
+            raise client_error('GoneException', 'GetConnection')
+        return {}
+
+
+def build_connection_table(name='chat_connections', **kwargs):
+    """Connection table laid out as in template.yaml"""
+    return FakeTable(name, 'connectionId', indexes={'room-index': ('room', 'connectionId'),
+                                                    'username-index': ('username', 'connectionId')}, **kwargs)
+
+
+def build_message_table(name='chat_messages', **kwargs):
+    """Message table laid out as in template.yaml"""
+    return FakeTable(name, 'room', 'index', **kwargs)
@@ -0,0 +1,129 @@
+"""
+Offline load test of the chat handlers.
+
+Handlers are driven with synthetic api gateway events modelled on
+tests/unit/test_data.py. Connection and message tables and the management
+api are in-memory stand-ins (benchmarks.fakes) with configurable latency
+and failure rates. Throughput and p50/p99 latency are reported for
+connect, send (store and broadcast), broadcast alone and history requests.
+
+Usage:
+    python -m chat_backend.benchmarks.load_test [--connections 10,1000,10000] [--messages 20]
+        [--db-latency-ms 0] [--gateway-latency-ms 0] [--failure-rate 0] [--gone-rate 0]
+"""
+import argparse
+import copy
+import json
+import os
+import time
+from chat_backend.benchmarks import use_script_environment
+
+if __name__ == '__main__':
+    use_script_environment()
+
+import aws_resources  # noqa: E402
+import utils  # noqa: E402
+from app import send_message, get_recent_messages  # noqa: E402
+from history import history_cache  # noqa: E402
+from chat_backend.ws_connection.app import connection_manager  # noqa: E402
+from chat_backend.tests.unit.test_data import web_socket_connect_event, send_message_event  # noqa: E402
+from chat_backend.benchmarks.fakes import FakeGateway, build_connection_table, build_message_table  # noqa: E402
+
+ROOM = 'load'
+
+
+def connect_event(number):
+    event = copy.deepcopy(web_socket_connect_event)
+    event['requestContext']['connectionId'] = f'conn-{number}'
+    event['queryStringParameters'] = {'username': f'user_{number}', 'room': ROOM}
+    return event
+
+
+def message_event(number, action='sendmessage'):
+    event = copy.deepcopy(send_message_event)
+    event['requestContext']['connectionId'] = f'conn-{number}'
+    event['body'] = json.dumps({'action': action, 'room': ROOM, 'content': f'load message {number}'})
+    return event
+
+
+def install_fakes(db_latency=0.0, gateway_latency=0.0, failure_rate=0.0):
+    """Replace AWS resources by fresh in-memory stand-ins and drop container caches"""
+    aws_resources.clear_cache()
+    history_cache.clear()
+    utils._index_blocks.clear()
+    utils._connection_items.clear()
+    connections = build_connection_table(os.environ['CONNECTION_TABLE_NAME'], latency=db_latency,
+                                         failure_rate=failure_rate)
+    messages = build_message_table(os.environ['MESSAGE_TABLE_NAME'], latency=db_latency,
+                                   failure_rate=failure_rate)
+    gateway = FakeGateway(latency=gateway_latency, failure_rate=failure_rate)
+    aws_resources.register_table(connections.name, connections)
+    aws_resources.register_table(messages.name, messages)
+    aws_resources.register_gateway_client(utils.get_endpoint_url(send_message_event), gateway)
+    return connections, messages, gateway
+
+
+def measure(name, calls):
+    """Run calls one after another and summarize their latency"""
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for call in calls:
+        call_started = time.perf_counter()
+        try:
+            response = call()
+            errors += response.get('statusCode', 200) >= 400
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return dict(utils.summarize_latencies(latencies), operation=name, errors=errors,
+                per_second=len(latencies) / elapsed if elapsed else 0.0)
+
+
+def run_scenario(connections, messages, db_latency=0.0, gateway_latency=0.0, failure_rate=0.0, gone_rate=0.0):
+    """
+    Connect clients to one room and send messages to it.
+    Returns:
+        list - latency summary of every operation
+    """
+    _, _, gateway = install_fakes(db_latency, gateway_latency, failure_rate)
+    results = [measure('connect', [lambda i=i: connection_manager(connect_event(i), None)
+                                   for i in range(connections)])]
+    gateway.gone = {f'conn-{i}' for i in range(int(connections * gone_rate))}
+    results.append(measure('send', [lambda i=i: send_message(message_event(i), None)
+                                    for i in range(messages)]))
+    posts = gateway.posts
+    broadcast = measure('broadcast', [lambda i=i: utils.broadcast_message(
+        'bench', {'room': ROOM, 'content': f'broadcast {i}'}, send_message_event) for i in range(messages)])
+    broadcast['deliveries_per_second'] = (gateway.posts - posts) / (broadcast['count'] / broadcast['per_second'])
+    results.append(broadcast)
+    # History is asked for by connections still alive, gone ones are the lowest numbered
+    results.append(measure('history', [
+        lambda i=i: get_recent_messages(message_event(connections - 1 - i % connections, 'getrecentmessages'), None)
+        for i in range(messages)]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--connections', default='10,1000,10000', help='comma separated room sizes')
+    parser.add_argument('--messages', type=int, default=20, help='messages sent per room size')
+    parser.add_argument('--db-latency-ms', type=float, default=0.0)
+    parser.add_argument('--gateway-latency-ms', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of failing table and gateway calls')
+    parser.add_argument('--gone-rate', type=float, default=0.0, help='share of connections gone before sending')
+    args = parser.parse_args()
+
+    print('{:>11} {:<10} {:>7} {:>12} {:>9} {:>9} {:>7} {:>14}'.format(
+        'connections', 'operation', 'count', 'ops/s', 'p50 ms', 'p99 ms', 'errors', 'deliveries/s'))
+    for connections in (int(x) for x in args.connections.split(',')):
+        for result in run_scenario(connections, args.messages, args.db_latency_ms / 1000,
+                                   args.gateway_latency_ms / 1000, args.failure_rate, args.gone_rate):
+            print('{:>11} {:<10} {:>7} {:>12.1f} {:>9.3f} {:>9.3f} {:>7} {:>14}'.format(
+                connections, result['operation'], result['count'], result['per_second'],
+                result.get('p50_ms', 0), result.get('p99_ms', 0), result['errors'],
+                '{:.0f}'.format(result['deliveries_per_second']) if 'deliveries_per_second' in result else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Throughput of the self-hosted runtime against the lambda path.
+
+The self-hosted run starts local_server in-process with in-memory storage,
+connects real WebSocket clients to one room and sends messages through
+them, a message counts as delivered once every client has read it.
+The lambda run drives send_message with the same in-memory tables and
+models what the self-hosted runtime saves: every invocation pays
+--invoke-overhead-ms (api gateway to lambda) and every post_to_connection
+pays --post-latency-ms (management api round trip).
+
+Usage:
+    python -m chat_backend.benchmarks.runtime_comparison [--connections 10,100,500] [--messages 50]
+        [--invoke-overhead-ms 15] [--post-latency-ms 10]
+"""
+import argparse
+import asyncio
+import json
+import time
+from chat_backend.benchmarks import use_script_environment
+
+if __name__ == '__main__':
+    use_script_environment()
+
+from chat_backend.benchmarks import load_test  # noqa: E402
+from chat_backend.local_server.server import ChatServer  # noqa: E402
+import aws_resources  # noqa: E402
+import utils  # noqa: E402
+from app import send_message  # noqa: E402
+
+try:
+    from websockets.asyncio.client import connect
+except ImportError:
+    connect = None
+
+
+def summarize(runtime, connections, latencies, elapsed):
+    return dict(utils.summarize_latencies(latencies), runtime=runtime, connections=connections,
+                per_second=len(latencies) / elapsed if elapsed else 0.0,
+                deliveries_per_second=len(latencies) * connections / elapsed if elapsed else 0.0)
+
+
+def run_lambda(connections, messages, invoke_overhead=0.0, post_latency=0.0):
+    """Send messages through send_message with modelled invocation and management api latency"""
+    load_test.install_fakes(gateway_latency=post_latency)
+    for i in range(connections):
+        load_test.connection_manager(load_test.connect_event(i), None)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(messages):
+        call_started = time.perf_counter()
+        time.sleep(invoke_overhead)
+        send_message(load_test.message_event(i), None)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize('lambda', connections, latencies, time.perf_counter() - started)
+
+
+async def run_local(connections, messages):
+    """Send messages through real sockets of the self-hosted runtime"""
+    aws_resources.clear_cache()
+    load_test.history_cache.clear()
+    load_test.utils._index_blocks.clear()
+    load_test.utils._connection_items.clear()
+    server = await ChatServer(port=0).start()
+    url = 'ws://{}/?room={}'.format(server.domain_name, load_test.ROOM)
+    clients = [await connect(url, max_queue=None) for _ in range(connections)]
+    try:
+        latencies = []
+        started = time.perf_counter()
+        for i in range(messages):
+            call_started = time.perf_counter()
+            await clients[i % connections].send(json.dumps(
+                {'action': 'sendmessage', 'room': load_test.ROOM, 'content': f'local message {i}'}))
+            await asyncio.gather(*(client.recv() for client in clients))
+            latencies.append(time.perf_counter() - call_started)
+        return summarize('local', connections, latencies, time.perf_counter() - started)
+    finally:
+        await asyncio.gather(*(client.close() for client in clients))
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--connections', default='10,100,500', help='comma separated room sizes')
+    parser.add_argument('--messages', type=int, default=50, help='messages sent per room size')
+    parser.add_argument('--invoke-overhead-ms', type=float, default=15.0,
+                        help='api gateway to lambda overhead added to every message')
+    parser.add_argument('--post-latency-ms', type=float, default=10.0,
+                        help='management api round trip of every post_to_connection')
+    args = parser.parse_args()
+    if connect is None:
+        parser.error('websockets package is required, see local_server/requirements.txt')
+
+    print('{:>11} {:<8} {:>7} {:>10} {:>9} {:>9} {:>14}'.format(
+        'connections', 'runtime', 'count', 'msgs/s', 'p50 ms', 'p99 ms', 'deliveries/s'))
+    for connections in (int(x) for x in args.connections.split(',')):
+        results = [run_lambda(connections, args.messages, args.invoke_overhead_ms / 1000,
+                              args.post_latency_ms / 1000),
+                   asyncio.run(run_local(connections, args.messages))]
+        for result in results:
+            print('{:>11} {:<8} {:>7} {:>10.1f} {:>9.3f} {:>9.3f} {:>14.0f}'.format(
+                connections, result['runtime'], result['count'], result['per_second'],
+                result['p50_ms'], result['p99_ms'], result['deliveries_per_second']))
+
+
+if __name__ == '__main__':
+    main()
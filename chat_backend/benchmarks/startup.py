@@ -0,0 +1,87 @@
+"""
+Cold start benchmark of the chat lambdas.
+
+Every run starts a fresh interpreter, imports the handler module the way
+the lambda runtime does and invokes the handler twice with a sample event.
+Reported are the import time, the first (cold) and the second (warm)
+invocation latency. AWS calls are answered locally with canned responses,
+so resource and client creation is measured but no request leaves the machine.
+
+Usage:
+    python -m chat_backend.benchmarks.startup [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from chat_backend.tests.unit.test_data import web_socket_connect_event, send_message_event
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+SHARED_DIR = os.path.join(BASE_DIR, 'shared')
+
+# name: (module, handler, sys.path of the function, event)
+HANDLERS = {
+    'connection_manager': ('chat_backend.ws_connection.app', 'connection_manager',
+                           [ROOT_DIR, os.path.join(BASE_DIR, 'ws_connection'), SHARED_DIR],
+                           web_socket_connect_event),
+    'send_message': ('app', 'send_message',
+                     [os.path.join(BASE_DIR, 'message'), SHARED_DIR],
+                     send_message_event),
+}
+
+# Executed in a fresh interpreter, reads its settings as json from stdin
+CHILD = '''
+import importlib, json, sys, time
+settings = json.load(sys.stdin)
+sys.path[:0] = settings['path']
+
+from botocore.client import BaseClient
+CANNED = {'Query': {'Items': []}, 'Scan': {'Items': []},
+          'UpdateItem': {'Attributes': {'next_index': 1}}}
+BaseClient._make_api_call = lambda self, operation, params: CANNED.get(operation, {})
+
+started = time.perf_counter()
+module = importlib.import_module(settings['module'])
+imported = time.perf_counter()
+handler = getattr(module, settings['handler'])
+handler(settings['event'], None)
+first = time.perf_counter()
+handler(settings['event'], None)
+second = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000,
+                  'first_invocation_ms': (first - imported) * 1000,
+                  'warm_invocation_ms': (second - first) * 1000}))
+'''
+
+
+def run_once(module, handler, path, event):
+    """Runs handler in a fresh interpreter and returns its timings"""
+    env = dict(os.environ, AWS_DEFAULT_REGION='us-east-2', AWS_ACCESS_KEY_ID='bench',
+               AWS_SECRET_ACCESS_KEY='bench', CONNECTION_TABLE_NAME='bench_connections',
+               MESSAGE_TABLE_NAME='bench_messages')
+    settings = json.dumps({'module': module, 'handler': handler, 'path': path, 'event': event})
+    output = subprocess.run([sys.executable, '-c', CHILD], input=settings, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per handler')
+    args = parser.parse_args()
+
+    print('{:<20} {:>12} {:>22} {:>21}'.format('handler', 'import ms', 'first invocation ms',
+                                              'warm invocation ms'))
+    for name, (module, handler, path, event) in HANDLERS.items():
+        runs = [run_once(module, handler, path, event) for _ in range(args.runs)]
+        medians = [statistics.median(run[key] for run in runs)
+                   for key in ('import_ms', 'first_invocation_ms', 'warm_invocation_ms')]
+        print('{:<20} {:>12.1f} {:>22.1f} {:>21.1f}'.format(name, *medians))
+
+
+if __name__ == '__main__':
+    main()
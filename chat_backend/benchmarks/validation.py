@@ -0,0 +1,85 @@
+"""
+Per event parse and validate cost.
+
+The sample events of tests/unit/test_data.py, plus an oversized and a
+malformed message, go through the checks handlers run before any I/O:
+the compiled validation layer with every available json codec, and the
+former path of json.loads with an isinstance check for comparison.
+
+Usage:
+    python -m chat_backend.benchmarks.validation [--number 20000]
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import timeit
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'shared'))
+
+import validation  # noqa: E402
+from chat_backend.tests.unit.test_data import web_socket_connect_event, send_message_event, room_data  # noqa: E402
+
+
+def build_events():
+    connect_to_room = dict(copy.deepcopy(web_socket_connect_event), **room_data)
+    oversized = dict(send_message_event, body=json.dumps({'action': 'sendmessage', 'content': 'x' * 64 * 1024}))
+    malformed = dict(send_message_event, body='{"action": "sendmessage", "content": ')
+    return {
+        'send message': (send_message_event, validation.EVENT, validation.SEND_MESSAGE),
+        'oversized message': (oversized, validation.EVENT, validation.SEND_MESSAGE),
+        'malformed message': (malformed, validation.EVENT, validation.SEND_MESSAGE),
+        'connect': (web_socket_connect_event, validation.CONNECTION_EVENT, None),
+        'connect to room': (connect_to_room, validation.CONNECTION_EVENT, None),
+    }
+
+
+def check(event, event_schema, body_schema):
+    """Run the checks a handler runs, returns whether the event passes"""
+    try:
+        validation.validate_event(event, event_schema)
+        if body_schema is None:
+            validation.validate_query(event)
+        else:
+            validation.parse_body(event, body_schema)
+        return True
+    except ValueError:
+        return False
+
+
+def check_former(event, event_schema, body_schema):
+    """Body decoding and dict check handlers ran before the validation layer"""
+    if body_schema is None:
+        return True
+    try:
+        body = json.loads(event.get('body', ''))
+    except:  # noqa: E722
+        return False
+    return isinstance(body, dict)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000, help='checks timed per event and path')
+    args = parser.parse_args()
+
+    codecs = ['json'] + (['orjson'] if validation.orjson is not None else [])
+    print('{:<18} {:<10} {:>7} {:>10}'.format('event', 'path', 'passes', 'us/event'))
+    for name, (event, event_schema, body_schema) in build_events().items():
+        paths = [('former', check_former)]
+        paths += [(codec, check) for codec in codecs]
+        for path, run in paths:
+            if path in codecs:
+                validation.use_codec(path)
+            passes = run(event, event_schema, body_schema)
+            seconds = timeit.timeit(lambda: run(event, event_schema, body_schema), number=args.number)
+            print('{:<18} {:<10} {:>7} {:>10.2f}'.format(name, path, 'yes' if passes else 'no',
+                                                       seconds / args.number * 1e6))
+    if validation.orjson is None:
+        print('orjson is not installed, its codec is skipped')
+
+
+if __name__ == '__main__':
+    main()
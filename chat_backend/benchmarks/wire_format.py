@@ -0,0 +1,53 @@
+"""
+Size and encode time of frames in every wire encoding.
+
+Frames measured are a single broadcast message, a history response and a
+full sync page built from the sample message of tests/unit/test_data.py.
+
+Usage:
+    python -m chat_backend.benchmarks.wire_format [--number 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'shared'))
+
+import wire_format  # noqa: E402
+from chat_backend.tests.unit.test_data import send_message_event  # noqa: E402
+
+CONTENT = json.loads(send_message_event['body'])['content']
+
+
+def build_frames():
+    message = {'username': 'Mate', 'content': CONTENT}
+    return {
+        'broadcast': {'messages': message},
+        'history (10)': {'messages': [dict(message, username=f'user_{i}') for i in range(10)]},
+        'sync page (50)': {'messages': [dict(message, username=f'user_{i}') for i in range(50)],
+                           'cursor': 1049, 'more': True},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=2000, help='encodings timed per frame and format')
+    args = parser.parse_args()
+
+    print('{:<16} {:<10} {:>8} {:>10} {:>12}'.format('frame', 'encoding', 'bytes', 'vs json', 'encode us'))
+    for frame_name, frame in build_frames().items():
+        json_size = len(wire_format.encode(frame, 'json'))
+        for encoding in wire_format.ENCODERS:
+            size = len(wire_format.encode(frame, encoding))
+            seconds = timeit.timeit(lambda: wire_format.encode(frame, encoding), number=args.number)
+            print('{:<16} {:<10} {:>8} {:>9.0%} {:>12.1f}'.format(
+                frame_name, encoding, size, size / json_size, seconds / args.number * 1e6))
+    if wire_format.msgpack is None:
+        print('msgpack is not installed, its encoding is skipped')
+
+
+if __name__ == '__main__':
+    main()
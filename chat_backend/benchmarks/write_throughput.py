@@ -0,0 +1,100 @@
+"""
+Sustained write throughput of one room with sharded message partitions.
+
+Writers store messages to a single room through put_message_to_db for a
+fixed time. The in-memory message table models DynamoDB partition capacity:
+every partition key sustains --partition-wcu writes per second and writes
+above it are throttled and retried. With one shard the room is capped by
+its single partition, with N shards writes spread over N partitions.
+
+The room index counter is a partition of its own and is written once per
+reserved block, keep --block-size well above 1 or the counter becomes the
+bottleneck no matter how many shards there are.
+
+Usage:
+    python -m chat_backend.benchmarks.write_throughput [--shards 1,2,4,8] [--partition-wcu 100]
+        [--writers 16] [--duration 3] [--block-size 50]
+"""
+import argparse
+import os
+import threading
+import time
+from chat_backend.benchmarks import use_script_environment
+
+if __name__ == '__main__':
+    use_script_environment()
+
+from botocore.exceptions import ClientError  # noqa: E402
+from chat_backend.benchmarks import load_test  # noqa: E402
+from chat_backend.benchmarks.fakes import build_message_table  # noqa: E402
+import aws_resources  # noqa: E402
+import utils  # noqa: E402
+
+ROOM = 'busy'
+# Seconds writers run before writes are counted, the partitions spend their one second burst
+WARMUP = 1.0
+# Seconds a writer waits after being throttled
+RETRY_DELAY = 0.005
+
+
+def run_writers(shards, partition_wcu, writers, duration, block_size):
+    """
+    Write to one room from concurrent writers.
+    Returns:
+        dict - counted writes per second overall and per partition, throttled writes and read check
+    """
+    load_test.install_fakes()
+    table = build_message_table(os.environ['MESSAGE_TABLE_NAME'], partition_wcu=partition_wcu)
+    aws_resources.register_table(table.name, table)
+    utils.MESSAGE_ROOM_SHARDS[ROOM] = shards
+    utils.MESSAGE_INDEX_BLOCK_SIZE = block_size
+    started = time.perf_counter()
+    counted_from, deadline = started + WARMUP, started + WARMUP + duration
+    written = [0] * writers
+
+    def write(number):
+        while time.perf_counter() < deadline:
+            try:
+                utils.put_message_to_db('bench', {'room': ROOM, 'content': 'message of writer {}'.format(number)})
+            except ClientError as err:
+                if err.response['Error']['Code'] != 'ProvisionedThroughputExceededException':
+                    raise
+                time.sleep(RETRY_DELAY)
+                continue
+            if time.perf_counter() >= counted_from:
+                written[number] += 1
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Readers merge shards back into index order
+    load_test.history_cache.clear()
+    recent = [x['index'] for x in utils.get_recent_history(ROOM)]
+    stored = sorted(item['index'] for item in table.items() if not item['room'].startswith(utils.INDEX_COUNTER_PREFIX))
+    return {'shards': shards, 'per_second': sum(written) / duration,
+            'per_partition': sum(written) / duration / shards, 'throttled': table.throttled,
+            'ordered': recent == stored[-len(recent):]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shards', default='1,2,4,8', help='comma separated shard counts of the room')
+    parser.add_argument('--partition-wcu', type=float, default=100.0, help='writes per second of one partition')
+    parser.add_argument('--writers', type=int, default=16, help='concurrent writer threads')
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds writes are counted')
+    parser.add_argument('--block-size', type=int, default=50, help='message indexes reserved per counter update')
+    args = parser.parse_args()
+
+    print('{:>6} {:>10} {:>15} {:>10} {:>8}'.format('shards', 'writes/s', 'per partition', 'throttled', 'ordered'))
+    for shards in (int(x) for x in args.shards.split(',')):
+        result = run_writers(shards, args.partition_wcu, args.writers, args.duration, args.block_size)
+        print('{:>6} {:>10.1f} {:>15.1f} {:>10} {:>8}'.format(
+            result['shards'], result['per_second'], result['per_partition'], result['throttled'],
+            'yes' if result['ordered'] else 'NO'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+Self-hosted WebSocket runtime of the chat handlers.
+
+Runs the lambda handlers in-process behind an asyncio WebSocket server.
+Every socket event becomes the api gateway event the handler would get:
+$connect and $disconnect go to connection_manager, messages are routed by
+their "action" field the way RouteSelectionExpression $request.body.action
+does. The management api is replaced by SocketGateway, which writes frames
+straight to open sockets, and storage is pluggable: in-memory tables or
+the DynamoDB tables named in the environment.
+
+Requires the websockets package (see requirements.txt).
+
+Usage:
+    python -m chat_backend.local_server.server [--host 127.0.0.1] [--port 8765] [--storage memory]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+
+from botocore.exceptions import ClientError
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if __name__ == '__main__':
+    # Run as a script, lambda code is put on the import path the way runtests.py does it
+    sys.path[:0] = [os.path.join(BASE_DIR, 'message'), os.path.join(BASE_DIR, 'shared')]
+
+import aws_resources  # noqa: E402
+import metrics  # noqa: E402
+from app import (send_message, get_recent_messages, sync_messages, direct_message, get_presence,  # noqa: E402
+                 heartbeat, default_message)
+from chat_backend.ws_connection.app import connection_manager  # noqa: E402
+
+try:
+    from websockets.asyncio.server import serve
+    from websockets.exceptions import ConnectionClosed
+except ImportError:
+    serve = None
+    ConnectionClosed = ConnectionError
+
+logger = logging.getLogger("local_server")
+
+STAGE = 'local'
+# Message routes by body action, unknown actions go to $default
+ROUTES = {
+    'sendmessage': send_message,
+    'getrecentmessages': get_recent_messages,
+    'syncmessages': sync_messages,
+    'directmessage': direct_message,
+    'getpresence': get_presence,
+    'heartbeat': heartbeat,
+}
+HANDLER_THREADS = int(os.environ.get('LOCAL_SERVER_HANDLER_THREADS', 64))
+
+
+def gone(operation='PostToConnection'):
+    return ClientError({'Error': {'Code': 'GoneException', 'Message': 'Gone'}}, operation)
+
+
+class SocketGateway:
+    """Management api writing frames directly to sockets open in this process"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.sockets = {}
+
+    def post_to_connection(self, ConnectionId, Data):
+        websocket = self.sockets.get(ConnectionId)
+        if websocket is None:
+            raise gone()
+        if isinstance(Data, (bytes, bytearray)):
+            try:
+                Data = Data.decode('utf-8')
+            except UnicodeDecodeError:
+                pass
+        future = asyncio.run_coroutine_threadsafe(websocket.send(Data), self.loop)
+        try:
+            future.result()
+        except ConnectionClosed:
+            raise gone()
+        return {}
+
+    def get_connection(self, ConnectionId):
+        if ConnectionId not in self.sockets:
+            raise gone('GetConnection')
+        return {}
+
+    def delete_connection(self, ConnectionId):
+        websocket = self.sockets.get(ConnectionId)
+        if websocket is None:
+            raise gone('DeleteConnection')
+        asyncio.run_coroutine_threadsafe(websocket.close(), self.loop)
+        return {}
+
+
+def use_memory_storage():
+    """Serve connection and message tables from memory"""
+    from chat_backend.benchmarks.fakes import build_connection_table, build_message_table
+    for table in (build_connection_table(os.environ['CONNECTION_TABLE_NAME']),
+                  build_message_table(os.environ['MESSAGE_TABLE_NAME'])):
+        aws_resources.register_table(table.name, table)
+
+
+def use_dynamodb_storage():
+    """Use DynamoDB tables named by CONNECTION_TABLE_NAME and MESSAGE_TABLE_NAME, dropping registered stand-ins"""
+    aws_resources.clear_cache()
+
+
+STORAGES = {'memory': use_memory_storage, 'dynamodb': use_dynamodb_storage}
+
+
+class ChatServer:
+    """
+    Routes socket events to the chat handlers.
+    Args:
+        host: str - interface to listen on
+        port: int - port to listen on, 0 picks a free one
+        storage: str - key of STORAGES
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, storage='memory'):
+        if serve is None:
+            raise RuntimeError('websockets package is required to run the local server')
+        self.host = host
+        self.port = port
+        self.storage = storage
+        self.executor = ThreadPoolExecutor(max_workers=HANDLER_THREADS)
+        self.gateway = None
+        self.server = None
+
+    @property
+    def domain_name(self):
+        return '{}:{}'.format(self.host, self.port)
+
+    def build_event(self, route_key, event_type, connection_id, body=None, query=None):
+        """Build the event api gateway would pass to the handler"""
+        now = int(time.time() * 1000)
+        return {'requestContext': {'routeKey': route_key, 'eventType': event_type,
+                                   'connectionId': connection_id, 'domainName': self.domain_name,
+                                   'stage': STAGE, 'apiId': 'local', 'messageDirection': 'IN',
+                                   'requestId': uuid.uuid4().hex, 'requestTimeEpoch': now,
+                                   'connectedAt': now},
+                'queryStringParameters': query or None,
+                'body': body,
+                'isBase64Encoded': False}
+
+    async def invoke(self, handler, event):
+        """Run blocking handler in the handler thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, handler, event, None)
+
+    def route(self, body):
+        try:
+            action = json.loads(body).get('action')
+        except (ValueError, AttributeError):
+            action = None
+        if action in ROUTES:
+            return action, ROUTES[action]
+        return '$default', default_message
+
+    async def handle(self, websocket):
+        connection_id = uuid.uuid4().hex
+        query = dict(parse_qsl(urlsplit(websocket.request.path).query))
+        response = await self.invoke(connection_manager,
+                                     self.build_event('$connect', 'CONNECT', connection_id, query=query))
+        if response.get('statusCode') != 200:
+            await websocket.close(code=1008, reason=str(response.get('body'))[:120])
+            return
+        self.gateway.sockets[connection_id] = websocket
+        try:
+            async for body in websocket:
+                if isinstance(body, bytes):
+                    body = body.decode('utf-8', errors='replace')
+                route_key, handler = self.route(body)
+                response = await self.invoke(handler, self.build_event(route_key, 'MESSAGE', connection_id, body))
+                if response.get('statusCode', 200) >= 400:
+                    logger.info('%s for %s answered %s', route_key, connection_id, response)
+        except ConnectionClosed:
+            pass
+        finally:
+            self.gateway.sockets.pop(connection_id, None)
+            await self.invoke(connection_manager, self.build_event('$disconnect', 'DISCONNECT', connection_id))
+
+    async def start(self):
+        STORAGES[self.storage]()
+        self.gateway = SocketGateway(asyncio.get_running_loop())
+        self.server = await serve(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        aws_resources.register_gateway_client('https://{}/{}'.format(self.domain_name, STAGE), self.gateway)
+        logger.info('Chat server listening on ws://%s', self.domain_name)
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+
+async def run(host, port, storage):
+    server = await ChatServer(host, port, storage).start()
+    try:
+        await asyncio.Future()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--storage', choices=sorted(STORAGES), default='memory')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    os.environ.setdefault('CONNECTION_TABLE_NAME', 'chat_connections')
+    os.environ.setdefault('MESSAGE_TABLE_NAME', 'chat_messages')
+    # Metrics lines are meant for CloudWatch, keep the console quiet unless asked for
+    if 'METRICS_SAMPLE_RATE' not in os.environ:
+        metrics.METRICS_SAMPLE_RATE = 0
+    try:
+        asyncio.run(run(args.host, args.port, args.storage))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
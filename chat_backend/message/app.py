@@ -1,12 +1,22 @@
 import logging
-from utils import (build_response, send_to_connection,
-    get_message_table, get_body, build_message_index, put_message_to_db, broadcast_message,
-                   validate_event, validate_body)
+from utils import (build_response, send_to_connection, send_frame,
+    get_message_table, get_body, build_message_index, build_message_item, broadcast_message,
+                   build_message_entry, validate_event, get_room, get_recent_history,
+                   get_sync_cursor, send_sync_pages, send_direct_message,
+                   get_connection_username, get_room_presence, refresh_connection_expiry,
+                   touch_connection, ask_to_reconnect)
+from validation import SEND_MESSAGE, DIRECT_MESSAGE, ROOM_REQUEST, SYNC_REQUEST
+from batching import message_batcher
+from persistence import enqueue_message, DURABILITY_MODE, PERSIST
+from rate_limit import check_rate
+from sweeper import sweep
+from metrics import instrumented, stage
 
 logger = logging.getLogger("handler_logger")
 logger.setLevel(logging.DEBUG)
 
 
+@instrumented('default_message')
 def default_message(event, context):
     """
     Send back error when unrecognized WebSocket action is received.
@@ -15,9 +25,10 @@ def default_message(event, context):
     return build_response(400, "Unrecognized WebSocket action.")
 
 
+@instrumented('get_recent_messages')
 def get_recent_messages(event, context):
     """
-    Return the 10 most recent chat messages.
+    Return the most recent chat messages of the room given in body.
     """
     connectionID = event["requestContext"].get("connectionId")
     logger.info("Retrieving most recent messages for CID '{}'" \
@@ -27,27 +38,154 @@ def get_recent_messages(event, context):
     if not connectionID:
         logger.error("Failed: connectionId value not set.")
         return build_response(500, "connectionId value not set.")
+    try:
+        with stage('Validate'):
+            validate_event(event)
+            room = get_room(get_body(event, ROOM_REQUEST))
+    except ValueError as v_er:
+        return build_response(400, f'Event or body are not in correct shape or format:({v_er})')
 
-    # Get the 10 most recent chat messages
-    table = get_message_table()
-    response = table.query(KeyConditionExpression="Room = :room",
-                           ExpressionAttributeValues={":room": "general"},
-                           Limit=10, ScanIndexForward=False)
-    items = response.get("Items", [])
+    try:
+        touch_connection(connectionID, event['requestContext'].get('connectedAt'))
+    except LookupError as l_er:
+        return ask_to_reconnect(connectionID, l_er, event)
 
-    # Extract the relevant data and order chronologically
-    messages = [{"username": x["Username"], "content": x["Content"]}
-                for x in items]
-    messages.reverse()
+    # Get the most recent chat messages ordered chronologically
+    with stage('History'):
+        messages = [build_message_entry(x["username"], x["content"], x["index"])
+                    for x in get_recent_history(room)]
 
     # Send them to the client who asked for it
-    data = {"messages": messages}
-    send_to_connection(connectionID, data, event)
+    with stage('Send'):
+        send_frame(connectionID, {"messages": messages}, event)
 
     return build_response(200, "Sent recent messages to '{}'." \
                          .format(connectionID))
 
 
+@instrumented('sync_messages')
+def sync_messages(event, context):
+    """
+    Send messages stored after the index the client saw last.
+    Messages are sent in size capped pages, every page carries the cursor to
+    continue from and whether more messages are waiting.
+    """
+    connectionID = event["requestContext"].get("connectionId")
+    if not connectionID:
+        logger.error("Failed: connectionId value not set.")
+        return build_response(500, "connectionId value not set.")
+    try:
+        with stage('Validate'):
+            validate_event(event)
+            body = get_body(event, SYNC_REQUEST)
+            room = get_room(body)
+            since = get_sync_cursor(body)
+    except ValueError as v_er:
+        return build_response(400, f'Event or body are not in correct shape or format:({v_er})')
+
+    try:
+        touch_connection(connectionID, event['requestContext'].get('connectedAt'))
+    except LookupError as l_er:
+        return ask_to_reconnect(connectionID, l_er, event)
+
+    logger.info("Syncing room '{}' after index {} for CID '{}'".format(room, since, connectionID))
+
+    sent, cursor, more = send_sync_pages(connectionID, room, since, event)
+    return build_response(200, {"pages": sent, "cursor": cursor, "more": more})
+
+
+@instrumented('direct_message')
+def direct_message(event, context):
+    """
+    Send message to all connections of the user named in body "to" field.
+    Connections are looked up by username index, not by scanning connections.
+    """
+    connectionID = event["requestContext"].get("connectionId")
+    if not connectionID:
+        logger.error("Failed: connectionId value not set.")
+        return build_response(500, "connectionId value not set.")
+    try:
+        with stage('Validate'):
+            validate_event(event)
+            body = get_body(event, DIRECT_MESSAGE)
+    except ValueError as v_er:
+        return build_response(400, f'Event or body are not in correct shape or format:({v_er})')
+
+    try:
+        touch_connection(connectionID, event['requestContext'].get('connectedAt'))
+    except LookupError as l_er:
+        return ask_to_reconnect(connectionID, l_er, event)
+
+    sender = get_connection_username(connectionID)
+    if sender is None:
+        return build_response(403, "Unknown connection '{}'.".format(connectionID))
+    logger.info("Direct message from '{}' to '{}'".format(sender, body['to']))
+    with stage('Deliver'):
+        return send_direct_message(sender, body, event)
+
+
+@instrumented('get_presence')
+def get_presence(event, context):
+    """
+    Send usernames of users online in the room given in body.
+    """
+    connectionID = event["requestContext"].get("connectionId")
+    if not connectionID:
+        logger.error("Failed: connectionId value not set.")
+        return build_response(500, "connectionId value not set.")
+    try:
+        with stage('Validate'):
+            validate_event(event)
+            room = get_room(get_body(event, ROOM_REQUEST))
+    except ValueError as v_er:
+        return build_response(400, f'Event or body are not in correct shape or format:({v_er})')
+
+    try:
+        touch_connection(connectionID, event['requestContext'].get('connectedAt'))
+    except LookupError as l_er:
+        return ask_to_reconnect(connectionID, l_er, event)
+
+    with stage('PresenceQuery'):
+        users = get_room_presence(room)
+    with stage('Send'):
+        send_frame(connectionID, {"presence": {"room": room, "users": users}}, event)
+    return build_response(200, "Sent {} online users of '{}'.".format(len(users), room))
+
+
+@instrumented('heartbeat')
+def heartbeat(event, context):
+    """
+    Keep connection row alive. Clients send it more often than CONNECTION_TTL,
+    a client whose row has expired is told to reconnect.
+    """
+    connectionID = event["requestContext"].get("connectionId")
+    if not connectionID:
+        logger.error("Failed: connectionId value not set.")
+        return build_response(500, "connectionId value not set.")
+    try:
+        with stage('Validate'):
+            validate_event(event)
+    except ValueError as v_er:
+        return build_response(400, f'Event or body are not in correct shape or format:({v_er})')
+
+    try:
+        with stage('Refresh'):
+            expires = refresh_connection_expiry(connectionID)
+    except LookupError as l_er:
+        return ask_to_reconnect(connectionID, l_er, event)
+    return build_response(200, {"expiresAt": expires})
+
+
+@instrumented('sweep_connections')
+def sweep_connections(event, context):
+    """
+    Scheduled removal of expired and gone connection rows.
+    """
+    summary = sweep()
+    return build_response(200, summary)
+
+
+@instrumented('send_message')
 def send_message(event, context):
     """
     When a message is sent on the socket, verify the passed in token,
@@ -56,17 +194,53 @@ def send_message(event, context):
     logger.info('Message sent on WebSocket.')
     # Ensure all required fields were provided
     try:
-        validate_event(event)
-        body = get_body(event)
-        validate_body(body)
+        with stage('Validate'):
+            validate_event(event)
+            body = get_body(event, SEND_MESSAGE)
+            room = get_room(body)
     except ValueError as v_er:
         return build_response(400, f'Event or body are not in correct shape or format:({v_er})')
 
+    connectionID = event["requestContext"].get("connectionId")
+    # Any action of the client keeps its connection row alive, not only heartbeats
+    try:
+        touch_connection(connectionID, event['requestContext'].get('connectedAt'))
+    except LookupError as l_er:
+        return ask_to_reconnect(connectionID, l_er, event)
+
+    # Chatty senders are turned away before their message costs any fan-out
+    limited = check_rate(connectionID, room)
+    if limited is not None:
+        logger.info("Rate limit of {} exceeded by CID '{}'".format(limited['scope'], connectionID))
+        with stage('Send'):
+            send_frame(connectionID, {'slow_down': limited}, event)
+        return build_response(429, dict(error='slow_down', **limited))
+
     # Todo: fix hardcode once username is known
     username = 'Mate'
-    put_message_to_db(username, body)
-    logger.debug('Broadcasting message: {}'.format(body['content']))
-    return broadcast_message(username, body, event)
+    # Message is stored by the persistence stage while it is broadcast
+    item = build_message_item(username, body)
+    with stage('Enqueue'):
+        stored = enqueue_message(room, item)
+    if message_batcher.enabled:
+        logger.debug('Batching message: {}'.format(body['content']))
+        with stage('Broadcast'):
+            summary = message_batcher.submit(room, build_message_entry(username, body['content'], item['index']), event)
+        response = build_response(200, dict(
+            message='Message sent to {} connections in a batch of {}.'.format(summary['sent'], summary['batched']),
+            delivery=message_batcher.stats(), **summary))
+    else:
+        logger.debug('Broadcasting message: {}'.format(body['content']))
+        with stage('Broadcast'):
+            response = broadcast_message(username, body, event, item['index'])
+    if DURABILITY_MODE == PERSIST:
+        try:
+            with stage('Persist'):
+                stored.result()
+        except Exception as err:
+            logger.error('Failed to store message: {}'.format(err))
+            return build_response(500, 'Message was sent but not stored.')
+    return response
 
     # for attribute in ['token', 'content']:
     #     if attribute not in body:
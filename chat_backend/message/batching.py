@@ -0,0 +1,115 @@
+"""
+Coalescing of room messages into one frame per connection.
+
+Messages of a room submitted within BATCH_WINDOW_MS of the first pending
+one, or until BATCH_MAX_MESSAGES are pending, are delivered together as a
+single {"messages": [...]} frame, so N messages cost one post per member
+instead of N. The first sender of a batch waits for the window and
+delivers it, later senders wait for that delivery.
+
+Senders are only merged when they share a process, e.g. handlers run by
+the threads of a long running server. A lambda container handles one
+invocation at a time, so there every batch holds a single message and the
+window only adds latency; keep batching disabled (window 0) there.
+"""
+import os
+import threading
+import time
+from collections import deque
+from utils import deliver_to_room, build_batch_frame, summarize_latencies
+
+BATCH_WINDOW_MS = float(os.environ.get('BATCH_WINDOW_MS', 0))
+BATCH_MAX_MESSAGES = int(os.environ.get('BATCH_MAX_MESSAGES', 25))
+# Number of most recent message to delivery latencies kept for statistics
+LATENCY_SAMPLES = 1000
+
+
+class _Batch:
+    """Messages of one room waiting for delivery"""
+
+    def __init__(self, event):
+        self.event = event
+        self.messages = []
+        self.submitted = []
+        self.closed = threading.Event()
+        self.delivered = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MessageBatcher:
+    """
+    Collects messages per room and delivers each batch with one call.
+    Args:
+        deliver: callable(room, messages, event) - sends batch, its result is returned to all senders
+        window: float - seconds to wait for more messages after the first one
+        max_messages: int - batch is delivered immediately when it reaches this size
+    """
+
+    def __init__(self, deliver, window=BATCH_WINDOW_MS / 1000, max_messages=BATCH_MAX_MESSAGES,
+                 clock=time.monotonic):
+        self.deliver = deliver
+        self.window = window
+        self.max_messages = max_messages
+        self.clock = clock
+        self.batches = 0
+        self._pending = {}
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def submit(self, room, message, event):
+        """
+        Add message to the pending batch of the room and wait until it is delivered.
+        Returns:
+            result of deliver for the batch the message went out with
+        """
+        with self._lock:
+            batch = self._pending.get(room)
+            leader = batch is None
+            if leader:
+                batch = self._pending[room] = _Batch(event)
+            batch.messages.append(message)
+            batch.submitted.append(self.clock())
+            if len(batch.messages) >= self.max_messages:
+                # New messages of the room start the next batch
+                self._pending.pop(room)
+                batch.closed.set()
+
+        if not leader:
+            batch.delivered.wait()
+        else:
+            batch.closed.wait(self.window)
+            with self._lock:
+                if self._pending.get(room) is batch:
+                    self._pending.pop(room)
+            try:
+                batch.result = self.deliver(room, batch.messages, batch.event)
+            except Exception as err:
+                batch.error = err
+            finally:
+                delivered = self.clock()
+                with self._lock:
+                    self.batches += 1
+                    self._latencies.extend(delivered - submitted for submitted in batch.submitted)
+                batch.delivered.set()
+        if batch.error is not None:
+            raise batch.error
+        return dict(batch.result, batched=len(batch.messages))
+
+    def stats(self):
+        """Returns number of delivered batches and message to delivery latency statistics"""
+        with self._lock:
+            latencies = list(self._latencies)
+        return {'batches': self.batches, 'delivery_latency': summarize_latencies(latencies)}
+
+
+def deliver_batch(room, messages, event):
+    """Send messages of the batch to room members as one frame"""
+    return deliver_to_room(room, build_batch_frame(messages), event)
+
+
+message_batcher = MessageBatcher(deliver_batch)
@@ -0,0 +1,93 @@
+"""
+Recent message history kept in the warm container.
+
+Every room holds a bounded buffer of its newest messages. Buffers are
+loaded from the message table on miss and dropped after HISTORY_CACHE_TTL
+seconds. Messages stored by the container itself are appended to its
+buffers, which only helps when one process both stores and serves history,
+like the self-hosted runtime. On Lambda sendmessage and getrecentmessages
+run in separate functions, so history served by a warm container misses
+messages stored after it was loaded for up to HISTORY_CACHE_TTL seconds.
+Hits and misses are counted as HistoryCacheHit and HistoryCacheMiss metrics.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+# Number of most recent messages sent to the client asking for history
+HISTORY_SIZE = int(os.environ.get('HISTORY_SIZE', 10))
+# Seconds the history of a room is served from the container without reading the table
+HISTORY_CACHE_TTL = float(os.environ.get('HISTORY_CACHE_TTL', 5))
+
+
+class HistoryCache:
+    """Per room ring buffers of newest messages ordered by index"""
+
+    def __init__(self, size=HISTORY_SIZE, ttl=HISTORY_CACHE_TTL, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def get(self, room):
+        """
+        Return cached messages of the room oldest first.
+        Returns:
+            list or None - None when the room is not cached or expired
+        """
+        with self._lock:
+            cached = self._rooms.get(room)
+            if cached is None or self.clock() - cached[0] > self.ttl:
+                self._rooms.pop(room, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(cached[1])
+
+    def fill(self, room, messages):
+        """Store messages of the room read from the table, oldest first"""
+        with self._lock:
+            self._rooms[room] = (self.clock(), deque(messages, maxlen=self.size))
+
+    def append(self, room, message):
+        """Add a message stored by this container. Rooms not cached are left to be loaded on read"""
+        with self._lock:
+            cached = self._rooms.get(room)
+            if cached is None:
+                return
+            buffer = cached[1]
+            if buffer and buffer[-1]['index'] > message['index']:
+                # Concurrent writers may store messages out of order
+                ordered = sorted(list(buffer) + [message], key=lambda x: x['index'])
+                buffer.clear()
+                buffer.extend(ordered)
+            else:
+                buffer.append(message)
+
+    def replace(self, room, index, message=None):
+        """Drop the cached message with the index, adding message in its place when given"""
+        with self._lock:
+            cached = self._rooms.get(room)
+            if cached is None:
+                return
+            buffer = cached[1]
+            ordered = [x for x in buffer if x['index'] != index] + ([message] if message is not None else [])
+            ordered.sort(key=lambda x: x['index'])
+            buffer.clear()
+            buffer.extend(ordered)
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Returns hit and miss counters"""
+        return {'hits': self.hits, 'misses': self.misses, 'rooms': len(self._rooms)}
+
+
+history_cache = HistoryCache()
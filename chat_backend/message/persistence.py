@@ -0,0 +1,232 @@
+"""
+Message persistence as a pipeline stage of its own.
+
+Accepted messages get their index and go to a queue, a worker thread drains
+it and stores them, so fan-out does not wait for the message table. Items
+waiting together are stored concurrently, up to PERSIST_BATCH_SIZE at once,
+each with the conditional put that never overwrites a stored message;
+batch_write_item cannot be conditional. When the room counter is behind the
+put recovers it and the item is stored under a new index, the future and the
+history entry of the item are updated with it. Throttled puts are retried
+with exponential backoff. Puts are recorded to the metrics of the invocation
+which submitted the item, once it has ended they are not reported.
+
+DURABILITY_MODE decides when the sender is answered:
+    persist - after the message is stored (fan-out runs meanwhile)
+    enqueue - right after the message is queued; a crash before the worker
+              writes it loses the message
+
+The queue is a queue.Queue by default, anything with its put, get and
+task_done methods can stand in for a durable queue. A lambda container is
+frozen between invocations, so there the enqueue mode only makes progress
+while some invocation runs; it is meant for long running servers.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from botocore.exceptions import ClientError
+import metrics
+from utils import store_message_item, summarize_latencies
+from history import history_cache
+
+logger = logging.getLogger("handler_logger")
+
+PERSIST = 'persist'
+ENQUEUE = 'enqueue'
+DURABILITY_MODE = os.environ.get('DURABILITY_MODE', PERSIST)
+# Most items stored concurrently
+PERSIST_BATCH_SIZE = int(os.environ.get('PERSIST_BATCH_SIZE', 25))
+# Milliseconds the worker waits for more items before writing a batch
+PERSIST_FLUSH_MS = float(os.environ.get('PERSIST_FLUSH_MS', 0))
+# Attempts of a throttled put before the item is given up
+PERSIST_MAX_ATTEMPTS = int(os.environ.get('PERSIST_MAX_ATTEMPTS', 5))
+PERSIST_RETRY_MS = float(os.environ.get('PERSIST_RETRY_MS', 50))
+# Number of most recent enqueue to store latencies kept for statistics
+LATENCY_SAMPLES = 1000
+# Errors of puts worth another attempt, others fail the item at once
+RETRYABLE_ERRORS = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'}
+
+
+class _Pending:
+    """Queued message item with the future resolved once it is stored"""
+
+    def __init__(self, room, item):
+        self.room = room
+        self.item = item
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        # Metrics of the submitting invocation, the put is recorded to it
+        self.recorder = metrics.current()
+
+
+class PersistenceQueue:
+    """
+    Stores queued message items from a worker thread.
+    Args:
+        store: callable(room, item) - stores one item conditionally, returns stored item
+        batch_size: int - most items stored concurrently
+        flush_interval: float - seconds to wait for more items before writing
+        max_attempts: int - attempts of a throttled item
+        retry_delay: float - seconds to wait before the first retry, doubled on every next one
+        pending: queue.Queue like - where accepted items wait for the worker
+    """
+
+    def __init__(self, store=store_message_item,
+                 batch_size=PERSIST_BATCH_SIZE, flush_interval=PERSIST_FLUSH_MS / 1000,
+                 max_attempts=PERSIST_MAX_ATTEMPTS, retry_delay=PERSIST_RETRY_MS / 1000,
+                 pending=None, sleep=time.sleep):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.pending = pending if pending is not None else queue.Queue()
+        self.sleep = sleep
+        self.enqueued = self.written = self.batches = self.retries = self.dropped = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._worker = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, room, item):
+        """
+        Queue message item of the room for storing.
+        Returns:
+            Future - resolved with the stored item, or failed when it could not be stored
+        """
+        self._start()
+        pending = _Pending(room, item)
+        self.pending.put(pending)
+        with self._lock:
+            self.enqueued += 1
+        return pending.future
+
+    def _start(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name='persistence', daemon=True)
+                    self._worker.start()
+
+    def _collect(self):
+        """Wait for the first item and take those following it up to the batch size"""
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self.flush(batch)
+            except Exception as err:
+                logger.exception('Persisting {} messages failed.'.format(len(batch)))
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(err)
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+
+    def flush(self, batch):
+        """Store items of the batch concurrently and resolve their futures"""
+        waiting = list(batch)
+        for attempt in range(self.max_attempts):
+            if attempt:
+                with self._lock:
+                    self.retries += 1
+                self.sleep(self.retry_delay * 2 ** (attempt - 1))
+            if len(waiting) == 1:
+                outcomes = [self._store(waiting[0])]
+            else:
+                outcomes = list(self._get_executor().map(self._store, waiting))
+            with self._lock:
+                self.batches += 1
+            throttled = []
+            for pending, (item, error) in zip(waiting, outcomes):
+                if error is None:
+                    self._done(pending, item)
+                elif isinstance(error, ClientError) and \
+                        error.response.get('Error', {}).get('Code') in RETRYABLE_ERRORS:
+                    throttled.append(pending)
+                else:
+                    pending.future.set_exception(error)
+            waiting = throttled
+            if not waiting:
+                return
+        logger.error('Gave up {} throttled messages after {} attempts.'.format(len(waiting), self.max_attempts))
+        with self._lock:
+            self.dropped += len(waiting)
+        for pending in waiting:
+            pending.future.set_exception(RuntimeError('Message could not be stored, writes were throttled'))
+
+    def _store(self, pending):
+        """Returns (stored item, None) or (None, error)"""
+        try:
+            with metrics.recording_to(pending.recorder):
+                return self.store(pending.room, pending.item), None
+        except Exception as err:
+            return None, err
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.batch_size, thread_name_prefix='persistence')
+        return self._executor
+
+    def _done(self, pending, item):
+        with self._lock:
+            self.written += 1
+            self._latencies.append(time.monotonic() - pending.enqueued)
+        pending.future.set_result(item)
+
+    def join(self):
+        """Wait until every queued item is stored or given up"""
+        self.pending.join()
+
+    def stats(self):
+        """Returns queue counters and enqueue to store latency statistics"""
+        with self._lock:
+            latencies = list(self._latencies)
+            return {'enqueued': self.enqueued, 'written': self.written, 'batches': self.batches,
+                    'retries': self.retries, 'dropped': self.dropped,
+                    'store_latency': summarize_latencies(latencies)}
+
+
+def history_entry(item):
+    return {'index': item['index'], 'username': item['username'], 'content': item['content']}
+
+
+def enqueue_message(room, item):
+    """
+    Accept message item for storing. It is served as history right away,
+    the history entry follows the item when it is stored under another index
+    and is dropped when it cannot be stored.
+    Returns:
+        Future - resolved with the stored item
+    """
+    history_cache.append(room, history_entry(item))
+    future = persistence_queue.submit(room, item)
+
+    def settle(stored):
+        if stored.exception() is not None:
+            history_cache.replace(room, item['index'])
+        elif stored.result()['index'] != item['index']:
+            history_cache.replace(room, item['index'], history_entry(stored.result()))
+
+    future.add_done_callback(settle)
+    return future
+
+
+persistence_queue = PersistenceQueue()
@@ -0,0 +1,192 @@
+"""
+Token bucket limits of messages per connection and per room.
+
+Every sender connection and every room has a bucket of BURST tokens
+refilled at RATE per second in the warm container; a message without a
+token is rejected without any I/O. Containers share the budget through
+counters in the message table: admitted messages are paid from leases of
+RATE_LEASE_SIZE tokens reserved from the key counter of the current
+RATE_WINDOW seconds, which holds RATE * RATE_WINDOW tokens. Once a window
+is spent by all containers together, messages are rejected until the next
+one. Bigger leases mean fewer counter writes, at most one lease per
+container may be admitted above the limit.
+
+A rate of 0 disables the limit, a lease size of 0 keeps it in-memory only.
+"""
+import logging
+import math
+import os
+import threading
+import time
+import metrics
+from utils import reserve_rate_lease
+
+logger = logging.getLogger("handler_logger")
+
+CONNECTION_RATE = float(os.environ.get('CONNECTION_RATE', 0))
+CONNECTION_BURST = float(os.environ.get('CONNECTION_BURST', 10))
+ROOM_RATE = float(os.environ.get('ROOM_RATE', 0))
+ROOM_BURST = float(os.environ.get('ROOM_BURST', 100))
+RATE_WINDOW = int(os.environ.get('RATE_WINDOW', 10))
+RATE_LEASE_SIZE = int(os.environ.get('RATE_LEASE_SIZE', 5))
+# Number of keys remembered by the container per limit
+RATE_CACHE_SIZE = 4096
+
+
+class _Key:
+    """Local bucket and shared counter lease of one limited key"""
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+        self.window = None
+        self.leased = 0
+        self.spent = False
+
+
+class RateLimiter:
+    """
+    Token bucket per key backed by shared window counters.
+    Args:
+        scope: str - what is limited, used in keys and rejections
+        rate: float - tokens added per second, 0 disables the limit
+        burst: float - bucket size
+        window: int - seconds of one shared counter
+        lease_size: int - tokens reserved from the shared counter at once, 0 for no shared counter
+        reserve: callable(key, window, size, limit, expires) - reserves tokens from the shared counter
+    """
+
+    def __init__(self, scope, rate, burst, window=RATE_WINDOW, lease_size=RATE_LEASE_SIZE,
+                 reserve=reserve_rate_lease, clock=time.time):
+        self.scope = scope
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.window = window
+        self.lease_size = lease_size
+        self.reserve = reserve
+        self.clock = clock
+        self.admitted = 0
+        self.rejected = 0
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def admit(self, key):
+        """
+        Take a token of the key.
+        Returns:
+            float - 0 when admitted, otherwise seconds to wait before the next try
+        """
+        if not self.enabled:
+            return 0.0
+        now = self.clock()
+        window = int(now // self.window)
+        with self._lock:
+            state = self._keys.get(key)
+            if state is None:
+                if len(self._keys) >= RATE_CACHE_SIZE:
+                    self._keys.clear()
+                state = self._keys[key] = _Key(self.burst, now)
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+            if state.window != window:
+                state.window, state.leased, state.spent = window, 0, False
+            if state.tokens < 1:
+                return self._reject((1 - state.tokens) / self.rate)
+            if state.spent:
+                return self._reject((window + 1) * self.window - now)
+            state.tokens -= 1
+            if not self.lease_size:
+                return self._admit()
+            if state.leased > 0:
+                state.leased -= 1
+                return self._admit()
+        # Lease is reserved outside the lock, keys of other senders are not held up
+        leased = self._lease(key, window)
+        with self._lock:
+            if state.window == window:
+                state.leased += leased
+                if state.leased > 0:
+                    state.leased -= 1
+                    return self._admit()
+                state.spent = True
+            state.tokens += 1
+            return self._reject((window + 1) * self.window - now)
+
+    def refund(self, key):
+        """
+        Give back the token taken by the last admit of the key, for messages rejected by a later limit.
+        A token paid from a lease of the current window goes back to the lease, the shared counter is not written.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            state = self._keys.get(key)
+            if state is None:
+                return
+            state.tokens = min(self.burst, state.tokens + 1)
+            if self.lease_size and state.window == int(self.clock() // self.window):
+                state.leased += 1
+            self.admitted -= 1
+
+    def _lease(self, key, window):
+        """
+        Reserve a lease from the shared window counter, a single token when a lease does not fit.
+        When the counter cannot be reached only the local bucket limits the key.
+        """
+        limit = max(int(self.rate * self.window), 1)
+        expires = (window + 2) * self.window
+        counter = '{}#{}'.format(self.scope, key)
+        try:
+            for size in sorted({min(self.lease_size, limit), 1}, reverse=True):
+                if self.reserve(counter, window, size, limit, expires):
+                    return size
+        except Exception as err:
+            logger.warning('Rate counter {} is not available: {}'.format(counter, err))
+            return 1
+        return 0
+
+    def _admit(self):
+        self.admitted += 1
+        return 0.0
+
+    def _reject(self, retry_after):
+        self.rejected += 1
+        return retry_after
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+            self.admitted = self.rejected = 0
+
+    def stats(self):
+        """Returns admitted and rejected counters"""
+        return {'admitted': self.admitted, 'rejected': self.rejected, 'keys': len(self._keys)}
+
+
+connection_limiter = RateLimiter('connection', CONNECTION_RATE, CONNECTION_BURST)
+room_limiter = RateLimiter('room', ROOM_RATE, ROOM_BURST)
+
+
+def check_rate(connection_id, room):
+    """
+    Admit a message of the connection to the room.
+    Returns:
+        dict or None - None when admitted, otherwise scope of the exceeded limit and seconds to retry after
+    """
+    with metrics.stage('RateLimit'):
+        admitted = []
+        for limiter, key in ((connection_limiter, connection_id), (room_limiter, room)):
+            retry_after = limiter.admit(key)
+            if retry_after:
+                # Limits passed before are not charged for a message which is not sent
+                for passed, passed_key in admitted:
+                    passed.refund(passed_key)
+                metrics.count('RateRejected')
+                return {'scope': limiter.scope, 'retry_after': math.ceil(retry_after * 1000) / 1000}
+            admitted.append((limiter, key))
+    metrics.count('RateAdmitted')
+    return None
@@ -0,0 +1,83 @@
+"""
+Scheduled removal of connection rows of clients that are gone.
+
+Rows are read with a paginated scan of the connection table. Rows past
+their expiry are deleted. With SWEEP_ENDPOINT set to the management api
+endpoint, rows still alive are also checked with get_connection and the
+ones api gateway reports as gone are deleted; this costs one management
+api call per live row, about what one broadcast to every room costs.
+
+Every removed row would otherwise be read by each room query of its room
+and cost the next broadcast to its room a post_to_connection answered
+with GoneException, the sweep reports those as saved sends.
+"""
+import logging
+import os
+import time
+from botocore.exceptions import ClientError
+import aws_resources
+import metrics
+from connection_expiry import is_expired, EXPIRY_ATTRIBUTE
+from utils import paginate, get_connection_table, get_broadcast_executor, delete_connections
+
+logger = logging.getLogger("handler_logger")
+
+# Management api endpoint connections are checked against, empty to remove expired rows only
+SWEEP_ENDPOINT = os.environ.get('SWEEP_ENDPOINT', '')
+# Most rows read by one scan page
+SWEEP_PAGE_SIZE = int(os.environ.get('SWEEP_PAGE_SIZE', 500))
+
+
+def scan_connections(now, expired_only):
+    """Yield connection id, room and expiry of connection rows, page by page"""
+    kwargs = {'ProjectionExpression': 'connectionId, room, #expires',
+              'ExpressionAttributeNames': {'#expires': EXPIRY_ATTRIBUTE},
+              'Limit': SWEEP_PAGE_SIZE}
+    if expired_only:
+        kwargs.update(FilterExpression='#expires <= :now', ExpressionAttributeValues={':now': int(now)})
+    return paginate(get_connection_table().scan, **kwargs)
+
+
+def is_gone(client, connection_id):
+    """Whether api gateway reports the connection as closed"""
+    try:
+        client.get_connection(ConnectionId=connection_id)
+        return False
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') == 'GoneException':
+            return True
+        logger.error('Failed to check connection {}: {}'.format(connection_id, err))
+        return False
+
+
+def sweep(endpoint=SWEEP_ENDPOINT, now=None):
+    """
+    Delete connection rows which are expired or gone.
+    Returns:
+        dict - rows scanned, found expired and gone, removed, rooms they were in and saved sends
+    """
+    now = now if now is not None else time.time()
+    client = aws_resources.get_gateway_client(endpoint) if endpoint else None
+    scanned, expired, gone = 0, [], []
+    with metrics.stage('Scan'):
+        alive = []
+        for item in scan_connections(now, expired_only=client is None):
+            scanned += 1
+            if is_expired(item, now):
+                expired.append(item)
+            else:
+                alive.append(item)
+    if client is not None and alive:
+        with metrics.stage('Probe'):
+            checked = get_broadcast_executor().map(lambda item: is_gone(client, item['connectionId']), alive)
+            gone = [item for item, is_closed in zip(alive, checked) if is_closed]
+    rooms = {item.get('room') for item in expired + gone}
+    with metrics.stage('Delete'):
+        removed = delete_connections(item['connectionId'] for item in expired + gone)
+    metrics.count('Expired', len(expired))
+    metrics.count('Gone', len(gone))
+    metrics.count('Removed', removed)
+    metrics.count('SavedSends', removed)
+    logger.info('Swept {} of {} connections in {} rooms.'.format(removed, scanned, len(rooms)))
+    return {'scanned': scanned, 'expired': len(expired), 'gone': len(gone), 'removed': removed,
+            'rooms': len(rooms), 'saved_sends': removed}
@@ -1,25 +1,267 @@
+import heapq
 import json
-import boto3
 import os
 import logging
 import time
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import BotoCoreError, ClientError
+import aws_resources
+import metrics
+from wire_format import FrameEncoder, DEFAULT_ENCODING, is_supported, encode
+from history import history_cache
+from user_index import user_connections
+from connection_expiry import get_connection_expiry, get_refresh_interval, is_expired, EXPIRY_ATTRIBUTE
+from validation import parse_body, validate_event, DEFAULT_ROOM, RESERVED_NAME_CHARACTER
 
-dynamodb = boto3.resource("dynamodb")
+logger = logging.getLogger("handler_logger")
 
+# Upper bound of concurrent post_to_connection calls made by one broadcast
+BROADCAST_MAX_WORKERS = int(os.environ.get('BROADCAST_MAX_WORKERS', 32))
 
-def get_body(event):
+# Global secondary index of connection table keyed by room
+CONNECTION_ROOM_INDEX = os.environ.get('CONNECTION_ROOM_INDEX', 'room-index')
+# Global secondary index of connection table keyed by username
+CONNECTION_USERNAME_INDEX = os.environ.get('CONNECTION_USERNAME_INDEX', 'username-index')
+
+# Number of connection attributes remembered by the container
+ENCODING_CACHE_SIZE = 1024
+
+# Most keys one batch_write_item call takes and attempts to write the unprocessed ones
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_MAX_ATTEMPTS = 5
+BATCH_WRITE_RETRY_MS = 50
+
+# Delta sync sends at most SYNC_MAX_PAGES pages per request, each capped by
+# message count and by encoded size (api gateway frames are limited to 128 KB)
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 50))
+SYNC_PAGE_BYTES = int(os.environ.get('SYNC_PAGE_BYTES', 32 * 1024))
+SYNC_MAX_PAGES = int(os.environ.get('SYNC_MAX_PAGES', 10))
+
+# Number of message indexes reserved with one counter update. Indexes of a block are
+# handed out by the warm container without a round trip. Blocks larger than 1 are only
+# safe with a single writer like the self-hosted runtime: containers holding blocks of
+# their own hand out indexes out of send order, sync cursors skip the lower ones
+MESSAGE_INDEX_BLOCK_SIZE = int(os.environ.get('MESSAGE_INDEX_BLOCK_SIZE', 1))
+# Room counters are stored in the message table under prefixed room key
+INDEX_COUNTER_PREFIX = 'counter#'
+
+# Rate limit counters are stored in the message table under prefixed key,
+# one item per limited key and window, dropped by table ttl on expiresAt
+RATE_COUNTER_PREFIX = 'rate#'
+
+# Messages of a room are spread over MESSAGE_SHARDS partitions by index % shards,
+# MESSAGE_ROOM_SHARDS (json object of room to shard count) overrides it per room.
+# Shard 0 keeps the plain room key, shard n is stored under "<room>#<n>". Readers
+# query the shards below the current count, so the count of a room may only grow.
+# Shards, index and rate counters share the room key space, the body schemas reject
+# room names with the separator so none of them can be addressed as a room
+MESSAGE_SHARDS = int(os.environ.get('MESSAGE_SHARDS', 1))
+MESSAGE_ROOM_SHARDS = json.loads(os.environ.get('MESSAGE_ROOM_SHARDS') or '{}')
+SHARD_SEPARATOR = RESERVED_NAME_CHARACTER
+
+# Reserved message indexes per room as [next, end]
+_index_lock = threading.Lock()
+_index_blocks = {}
+
+_serializer = TypeSerializer()
+
+# Fan-out pool lives across warm invocations
+_broadcast_executor = None
+# Username and encoding negotiated by connections on connect, by connection id
+_connection_items = {}
+# When expiry of connection rows was last moved forward by the container, by connection id
+_connection_refreshes = {}
+
+
+def get_body(event, schema=None):
+    """Decode event body and check it against the schema, see validation.parse_body"""
+    return parse_body(event, schema)
+
+
+def get_room(body):
+    """Returns room the message body is addressed to, names are checked by the body schemas"""
+    return body.get('room') or DEFAULT_ROOM
+
+
+def paginate(operation, **kwargs):
+    """
+    Yield items of all pages of dynamo query or scan.
+    Args:
+        operation: callable - table.query or table.scan
+        kwargs: arguments of the operation
+    """
+    while True:
+        response = operation(**kwargs)
+        yield from response.get('Items', [])
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+def get_live_connections(items):
+    """
+    Pick connections of index items which are not expired.
+    Returns:
+        list - (connection id, encoding) pairs
+    """
+    now, expired, connections = time.time(), 0, []
+    for x in items:
+        if 'connectionId' not in x:
+            continue
+        if is_expired(x, now):
+            expired += 1
+            continue
+        connections.append((x['connectionId'], x.get('encoding', DEFAULT_ENCODING)))
+    # Sends saved on rows of clients which stopped sending heartbeats
+    metrics.count('Expired', expired)
+    return connections
+
+
+def get_room_connections(room):
+    """Returns live connections joined to the room as (connection id, encoding) pairs"""
+    items = paginate(get_connection_table().query, IndexName=CONNECTION_ROOM_INDEX,
+                     KeyConditionExpression='room = :room',
+                     ExpressionAttributeValues={':room': room})
+    return get_live_connections(items)
+
+
+def get_user_connections(username):
+    """Returns live connections of the user as (connection id, encoding) pairs"""
+    connections = user_connections.get(username)
+    if connections is None:
+        items = paginate(get_connection_table().query, IndexName=CONNECTION_USERNAME_INDEX,
+                         KeyConditionExpression='username = :username',
+                         ExpressionAttributeValues={':username': username})
+        connections = get_live_connections(items)
+        user_connections.fill(username, connections)
+    return connections
+
+
+def refresh_connection_expiry(connection_id):
+    """
+    Move expiry of the connection row forward, rows without expiry are left untouched.
+    Returns:
+        int or None - new expiry, None when rows do not expire
+    Raises:
+        LookupError: in case the row is gone, it expired or the connection was closed
+    """
+    expires = get_connection_expiry()
+    if expires is None:
+        return None
     try:
-        return json.loads(event.get("body", ""))
-    except:
-        raise ValueError("event body could not be JSON decoded.")
+        # An expired row is not revived, its client may be gone already
+        get_connection_table().update_item(
+            Key={'connectionId': connection_id},
+            UpdateExpression='SET #expires = :expires',
+            ConditionExpression='attribute_exists(connectionId) AND '
+                                '(attribute_not_exists(#expires) OR #expires > :now)',
+            ExpressionAttributeNames={'#expires': EXPIRY_ATTRIBUTE},
+            ExpressionAttributeValues={':expires': expires, ':now': int(time.time())})
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+        raise LookupError("Connection '{}' has expired.".format(connection_id))
+    if len(_connection_refreshes) >= ENCODING_CACHE_SIZE:
+        _connection_refreshes.clear()
+    _connection_refreshes[connection_id] = time.time()
+    return expires
+
+
+def touch_connection(connection_id, connected_at=None):
+    """
+    Move expiry of the connection row forward on an action of its client. The row is written
+    only when neither connect nor the container did so within the refresh interval.
+    Args:
+        connection_id: str - connection the action came from
+        connected_at: int - epoch millisecond the connection was opened at, connectedAt of request context
+    Returns:
+        int or None - new expiry, None when the row was not written
+    Raises:
+        LookupError: in case the row is gone, it expired or the connection was closed
+    """
+    interval = get_refresh_interval()
+    if interval is None:
+        return None
+    # Connect stored the first expiry, rows of new connections are not written again right away
+    refreshed = _connection_refreshes.get(connection_id, (connected_at or 0) / 1000)
+    if time.time() - refreshed < interval:
+        return None
+    try:
+        with metrics.stage('Refresh'):
+            return refresh_connection_expiry(connection_id)
+    except ClientError as err:
+        # Action is still served, the next one or a heartbeat tries again
+        logger.warning('Failed to refresh expiry of {}: {}'.format(connection_id, err))
+        return None
+
+
+def ask_to_reconnect(connection_id, reason, event):
+    """Tell the client its connection row has expired and answer the action with 410"""
+    logger.info("Failed: {}".format(reason))
+    with metrics.stage('Send'):
+        send_frame(connection_id, {"reconnect": {"reason": "expired"}}, event)
+    return build_response(410, str(reason))
+
+
+def get_room_presence(room):
+    """Returns sorted usernames of users with at least one live connection joined to the room"""
+    items = paginate(get_connection_table().query, IndexName=CONNECTION_ROOM_INDEX,
+                     KeyConditionExpression='room = :room',
+                     ExpressionAttributeValues={':room': room},
+                     ProjectionExpression='username, #expires',
+                     ExpressionAttributeNames={'#expires': EXPIRY_ATTRIBUTE})
+    now = time.time()
+    return sorted({x['username'] for x in items if 'username' in x and not is_expired(x, now)})
+
+
+def get_connection_item(connection_id):
+    """Returns username and encoding the connection stored on connect"""
+    item = _connection_items.get(connection_id)
+    if item is None:
+        response = get_connection_table().get_item(Key={'connectionId': connection_id},
+                                                   ProjectionExpression='username, #encoding',
+                                                   ExpressionAttributeNames={'#encoding': 'encoding'})
+        item = response.get('Item') or {}
+        if not is_supported(item.get('encoding', DEFAULT_ENCODING)):
+            item['encoding'] = DEFAULT_ENCODING
+        if len(_connection_items) >= ENCODING_CACHE_SIZE:
+            _connection_items.clear()
+        _connection_items[connection_id] = item
+    return item
+
+
+def get_connection_encoding(connection_id):
+    """Returns encoding the connection negotiated on connect"""
+    return get_connection_item(connection_id).get('encoding', DEFAULT_ENCODING)
+
+
+def get_connection_username(connection_id):
+    """Returns username the connection was opened with, None for unknown connections"""
+    return get_connection_item(connection_id).get('username')
+
+
+def get_endpoint_url(event):
+    """Builds management api endpoint of the websocket api the event came from"""
+    return "https://" + event["requestContext"]["domainName"] + "/" + event["requestContext"]["stage"]
+
+
+def get_gateway_client(event):
+    """Returns management api client for the event endpoint. One client is created per endpoint"""
+    return aws_resources.get_gateway_client(get_endpoint_url(event))
 
 
 def send_to_connection(connection_id, data, event):
-    gatewayapi = boto3.client("apigatewaymanagementapi",
-                              endpoint_url="https://" + event["requestContext"]["domainName"] +
-                                           "/" + event["requestContext"]["stage"])
-    return gatewayapi.post_to_connection(ConnectionId=connection_id,
-                                         Data=data)
+    return get_gateway_client(event).post_to_connection(ConnectionId=connection_id,
+                                                        Data=data)
+
+
+def send_frame(connection_id, frame, event):
+    """Encode frame the way the connection asked for and send it"""
+    return send_to_connection(connection_id, encode(frame, get_connection_encoding(connection_id)), event)
 
 
 def build_response(status_code, body):
@@ -31,78 +273,416 @@ def build_response(status_code, body):
 
 def get_connection_table():
     """ Returns dynamo table resource to store connection ids"""
-    return dynamodb.Table(os.environ['CONNECTION_TABLE_NAME'])
+    return aws_resources.get_table(os.environ['CONNECTION_TABLE_NAME'])
 
 
 def get_message_table():
     """ Returns dynamo table resource to store connection ids"""
-    return dynamodb.Table(os.environ['MESSAGE_TABLE_NAME'])
+    return aws_resources.get_table(os.environ['MESSAGE_TABLE_NAME'])
+
+
+def get_room_shards(room):
+    """Returns number of partitions messages of the room are spread over"""
+    return max(1, int(MESSAGE_ROOM_SHARDS.get(room, MESSAGE_SHARDS)))
+
+
+def get_message_partition(room, index):
+    """Returns partition key the message with the index is stored under"""
+    shard = index % get_room_shards(room)
+    return room if shard == 0 else '{}{}{}'.format(room, SHARD_SEPARATOR, shard)
+
 
+def get_room_partitions(room):
+    """Returns partition keys of all shards of the room"""
+    return [room] + ['{}{}{}'.format(room, SHARD_SEPARATOR, shard) for shard in range(1, get_room_shards(room))]
 
-def build_message_index(message_table):
-    """Get the latest message from dynamo table and return the message index +1"""
-    response = message_table.query(KeyConditionExpression='room = :room',
-                                   ExpressionAttributeValues={':room': 'general'},
-                                   Limit=1, ScanIndexForward=False)
-    items = response.get('Items', [])
-    index = items[0]['index'] + 1 if len(items) > 0 else 0
+
+def map_partitions(query, partitions):
+    """Run query for every partition, concurrently when the room is sharded"""
+    if len(partitions) == 1:
+        return [query(partitions[0])]
+    return list(get_broadcast_executor().map(query, partitions))
+
+
+def reserve_index_block(message_table, room, size):
+    """
+    Atomically move the room message counter forward.
+    Returns:
+        tuple - (first, end) range of indexes reserved for this container
+    """
+    response = message_table.update_item(Key={'room': INDEX_COUNTER_PREFIX + room, 'index': 0},
+                                         UpdateExpression='ADD next_index :size',
+                                         ExpressionAttributeValues={':size': size},
+                                         ReturnValues='UPDATED_NEW')
+    end = int(response['Attributes']['next_index'])
+    return end - size, end
+
+
+def reserve_rate_lease(key, window, size, limit, expires):
+    """
+    Take size tokens from the shared counter of the key for the window.
+    Returns:
+        bool - False when fewer than size tokens are left in the window
+    """
+    try:
+        get_message_table().update_item(Key={'room': RATE_COUNTER_PREFIX + key, 'index': window},
+                                        UpdateExpression='ADD used :size SET expiresAt = :expires',
+                                        ConditionExpression='attribute_not_exists(used) OR used <= :last',
+                                        ExpressionAttributeValues={':size': size, ':last': limit - size,
+                                                                   ':expires': expires})
+        return True
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+
+def build_message_index(message_table, room=DEFAULT_ROOM):
+    """Return next unique message index, reserving a new block from the room counter when needed"""
+    with _index_lock:
+        block = _index_blocks.get(room)
+        if block is None or block[0] >= block[1]:
+            block = list(reserve_index_block(message_table, room, MESSAGE_INDEX_BLOCK_SIZE))
+            _index_blocks[room] = block
+        index = block[0]
+        block[0] += 1
     return index
 
 
+def recover_index_counter(message_table, room=DEFAULT_ROOM):
+    """
+    Move the room counter past the latest stored message.
+    Needed once for rooms written before the counter existed.
+    """
+    def latest(partition):
+        return message_table.query(KeyConditionExpression='room = :room',
+                                   ExpressionAttributeValues={':room': partition},
+                                   Limit=1, ScanIndexForward=False).get('Items', [])
+
+    items = [item for items in map_partitions(latest, get_room_partitions(room)) for item in items]
+    next_index = max(item['index'] for item in items) + 1 if len(items) > 0 else 0
+    try:
+        message_table.update_item(Key={'room': INDEX_COUNTER_PREFIX + room, 'index': 0},
+                                  UpdateExpression='SET next_index = :next',
+                                  ConditionExpression='attribute_not_exists(next_index) OR next_index < :next',
+                                  ExpressionAttributeValues={':next': next_index})
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+    with _index_lock:
+        _index_blocks.pop(room, None)
+
+
+def build_message_item(username, body):
+    """Composes message item under the next index of its room"""
+    room = get_room(body)
+    with metrics.stage('AllocateIndex'):
+        index = build_message_index(get_message_table(), room)
+    return {'room': get_message_partition(room, index), 'index': index,
+            'timestamp': int(time.time()), 'username': username, 'content': body['content']}
+
+
+def store_message_item(room, item):
+    """
+    Store message item without overwriting a stored message. When its index is
+    taken the room counter is recovered and the message stored under a new index.
+    Returns:
+        dict - stored item
+    """
+    message_table = get_message_table()
+    for attempt in range(2):
+        try:
+            # Never overwrite a stored message, even if the counter is behind
+            with metrics.stage('PutItem'):
+                message_table.put_item(Item=item, ConditionExpression='attribute_not_exists(#index)',
+                                       ExpressionAttributeNames={'#index': 'index'})
+            return item
+        except ClientError as err:
+            if attempt or err.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            logger.warning('Message index {} is taken in room {}, recovering counter.'.format(item['index'], room))
+            recover_index_counter(message_table, room)
+            with metrics.stage('AllocateIndex'):
+                index = build_message_index(message_table, room)
+            item = dict(item, room=get_message_partition(room, index), index=index)
+
+
 def put_message_to_db(username, body):
     """Composes message body and send it to dynamo table"""
-    message_table = get_message_table()
-    timestamp = int(time.time())
-    content = body['content']
-    message_table.put_item(Item={'room': 'general', 'index': build_message_index(message_table),
-                                 'timestamp': timestamp, 'username': username,
-                                 'content': content})
+    room = get_room(body)
+    item = store_message_item(room, build_message_item(username, body))
+    history_cache.append(room, {'index': item['index'], 'username': username, 'content': item['content']})
+    return item
+
+
+def get_recent_history(room):
+    """Returns newest messages of the room oldest first. Served from the container while fresh"""
+    messages = history_cache.get(room)
+    metrics.count('HistoryCacheHit' if messages is not None else 'HistoryCacheMiss')
+    if messages is None:
+        def newest(partition):
+            return get_message_table().query(KeyConditionExpression='room = :room',
+                                             ExpressionAttributeValues={':room': partition},
+                                             Limit=history_cache.size, ScanIndexForward=False).get('Items', [])
+
+        with metrics.stage('HistoryQuery'):
+            shards = map_partitions(newest, get_room_partitions(room))
+        # Every shard is newest first, merge them and keep the newest of all
+        items = islice(heapq.merge(*shards, key=lambda x: x['index'], reverse=True), history_cache.size)
+        messages = [{'index': int(x['index']), 'username': x['username'], 'content': x['content']} for x in items]
+        messages.reverse()
+        history_cache.fill(room, messages)
+    return messages
+
+
+def iter_messages_since(room, since):
+    """
+    Yield messages of the room stored after index since, oldest first.
+    Shards are read page by page and merged by index.
+    """
+    shards = [paginate(get_message_table().query,
+                       KeyConditionExpression='room = :room AND #index > :since',
+                       ExpressionAttributeNames={'#index': 'index'},
+                       ExpressionAttributeValues={':room': partition, ':since': since},
+                       ScanIndexForward=True, Limit=SYNC_PAGE_SIZE)
+              for partition in get_room_partitions(room)]
+    for x in heapq.merge(*shards, key=lambda x: x['index']):
+        yield {'index': int(x['index']), 'username': x['username'], 'content': x['content']}
+
+
+def build_sync_pages(messages, page_size=None, page_bytes=None):
+    """Split messages into pages capped by message count and encoded size"""
+    page_size = page_size or SYNC_PAGE_SIZE
+    page_bytes = page_bytes or SYNC_PAGE_BYTES
+    page, page_len = [], 0
+    for message in messages:
+        message_len = len(json.dumps(message)) + 2
+        if page and (len(page) >= page_size or page_len + message_len > page_bytes):
+            yield page
+            page, page_len = [], 0
+        page.append(message)
+        page_len += message_len
+    if page:
+        yield page
+
+
+def send_sync_pages(connection_id, room, since, event):
+    """
+    Send messages of the room stored after index since to the connection.
+    At most SYNC_MAX_PAGES pages are sent, the client continues from the cursor
+    of the last page when it says more messages are waiting.
+    Returns:
+        tuple - (pages sent, cursor of the last page, more messages waiting)
+    """
+    pages = build_sync_pages(iter_messages_since(room, since))
+    page, sent, cursor = next(pages, []), 0, since
+    while True:
+        following = next(pages, None) if page else None
+        more = following is not None
+        cursor = page[-1]['index'] if page else cursor
+        send_frame(connection_id, {'messages': page, 'cursor': cursor, 'more': more}, event)
+        sent += 1
+        metrics.count('SyncMessages', len(page))
+        if not more or sent >= SYNC_MAX_PAGES:
+            return sent, cursor, more
+        page = following
+
+
+def get_sync_cursor(body):
+    """
+    Get index of the last message the client saw.
+    Raises:
+        ValueError: in case cursor is not an integer
+    """
+    since = body.get('since', -1)
+    if isinstance(since, bool) or not isinstance(since, int):
+        raise ValueError('since should be an integer message index')
+    return since
+
+
+def build_message_entry(username, content, index=None):
+    """Message as sent to clients, index is the sync cursor of clients which saw it"""
+    entry = {'username': username, 'content': content}
+    if index is not None:
+        entry['index'] = index
+    return entry
 
 
-def build_message_data(username, body):
+def build_message_frame(username, body, index=None):
+    """Create api Gateway message"""
+    return {'messages': build_message_entry(username, body['content'], index)}
+
+
+def build_message_data(username, body, index=None):
     """Create encoded api Gateway message"""
-    data = {'messages': {'username': username, 'content': body['content']}}
-    return json.dumps(data).encode('utf-8')
+    return json.dumps(build_message_frame(username, body, index)).encode('utf-8')
+
+
+def build_batch_frame(messages):
+    """Create api Gateway message carrying several messages, shaped as history response"""
+    return {'messages': [build_message_entry(x['username'], x['content'], x.get('index')) for x in messages]}
 
 
-def broadcast_message(username, body, event):
-    """Build message object and send it to all currently available connections"""
-    # Get all current connections
-    items = get_connection_table().scan(ProjectionExpression='connectionId').get('Items', [])
-    connections = [x['connectionId'] for x in items if 'connectionId' in x]
-    # Send the message data to all connections
-    for connectionID in connections:
-        send_to_connection(connectionID, build_message_data(username, body), event)
-    return build_response(200,
-                          'Message sent to {} connections.'.format(len(connections)))
+def get_broadcast_executor():
+    """Returns thread pool used to post messages to connections concurrently"""
+    global _broadcast_executor
+    if _broadcast_executor is None:
+        _broadcast_executor = ThreadPoolExecutor(max_workers=BROADCAST_MAX_WORKERS)
+    return _broadcast_executor
 
 
-def validate_event(ev):
+def post_to_connection(client, connection_id, data):
     """
-    Check if all required fields are included to event.
+    Post data to a single connection.
+    Returns:
+        tuple - (connection id, outcome, latency in seconds) where outcome
+        is one of 'sent', 'gone' or 'failed'
+    """
+    started = time.perf_counter()
+    try:
+        client.post_to_connection(ConnectionId=connection_id, Data=data)
+        outcome = 'sent'
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') == 'GoneException':
+            outcome = 'gone'
+        else:
+            logger.error('Failed to post to connection {}: {}'.format(connection_id, err))
+            outcome = 'failed'
+    except BotoCoreError as err:
+        # Connection errors and timeouts fail this post only, not the whole fan-out
+        logger.error('Failed to post to connection {}: {}'.format(connection_id, err))
+        outcome = 'failed'
+    return connection_id, outcome, time.perf_counter() - started
+
+
+def post_to_connections(deliveries, event):
+    """
+    Post encoded data to connections using one pooled client.
     Args:
-        ev: dict - ApiGateway event
-    Raises:
-        ValueError: in case of absent required field or data
+        deliveries: list - (connection id, encoded data) pairs
+    Returns:
+        dict - outcome name mapped to list of (connection id, latency) pairs
     """
-    # Todo: to be filled in
-    pass
-    # event["requestContext"]["domainName"] +
-    # "/" + event["requestContext"]["stage"]
+    client = get_gateway_client(event)
+    results = {'sent': [], 'gone': [], 'failed': []}
+    if len(deliveries) == 1:
+        posted = [post_to_connection(client, *deliveries[0])]
+    else:
+        posted = get_broadcast_executor().map(
+            lambda delivery: post_to_connection(client, *delivery), deliveries)
+    for connection_id, outcome, latency in posted:
+        results[outcome].append((connection_id, latency))
+    return results
 
 
-def validate_body(body):
+def delete_connections(connection_ids):
     """
-    Check if all required fields are included to message body.
+    Delete connection rows with batch_write_item, BATCH_WRITE_SIZE keys per call.
+    Unprocessed keys are retried with exponential backoff.
+    Returns:
+        int - number of rows deleted
+    """
+    connection_ids = list(connection_ids)
+    if not connection_ids:
+        return 0
+    table = get_connection_table()
+    client = table.meta.client
+    deleted = 0
+    for start in range(0, len(connection_ids), BATCH_WRITE_SIZE):
+        requests = [{'DeleteRequest': {'Key': {'connectionId': _serializer.serialize(connection_id)}}}
+                    for connection_id in connection_ids[start:start + BATCH_WRITE_SIZE]]
+        chunk = len(requests)
+        for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(BATCH_WRITE_RETRY_MS / 1000 * 2 ** (attempt - 1))
+            response = client.batch_write_item(RequestItems={table.name: requests})
+            requests = response.get('UnprocessedItems', {}).get(table.name, [])
+            if not requests:
+                break
+        if requests:
+            logger.warning('{} connections were left undeleted.'.format(len(requests)))
+        deleted += chunk - len(requests)
+    for connection_id in connection_ids:
+        user_connections.discard(connection_id)
+        _connection_items.pop(connection_id, None)
+    return deleted
+
+
+def summarize_latencies(latencies):
+    """Aggregates send latencies given in seconds into millisecond statistics"""
+    if not latencies:
+        return {'count': 0}
+    ordered = sorted(latencies)
+
+    def percentile(pct):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000, 3)
+
+    return {'count': len(ordered),
+            'avg_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+            'p50_ms': percentile(0.5),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(ordered[-1] * 1000, 3)}
+
+
+def deliver_to_room(room, frame, event):
+    """
+    Send frame to all connections joined to the room. The frame is encoded
+    once for every encoding used by the room members.
+    Returns:
+        dict - sent, failed and stale connection counters with send latency statistics
+    """
+    with metrics.stage('RoomQuery'):
+        connections = get_room_connections(room)
+    return deliver_to_connections(connections, frame, event)
+
+
+def deliver_to_connections(connections, frame, event):
+    """
+    Send frame to connections encoded the way each of them asked for and drop the gone ones.
     Args:
-        body: dict - body message sent ws connection
-    Raises:
-        ValueError: in case of absent required field or data
+        connections: list - (connection id, encoding) pairs
+    Returns:
+        dict - sent, failed and stale connection counters with send latency statistics
     """
-    # Todo: to be filled in
-    #body['content is needed']
-    if not isinstance(body, dict):
-        raise ValueError('Message body should be a valid dictionary')
-        # logger.debug('Failed: message body not in dict format.')
+    with metrics.stage('Encode'):
+        encoder = FrameEncoder(frame)
+        deliveries = [(connection_id, encoder(encoding)) for connection_id, encoding in connections]
+    with metrics.stage('FanOut'):
+        results = post_to_connections(deliveries, event)
+    stale = [connection_id for connection_id, _ in results['gone']]
+    with metrics.stage('RemoveStale'):
+        removed = delete_connections(stale)
+    if stale:
+        logger.info('Removed {} of {} stale connections.'.format(removed, len(stale)))
+    metrics.count('Connections', len(connections))
+    metrics.count('Sent', len(results['sent']))
+    metrics.count('Failed', len(results['failed']))
+    metrics.count('Stale', len(stale))
+    latencies = [latency for outcome in results.values() for _, latency in outcome]
+    return {'sent': len(results['sent']),
+            'failed': len(results['failed']),
+            'stale': len(stale),
+            'latency': summarize_latencies(latencies)}
+
+
+def broadcast_message(username, body, event, index=None):
+    """Build message object and send it to all connections joined to the message room"""
+    # Encode once and send the same message data to all connections
+    summary = deliver_to_room(get_room(body), build_message_frame(username, body, index), event)
+    return build_response(200, dict(
+        message='Message sent to {} connections.'.format(summary['sent']), **summary))
+
+
+def build_direct_frame(sender, body):
+    return {'direct': {'from': sender, 'to': body['to'], 'content': body['content']}}
+
 
-    pass
\ No newline at end of file
+def send_direct_message(sender, body, event):
+    """Send message to every connection of the user it is addressed to"""
+    with metrics.stage('UserQuery'):
+        connections = get_user_connections(body['to'])
+    if not connections:
+        return build_response(404, "User '{}' is not connected.".format(body['to']))
+    summary = deliver_to_connections(connections, build_direct_frame(sender, body), event)
+    return build_response(200, dict(
+        message='Message sent to {} connections of {}.'.format(summary['sent'], body['to']), **summary))
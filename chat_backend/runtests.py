@@ -1,5 +1,12 @@
+import os
+import sys
 import pytest
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Lambda code imports its modules by plain names, as they are laid out by sam build
+sys.path[:0] = [BASE_DIR, os.path.join(BASE_DIR, 'message'), os.path.join(BASE_DIR, 'shared')]
+
 
 if __name__ == '__main__':
-    pytest.main()
\ No newline at end of file
+    pytest.main()
@@ -0,0 +1,75 @@
+"""
+AWS resources shared by the chat lambdas.
+
+Nothing is created on import. DynamoDB resource, table handles and api
+gateway management clients are built on first use and cached at module
+level, so warm invocations of a container reuse them.
+"""
+import os
+import threading
+import boto3
+from botocore.config import Config
+import metrics
+
+# Size of the http connection pool of management api clients. It should not be
+# lower than the number of threads posting to connections concurrently
+GATEWAY_MAX_POOL_CONNECTIONS = int(os.environ.get('GATEWAY_MAX_POOL_CONNECTIONS', 32))
+
+_lock = threading.Lock()
+_dynamodb = None
+_tables = {}
+_gateway_clients = {}
+
+
+def get_dynamodb():
+    """Returns dynamodb resource, creating it on first call"""
+    global _dynamodb
+    if _dynamodb is None:
+        with _lock:
+            if _dynamodb is None:
+                resource = boto3.resource("dynamodb")
+                metrics.attach_to_dynamodb(resource.meta.client)
+                _dynamodb = resource
+    return _dynamodb
+
+
+def get_table(table_name):
+    """Returns cached dynamo table resource by its name"""
+    table = _tables.get(table_name)
+    if table is None:
+        table = get_dynamodb().Table(table_name)
+        _tables[table_name] = table
+    return table
+
+
+def get_gateway_client(endpoint_url):
+    """Returns cached api gateway management client for the endpoint"""
+    client = _gateway_clients.get(endpoint_url)
+    if client is None:
+        # boto3 client creation is not thread safe
+        with _lock:
+            client = _gateway_clients.get(endpoint_url)
+            if client is None:
+                client = boto3.client("apigatewaymanagementapi", endpoint_url=endpoint_url,
+                                      config=Config(max_pool_connections=GATEWAY_MAX_POOL_CONNECTIONS))
+                _gateway_clients[endpoint_url] = client
+    return client
+
+
+def register_table(table_name, table):
+    """Serve table_name by the given object, e.g. an in-memory stand-in"""
+    _tables[table_name] = table
+
+
+def register_gateway_client(endpoint_url, client):
+    """Serve management api of the endpoint by the given object"""
+    _gateway_clients[endpoint_url] = client
+
+
+def clear_cache():
+    """Drops all cached resources, next calls create them again"""
+    global _dynamodb
+    with _lock:
+        _dynamodb = None
+        _tables.clear()
+        _gateway_clients.clear()
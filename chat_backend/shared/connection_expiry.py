@@ -0,0 +1,40 @@
+"""
+Expiry of connection rows.
+
+Api gateway does not deliver $disconnect for every dropped client, rows of
+such connections would stay in the connection table and be read and posted
+to by every broadcast to their room. With CONNECTION_TTL set, connect
+stores an expiresAt epoch second on the row. The heartbeat action moves it
+forward, and so does every other action of the client, at most once per half
+ttl and container. Expired rows are skipped by broadcasts, removed by the
+scheduled sweeper and eventually by table ttl on expiresAt.
+
+A CONNECTION_TTL of 0 keeps rows until disconnect, rows without expiresAt
+never expire.
+"""
+import os
+import time
+
+# Seconds a connection row lives without a heartbeat
+CONNECTION_TTL = int(os.environ.get('CONNECTION_TTL', 0))
+EXPIRY_ATTRIBUTE = 'expiresAt'
+
+
+def get_connection_expiry(now=None):
+    """Returns epoch second a row written now expires at, None when rows do not expire"""
+    if CONNECTION_TTL <= 0:
+        return None
+    return int(now if now is not None else time.time()) + CONNECTION_TTL
+
+
+def get_refresh_interval():
+    """Returns seconds after which other actions move expiry forward again, None when rows do not expire"""
+    if CONNECTION_TTL <= 0:
+        return None
+    return CONNECTION_TTL / 2
+
+
+def is_expired(item, now=None):
+    """Whether the connection row is past its expiry"""
+    expires = item.get(EXPIRY_ATTRIBUTE)
+    return expires is not None and expires <= (now if now is not None else time.time())
@@ -0,0 +1,167 @@
+"""
+Per invocation metrics of the chat handlers.
+
+Handlers wrapped with `instrumented` record durations of the stages they
+go through, DynamoDB consumed capacity and item counts, and any counters
+code adds with `count`. At the end of the invocation one line in CloudWatch
+embedded metric format is printed, CloudWatch turns it into metrics with
+Handler dimension.
+
+Work done for an invocation on other threads, like the persistence worker
+storing its message, is recorded to it with `recording_to`.
+
+Only METRICS_SAMPLE_RATE share of invocations is recorded, the others run
+against a no-op recorder. Consumed capacity is asked from DynamoDB only
+for recorded invocations.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ChatApp')
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+
+_local = threading.local()
+
+
+class InvocationMetrics:
+    """Stage durations in milliseconds and counters of one handler invocation"""
+
+    recording = True
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.stages = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        # Worker threads record to the invocation while its handler does
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + duration
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def build_record(self, status_code=None):
+        """Returns embedded metric format record of the invocation"""
+        values = {'Duration': (time.perf_counter() - self.started) * 1000}
+        values.update(('{}Time'.format(name), duration) for name, duration in self.stages.items())
+        values.update(self.counters)
+        units = {name: 'Milliseconds' if name == 'Duration' or name.endswith('Time') else 'Count'
+                 for name in values}
+        record = {'_aws': {'Timestamp': int(time.time() * 1000),
+                           'CloudWatchMetrics': [{'Namespace': METRICS_NAMESPACE,
+                                                  'Dimensions': [['Handler']],
+                                                  'Metrics': [{'Name': name, 'Unit': unit}
+                                                              for name, unit in units.items()]}]},
+                  'Handler': self.handler}
+        if status_code is not None:
+            record['StatusCode'] = status_code
+        record.update((name, round(value, 3)) for name, value in values.items())
+        return record
+
+
+class _NotRecorded:
+    """Recorder of invocations left out by sampling"""
+
+    recording = False
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def count(self, name, value=1):
+        pass
+
+
+NOT_RECORDED = _NotRecorded()
+
+
+def current():
+    """Returns recorder of the invocation handled by this thread"""
+    return getattr(_local, 'metrics', NOT_RECORDED)
+
+
+@contextmanager
+def recording_to(recorder):
+    """Record metrics of this thread to the recorder of an invocation handled by another one"""
+    previous = current()
+    _local.metrics = recorder
+    try:
+        yield recorder
+    finally:
+        _local.metrics = previous
+
+
+def stage(name):
+    """Context manager timing a stage of the current invocation"""
+    return current().stage(name)
+
+
+def count(name, value=1):
+    """Add value to a counter of the current invocation"""
+    current().count(name, value)
+
+
+def emit(record):
+    sys.stdout.write(json.dumps(record) + '\n')
+    sys.stdout.flush()
+
+
+def instrumented(handler_name):
+    """Decorator recording metrics of sampled invocations of a lambda handler"""
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(event, context):
+            if random.random() >= METRICS_SAMPLE_RATE:
+                return handler(event, context)
+            previous = current()
+            recorder = _local.metrics = InvocationMetrics(handler_name)
+            response = None
+            try:
+                response = handler(event, context)
+                return response
+            finally:
+                _local.metrics = previous
+                status_code = response.get('statusCode') if isinstance(response, dict) else None
+                emit(recorder.build_record(status_code))
+        return wrapper
+    return decorator
+
+
+def request_consumed_capacity(params, model, **_):
+    """botocore hook asking DynamoDB for consumed capacity of recorded invocations"""
+    if current().recording and 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+
+def record_consumed_capacity(parsed, **_):
+    """botocore hook adding consumed capacity and read item count to the current invocation"""
+    recorder = current()
+    if not recorder.recording or not isinstance(parsed, dict):
+        return
+    consumed = parsed.get('ConsumedCapacity')
+    for capacity in consumed if isinstance(consumed, list) else [consumed] if consumed else []:
+        recorder.count('ConsumedCapacity', capacity.get('CapacityUnits', 0))
+    if 'Count' in parsed:
+        recorder.count('ItemsRead', parsed['Count'])
+
+
+def attach_to_dynamodb(client):
+    """Register consumed capacity hooks on low level dynamodb client"""
+    client.meta.events.register('before-parameter-build.dynamodb', request_consumed_capacity)
+    client.meta.events.register('after-call.dynamodb', record_consumed_capacity)
@@ -0,0 +1,82 @@
+"""
+Connections of users kept in the warm container.
+
+Connections are looked up by username through the username index of the
+connection table, one user may hold several connections. Lookups are
+cached for USER_CACHE_TTL seconds. Connect and disconnect are handled by
+another function, so connections opened since a lookup show up after the
+ttl; closed ones are dropped once api gateway reports them as gone.
+"""
+import os
+import threading
+import time
+
+# Seconds the connections of a user are served from the container without a query
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 5))
+# Number of users remembered by the container
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+
+
+class UserConnectionCache:
+    """Connection ids with their encodings by username"""
+
+    def __init__(self, ttl=USER_CACHE_TTL, size=USER_CACHE_SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.size = size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._users = {}
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        """
+        Return cached connections of the user.
+        Returns:
+            list or None - (connection id, encoding) pairs, None when the user is not cached or expired
+        """
+        with self._lock:
+            cached = self._users.get(username)
+            if cached is None or self.clock() - cached[0] > self.ttl:
+                self._drop(username)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(cached[1].items())
+
+    def fill(self, username, connections):
+        """Store connections of the user read from the table"""
+        with self._lock:
+            self._drop(username)
+            if len(self._users) >= self.size:
+                self._users.clear()
+                self._owners.clear()
+            self._users[username] = (self.clock(), dict(connections))
+            self._owners.update((connection_id, username) for connection_id, _ in connections)
+
+    def discard(self, connection_id):
+        """Forget a closed or gone connection"""
+        with self._lock:
+            username = self._owners.pop(connection_id, None)
+            cached = self._users.get(username)
+            if cached is not None:
+                cached[1].pop(connection_id, None)
+
+    def _drop(self, username):
+        cached = self._users.pop(username, None)
+        for connection_id in cached[1] if cached else ():
+            self._owners.pop(connection_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._owners.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Returns hit and miss counters"""
+        return {'hits': self.hits, 'misses': self.misses, 'users': len(self._users)}
+
+
+user_connections = UserConnectionCache()
@@ -0,0 +1,154 @@
+"""
+Validation of api gateway events and message bodies.
+
+Schemas are declared as field specs and compiled once on import into flat
+tuples of checks, so validating an event is a loop over a few tuples. Every
+check runs before the handler does any I/O and raises ValueError, which the
+handlers answer with 400.
+
+Bodies are decoded with orjson when it is installed and JSON_CODEC does not
+ask for the standard library json.
+"""
+import json
+import os
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Api gateway takes frames of up to 128 KB, chat messages are kept well below
+MAX_BODY_BYTES = int(os.environ.get('MAX_BODY_BYTES', 32 * 1024))
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 4096))
+# Longest username, room and other name like values
+MAX_NAME_LENGTH = int(os.environ.get('MAX_NAME_LENGTH', 64))
+# Separates parts of internal table keys, names may not contain it
+RESERVED_NAME_CHARACTER = '#'
+# Characters of usernames, rooms and other names
+NAME_PATTERN = re.compile(r'[^{}\x00-\x1f\x7f]*'.format(re.escape(RESERVED_NAME_CHARACTER)))
+# Room of messages and connections that do not name one
+DEFAULT_ROOM = 'general'
+# json or orjson, orjson is used when installed unless json is asked for
+JSON_CODEC = os.environ.get('JSON_CODEC', 'orjson' if orjson is not None else 'json')
+
+
+_loads, _decode_error = json.loads, ValueError
+
+
+def use_codec(codec):
+    """
+    Switch the json codec bodies are decoded with.
+    Returns:
+        str - codec in use, json when orjson was asked for but is not installed
+    """
+    global _loads, _decode_error
+    if codec == 'orjson' and orjson is not None:
+        _loads, _decode_error = orjson.loads, orjson.JSONDecodeError
+        return codec
+    _loads, _decode_error = json.loads, ValueError
+    return 'json'
+
+
+use_codec(JSON_CODEC)
+
+
+def loads(data):
+    """Decode json text with the configured codec"""
+    return _loads(data)
+
+
+def compile_schema(fields):
+    """
+    Compile field specs to a validator of dicts.
+    Args:
+        fields: dict - field name mapped to (type or tuple of types, max length or None, required,
+            compiled pattern the whole text has to match or None)
+    Returns:
+        callable(dict) - raises ValueError for missing, mistyped, too long or malformed fields
+    """
+    checks = tuple((name, types, max_length, required, pattern)
+                   for name, (types, max_length, required, pattern) in fields.items())
+
+    def validate(data):
+        for name, types, max_length, required, pattern in checks:
+            value = data.get(name)
+            if value is None:
+                if required:
+                    raise ValueError("'{}' is required".format(name))
+                continue
+            if not isinstance(value, types) or isinstance(value, bool) and bool not in types:
+                raise ValueError("'{}' has wrong type".format(name))
+            if max_length is not None and len(value) > max_length:
+                raise ValueError("'{}' is longer than {}".format(name, max_length))
+            if pattern is not None and pattern.fullmatch(value) is None:
+                raise ValueError("'{}' contains characters which are not allowed".format(name))
+        return data
+    return validate
+
+
+def _text(max_length=MAX_NAME_LENGTH, required=False, pattern=None):
+    return (str,), max_length, required, pattern
+
+
+def _name(max_length=MAX_NAME_LENGTH, required=False):
+    return _text(max_length, required, NAME_PATTERN)
+
+
+def _number(required=False):
+    return (int,), None, required, None
+
+
+# Request context every handler reads: endpoint of the management api and the sender
+EVENT = compile_schema({'connectionId': _text(128, True), 'domainName': _text(256, True),
+                        'stage': _text(128, True)})
+# Connect and disconnect do not post to connections, the management api endpoint is not needed
+CONNECTION_EVENT = compile_schema({'connectionId': _text(128, True), 'eventType': _text(16, True)})
+# Bodies by route
+SEND_MESSAGE = compile_schema({'content': _text(MAX_CONTENT_LENGTH, True), 'room': _name()})
+DIRECT_MESSAGE = compile_schema({'content': _text(MAX_CONTENT_LENGTH, True), 'to': _name(required=True)})
+ROOM_REQUEST = compile_schema({'room': _name()})
+SYNC_REQUEST = compile_schema({'room': _name(), 'since': _number()})
+# Query parameters of connect
+CONNECT_QUERY = compile_schema({'username': _name(), 'room': _name(), 'encoding': _name(16)})
+
+
+def validate_event(event, schema=EVENT):
+    """
+    Check the event carries the request context fields handlers need.
+    Raises:
+        ValueError: in case of absent or malformed field
+    """
+    if not isinstance(event, dict) or not isinstance(event.get('requestContext'), dict):
+        raise ValueError('requestContext is missing')
+    schema(event['requestContext'])
+    return event
+
+
+def parse_body(event, schema=None):
+    """
+    Decode event body to a dict and check it against the schema.
+    Raises:
+        ValueError: in case the body is too big, not a json object or does not match the schema
+    """
+    body = event.get('body')
+    if not isinstance(body, (str, bytes)):
+        raise ValueError('event body is missing')
+    size = len(body)
+    # utf-8 takes at most 4 bytes per character, text is only encoded when its length cannot tell
+    if isinstance(body, str) and size <= MAX_BODY_BYTES < size * 4:
+        size = len(body.encode('utf-8'))
+    if size > MAX_BODY_BYTES:
+        raise ValueError('event body is larger than {} bytes'.format(MAX_BODY_BYTES))
+    try:
+        data = _loads(body)
+    except _decode_error:
+        raise ValueError('event body could not be JSON decoded.')
+    if not isinstance(data, dict):
+        raise ValueError('Message body should be a valid dictionary')
+    return schema(data) if schema is not None else data
+
+
+def validate_query(event, schema=CONNECT_QUERY):
+    """Check query string parameters of connect request"""
+    return schema(event.get('queryStringParameters') or {})
@@ -0,0 +1,94 @@
+"""
+Wire encodings of frames sent to connections.
+
+A client picks its encoding with the `encoding` query parameter on connect:
+    json     - plain utf-8 json, the default
+    compact  - json without whitespace and with messages sent as
+               [username, content, ...] rows under "m", field names listed once in "f".
+               Fields other than username and content, like the sync "index", follow them
+    msgpack  - the plain frame packed with msgpack, available when msgpack is installed
+    zlib     - plain json, deflated with zlib once the frame reaches ZLIB_MIN_BYTES.
+               Compressed frames start with byte 0x78, plain ones with '{'
+"""
+import json
+import os
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DEFAULT_ENCODING = 'json'
+# Frames shorter than this are sent uncompressed to zlib clients
+ZLIB_MIN_BYTES = int(os.environ.get('ZLIB_MIN_BYTES', 1024))
+# Leading fields of every compact row, other message fields follow in order of appearance
+MESSAGE_FIELDS = ('username', 'content')
+
+
+def to_compact(frame):
+    """
+    Replace message dicts of the frame by rows of their field values, absent fields are null.
+    Frames without messages are left as they are.
+    """
+    if 'messages' not in frame:
+        return frame
+    compact = {key: value for key, value in frame.items() if key != 'messages'}
+    messages = frame['messages']
+    if isinstance(messages, dict):
+        messages = [messages]
+    fields = list(MESSAGE_FIELDS)
+    for message in messages:
+        fields.extend(field for field in message if field not in fields)
+    compact['f'] = fields
+    compact['m'] = [[message.get(field) for field in fields] for message in messages]
+    return compact
+
+
+def encode_json(frame):
+    return json.dumps(frame).encode('utf-8')
+
+
+def encode_compact(frame):
+    return json.dumps(to_compact(frame), separators=(',', ':')).encode('utf-8')
+
+
+def encode_msgpack(frame):
+    return msgpack.packb(frame, use_bin_type=True)
+
+
+def encode_zlib(frame):
+    data = encode_json(frame)
+    if len(data) < ZLIB_MIN_BYTES:
+        return data
+    return zlib.compress(data)
+
+
+ENCODERS = {'json': encode_json, 'compact': encode_compact, 'zlib': encode_zlib}
+if msgpack is not None:
+    ENCODERS['msgpack'] = encode_msgpack
+
+
+def is_supported(encoding):
+    return encoding in ENCODERS
+
+
+def encode(frame, encoding=DEFAULT_ENCODING):
+    """Encode frame, unknown encodings fall back to the default one"""
+    return ENCODERS.get(encoding, ENCODERS[DEFAULT_ENCODING])(frame)
+
+
+class FrameEncoder:
+    """Encodes one frame lazily, each encoding at most once"""
+
+    def __init__(self, frame):
+        self.frame = frame
+        self._encoded = {}
+
+    def __call__(self, encoding=DEFAULT_ENCODING):
+        if not is_supported(encoding):
+            encoding = DEFAULT_ENCODING
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = self._encoded[encoding] = encode(self.frame, encoding)
+        return data
@@ -0,0 +1,35 @@
+from unittest import mock
+import unittest
+import aws_resources
+
+
+class TestAwsResources(unittest.TestCase):
+
+    def setUp(self):
+        aws_resources.clear_cache()
+
+    @mock.patch('aws_resources.boto3.resource')
+    def test_table_handles_are_cached(self, resource_mock):
+        # Given: Nothing was requested from dynamodb yet
+        resource_mock.assert_not_called()
+        # When: The same table is requested several times
+        tables = [aws_resources.get_table('test_table') for _ in range(3)]
+        # Then: Resource and table handle are created only once
+        resource_mock.assert_called_once_with('dynamodb')
+        resource_mock.return_value.Table.assert_called_once_with('test_table')
+        self.assertTrue(all(table is tables[0] for table in tables))
+
+    @mock.patch('aws_resources.boto3.client')
+    def test_gateway_clients_are_cached_per_endpoint(self, client_mock):
+        client_mock.side_effect = lambda *_, **__: mock.Mock()
+        # When: Clients are requested for two endpoints
+        first = aws_resources.get_gateway_client('https://first/Prod')
+        second = aws_resources.get_gateway_client('https://second/Prod')
+        # Then: One client is created for each endpoint and reused afterwards
+        self.assertIsNot(first, second)
+        self.assertIs(first, aws_resources.get_gateway_client('https://first/Prod'))
+        self.assertEqual(client_mock.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
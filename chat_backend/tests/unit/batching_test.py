@@ -0,0 +1,93 @@
+import os
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+import aws_resources
+from batching import MessageBatcher
+from message.app import send_message
+from chat_backend.tests.unit.test_data import send_message_event as send_ev
+
+
+def submit_concurrently(batcher, count, room='general'):
+    results = [None] * count
+
+    def submit(i):
+        results[i] = batcher.submit(room, {'username': 'a', 'content': str(i)}, send_ev)
+
+    workers = [threading.Thread(target=submit, args=(i,)) for i in range(count)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+class TestMessageBatcher(unittest.TestCase):
+
+    def test_messages_within_window_are_delivered_once(self):
+        # Given: Batcher with 200 ms window
+        deliver = mock.Mock(return_value={'sent': 3})
+        batcher = MessageBatcher(deliver, window=0.2, max_messages=100)
+        # When: 5 messages are submitted at the same time
+        results = submit_concurrently(batcher, 5)
+        # Then: They are delivered together with a single call
+        deliver.assert_called_once()
+        room, messages, _ = deliver.call_args[0]
+        self.assertEqual(room, 'general')
+        self.assertEqual(sorted(m['content'] for m in messages), ['0', '1', '2', '3', '4'])
+        # Then: Every sender gets result of the shared delivery
+        self.assertTrue(all(r == {'sent': 3, 'batched': 5} for r in results))
+        self.assertEqual(batcher.stats()['delivery_latency']['count'], 5)
+
+    def test_full_batch_is_delivered_before_window_ends(self):
+        # Given: Batcher with long window and batches of at most 3 messages
+        deliver = mock.Mock(return_value={'sent': 1})
+        batcher = MessageBatcher(deliver, window=10, max_messages=3)
+        # When: 3 messages are submitted
+        started = time.monotonic()
+        submit_concurrently(batcher, 3)
+        # Then: Batch goes out without waiting for the window
+        self.assertLess(time.monotonic() - started, 5)
+        deliver.assert_called_once()
+
+    def test_rooms_are_batched_separately(self):
+        deliver = mock.Mock(return_value={'sent': 1})
+        batcher = MessageBatcher(deliver, window=0.05, max_messages=100)
+        batcher.submit('general', {'username': 'a', 'content': 'x'}, send_ev)
+        batcher.submit('random', {'username': 'a', 'content': 'y'}, send_ev)
+        self.assertEqual([c[0][0] for c in deliver.call_args_list], ['general', 'random'])
+
+    def test_delivery_error_reaches_every_sender(self):
+        batcher = MessageBatcher(mock.Mock(side_effect=RuntimeError('boom')), window=0.01)
+        with self.assertRaises(RuntimeError):
+            batcher.submit('general', {'username': 'a', 'content': 'x'}, send_ev)
+
+
+@mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table"})
+@mock.patch.dict(os.environ, {"MESSAGE_TABLE_NAME": "test_message_table"})
+class TestBatchedSending(unittest.TestCase):
+
+    def setUp(self):
+        aws_resources.clear_cache()
+
+    @mock.patch('batching.message_batcher.window', 0.01)
+    @mock.patch('aws_resources.boto3.resource')
+    @mock.patch('boto3.client')
+    def test_batched_frame_has_history_shape(self, api_gateway_mock, resource_mock):
+        # Given: One connection in the room and batching enabled
+        table = resource_mock.return_value.Table.return_value
+        table.update_item.return_value = {'Attributes': {'next_index': 1}}
+        table.query.return_value = {'Items': [{'connectionId': 'conn_0'}]}
+        # When: Message is sent
+        response = send_message(send_ev, "")
+        # Then: Connection gets a list of messages like the one history response carries
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(json.loads(response['body'])['batched'], 1)
+        frame = json.loads(api_gateway_mock.return_value.post_to_connection.call_args[1]['Data'])
+        self.assertEqual(frame, {'messages': [{'username': 'Mate', 'content': 'Must be something useful', 'index': 0}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import json
+import os
+import time
+import unittest
+from unittest import mock
+import aws_resources
+import utils
+import sweeper
+from user_index import user_connections
+from message.app import heartbeat, sweep_connections, send_message, get_presence, get_recent_messages
+from chat_backend.ws_connection.app import connection_manager
+from chat_backend.benchmarks.fakes import FakeGateway, build_connection_table, build_message_table
+from chat_backend.tests.unit.test_data import web_socket_connect_event, send_message_event
+
+SENDER = send_message_event['requestContext']['connectionId']
+ENDPOINT = utils.get_endpoint_url(send_message_event)
+
+
+@mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table", "MESSAGE_TABLE_NAME": "test_message_table"})
+@mock.patch('connection_expiry.CONNECTION_TTL', 600)
+class TestConnectionExpiry(unittest.TestCase):
+
+    def setUp(self):
+        aws_resources.clear_cache()
+        user_connections.clear()
+        utils._connection_items.clear()
+        utils._connection_refreshes.clear()
+        self.table = build_connection_table('test_conn_table', page_size=10)
+        self.gateway = FakeGateway()
+        self.gateway.keep_frames = True
+        aws_resources.register_table(self.table.name, self.table)
+        aws_resources.register_table('test_message_table', build_message_table('test_message_table'))
+        aws_resources.register_gateway_client(ENDPOINT, self.gateway)
+
+    def tearDown(self):
+        aws_resources.clear_cache()
+
+    def add_connections(self, count, prefix, expires, room='general'):
+        for i in range(count):
+            self.table.put_item(Item={'connectionId': f'{prefix}_{i}', 'room': room, 'expiresAt': expires})
+
+    def test_connect_stores_expiry(self):
+        response = connection_manager(web_socket_connect_event, "")
+        self.assertEqual(response['statusCode'], 200)
+        expires = int(self.table.items()[0]['expiresAt'])
+        self.assertAlmostEqual(expires, time.time() + 600, delta=5)
+
+    def test_broadcast_skips_expired_connections(self):
+        # Given: Room with 3 live connections and 5 whose clients stopped sending heartbeats
+        self.add_connections(3, 'live', int(time.time()) + 600)
+        self.add_connections(5, 'expired', 1)
+        # When: Message is broadcast to the room
+        response = utils.broadcast_message('Mate', {'content': 'hi'}, send_message_event)
+        # Then: Only live connections are posted to
+        self.assertEqual(json.loads(response['body'])['sent'], 3)
+        self.assertEqual(sorted(self.gateway.received), ['live_0', 'live_1', 'live_2'])
+
+    def test_heartbeat_moves_expiry_forward(self):
+        self.table.put_item(Item={'connectionId': SENDER, 'room': 'general', 'expiresAt': int(time.time()) + 10})
+        response = heartbeat(send_message_event, "")
+        self.assertEqual(response['statusCode'], 200)
+        self.assertGreater(self.table.items()[0]['expiresAt'], time.time() + 500)
+
+    def test_expired_connection_is_told_to_reconnect(self):
+        # Given: Row of the sender has expired
+        self.table.put_item(Item={'connectionId': SENDER, 'room': 'general', 'expiresAt': 1})
+        # When: Late heartbeat arrives
+        response = heartbeat(send_message_event, "")
+        # Then: Row is not revived and the client is asked to reconnect
+        self.assertEqual(response['statusCode'], 410)
+        self.assertEqual(self.table.items()[0]['expiresAt'], 1)
+        frame = json.loads(self.gateway.received[SENDER][0])
+        self.assertEqual(frame['reconnect']['reason'], 'expired')
+
+    def test_sending_messages_keeps_connection_alive(self):
+        # Given: Sender which never sends heartbeats, its row expires in 10 seconds
+        self.table.put_item(Item={'connectionId': SENDER, 'room': 'general', 'expiresAt': int(time.time()) + 10})
+        # When: It sends 3 messages
+        responses = [send_message(send_message_event, "") for _ in range(3)]
+        # Then: Expiry is moved forward once, not on every message
+        self.assertEqual([r['statusCode'] for r in responses], [200, 200, 200])
+        self.assertGreater(self.table.items()[0]['expiresAt'], time.time() + 500)
+        self.assertEqual(self.table.calls['UpdateItem'], 1)
+
+    def test_first_action_of_new_connection_does_not_write(self):
+        # Given: Connection opened a second ago, connect stored its expiry
+        self.table.put_item(Item={'connectionId': SENDER, 'room': 'general', 'expiresAt': int(time.time()) + 599})
+        request_context = dict(send_message_event['requestContext'], connectedAt=int(time.time() * 1000) - 1000)
+        event = dict(send_message_event, requestContext=request_context,
+                     body=json.dumps({'action': 'getrecentmessages'}))
+        # When: Client asks for history right after connecting
+        response = get_recent_messages(event, "")
+        # Then: Row is not written again
+        self.assertEqual(response['statusCode'], 200)
+        self.assertNotIn('UpdateItem', self.table.calls)
+
+    def test_message_from_expired_connection_is_not_sent(self):
+        self.table.put_item(Item={'connectionId': SENDER, 'room': 'general', 'expiresAt': 1})
+        response = send_message(send_message_event, "")
+        self.assertEqual(response['statusCode'], 410)
+        frame = json.loads(self.gateway.received[SENDER][0])
+        self.assertEqual(frame['reconnect']['reason'], 'expired')
+
+    def test_presence_skips_expired_connections(self):
+        # Given: Room with a live user and a user whose client is gone
+        self.table.put_item(Item={'connectionId': SENDER, 'room': 'general', 'username': 'alice',
+                                  'expiresAt': int(time.time()) + 600})
+        self.table.put_item(Item={'connectionId': 'gone_0', 'room': 'general', 'username': 'bob', 'expiresAt': 1})
+        # When: Presence of the room is asked for
+        response = get_presence(dict(send_message_event, body=json.dumps({'room': 'general'})), "")
+        # Then: Only the live user is reported online
+        self.assertEqual(response['statusCode'], 200)
+        frame = json.loads(self.gateway.received[SENDER][0])
+        self.assertEqual(frame['presence']['users'], ['alice'])
+
+    @mock.patch('sweeper.SWEEP_ENDPOINT', '')
+    def test_sweep_removes_expired_rows_in_batches(self):
+        # Given: 60 expired and 4 live rows, read 10 per scan page
+        self.add_connections(4, 'live', int(time.time()) + 600)
+        self.add_connections(40, 'expired', 1)
+        self.add_connections(20, 'expired_other', 1, room='other')
+        # When: Sweeper runs
+        response = sweep_connections({}, "")
+        summary = json.loads(response['body'])
+        # Then: Expired rows are deleted 25 per batch and live ones are kept
+        self.assertEqual(summary, {'scanned': 60, 'expired': 60, 'gone': 0, 'removed': 60,
+                                   'rooms': 2, 'saved_sends': 60})
+        self.assertEqual(self.table.calls['BatchWriteItem'], 3)
+        self.assertGreater(self.table.calls['Scan'], 1)
+        self.assertEqual(sorted(x['connectionId'] for x in self.table.items()),
+                         ['live_0', 'live_1', 'live_2', 'live_3'])
+
+    def test_sweep_removes_connections_reported_gone(self):
+        # Given: Live rows of which api gateway reports 2 as gone, and one expired row
+        self.add_connections(5, 'live', int(time.time()) + 600)
+        self.add_connections(1, 'expired', 1)
+        self.gateway.gone = {'live_1', 'live_3'}
+        # When: Sweeper checks connections against the management api
+        summary = sweeper.sweep(endpoint=ENDPOINT)
+        # Then: Gone and expired rows are removed
+        self.assertEqual((summary['expired'], summary['gone'], summary['removed']), (1, 2, 3))
+        self.assertEqual(sorted(x['connectionId'] for x in self.table.items()), ['live_0', 'live_2', 'live_4'])
+
+    @mock.patch('utils.BATCH_WRITE_RETRY_MS', 0)
+    def test_unprocessed_deletes_are_retried(self):
+        # Given: Table leaving the first key of the first batch unprocessed
+        self.add_connections(3, 'expired', 1)
+        batch_write_item = self.table.batch_write_item
+        calls = []
+
+        def throttle_first(RequestItems):
+            calls.append(RequestItems)
+            requests = RequestItems[self.table.name]
+            if len(calls) > 1:
+                return batch_write_item(RequestItems=RequestItems)
+            batch_write_item(RequestItems={self.table.name: requests[1:]})
+            return {'UnprocessedItems': {self.table.name: requests[:1]}}
+
+        with mock.patch.object(self.table, 'batch_write_item', side_effect=throttle_first):
+            removed = utils.delete_connections(['expired_0', 'expired_1', 'expired_2'])
+        # Then: Key left unprocessed is deleted by the retry
+        self.assertEqual(removed, 3)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(self.table), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import copy
+import json
+import os
+import unittest
+from unittest import mock
+import aws_resources
+import utils
+from user_index import UserConnectionCache, user_connections
+from message.app import direct_message, get_presence
+from chat_backend.ws_connection.app import connection_manager
+from chat_backend.benchmarks.fakes import FakeGateway, build_connection_table
+from chat_backend.tests.unit.test_data import web_socket_connect_event, send_message_event
+from chat_backend.tests.unit.test_helpers import FakeClock
+
+
+class TestUserConnectionCache(unittest.TestCase):
+
+    def test_connections_expire_after_ttl(self):
+        clock = FakeClock()
+        cache = UserConnectionCache(ttl=5, clock=clock)
+        cache.fill('loha', [('conn_1', 'json')])
+        clock.now = 6
+        self.assertIsNone(cache.get('loha'))
+
+    def test_gone_connections_are_discarded(self):
+        # Given: User with two cached connections
+        cache = UserConnectionCache(ttl=5, clock=FakeClock())
+        cache.fill('loha', [('conn_1', 'json'), ('conn_2', 'compact')])
+        # When: The first one is reported as gone
+        cache.discard('conn_1')
+        # Then: Only the open connection is cached
+        self.assertEqual(cache.get('loha'), [('conn_2', 'compact')])
+
+
+@mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table"})
+class TestDirectMessages(unittest.TestCase):
+
+    def setUp(self):
+        aws_resources.clear_cache()
+        user_connections.clear()
+        utils._connection_items.clear()
+        self.table = build_connection_table('test_conn_table')
+        self.gateway = FakeGateway()
+        self.gateway.keep_frames = True
+        aws_resources.register_table(self.table.name, self.table)
+        aws_resources.register_gateway_client(utils.get_endpoint_url(send_message_event), self.gateway)
+
+    def connect(self, connection_id, username, room='general'):
+        event = copy.deepcopy(web_socket_connect_event)
+        event['requestContext']['connectionId'] = connection_id
+        event['queryStringParameters'] = {'username': username, 'room': room}
+        return connection_manager(event, None)
+
+    def disconnect(self, connection_id):
+        event = copy.deepcopy(web_socket_connect_event)
+        event['requestContext'].update(connectionId=connection_id, eventType='DISCONNECT')
+        return connection_manager(event, None)
+
+    def message_event(self, connection_id, body):
+        event = copy.deepcopy(send_message_event)
+        event['requestContext']['connectionId'] = connection_id
+        event['body'] = json.dumps(body)
+        return event
+
+    def send_direct(self, sender, to, content='hi'):
+        return direct_message(self.message_event(sender, {'action': 'directmessage', 'to': to,
+                                                          'content': content}), None)
+
+    def test_direct_message_reaches_every_connection_of_user_only(self):
+        # Given: Bob is connected twice, Alice and Carol once
+        self.connect('alice_1', 'alice')
+        self.connect('bob_1', 'bob')
+        self.connect('bob_2', 'bob', room='random')
+        self.connect('carol_1', 'carol')
+        # When: Alice sends a direct message to Bob
+        response = self.send_direct('alice_1', 'bob')
+        # Then: Both connections of Bob get it from Alice, found without a table scan
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(sorted(self.gateway.received), ['bob_1', 'bob_2'])
+        self.assertEqual(json.loads(self.gateway.received['bob_1'][0]),
+                         {'direct': {'from': 'alice', 'to': 'bob', 'content': 'hi'}})
+        self.assertNotIn('Scan', self.table.calls)
+
+    def test_warm_lookup_drops_connections_reported_gone(self):
+        # Given: Bob connections are cached by the first direct message
+        self.connect('alice_1', 'alice')
+        self.connect('bob_1', 'bob')
+        self.connect('bob_2', 'bob')
+        self.send_direct('alice_1', 'bob', 'first')
+        queries = self.table.calls['Query']
+        # When: One of Bob connections is closed, which the direct message container does not see
+        self.disconnect('bob_1')
+        self.gateway.gone.add('bob_1')
+        self.send_direct('alice_1', 'bob', 'second')
+        self.send_direct('alice_1', 'bob', 'third')
+        # Then: Gone connection is posted to once more and dropped, messages are served from the cache
+        self.assertEqual(len(self.gateway.received['bob_1']), 1)
+        self.assertEqual(len(self.gateway.received['bob_2']), 3)
+        self.assertEqual(self.table.calls['Query'], queries)
+
+    def test_new_connections_show_up_after_ttl(self):
+        # Given: Bob connections are cached by the first direct message
+        self.connect('alice_1', 'alice')
+        self.connect('bob_1', 'bob')
+        self.send_direct('alice_1', 'bob', 'first')
+        # When: Bob opens another connection through the connection manager
+        self.connect('bob_2', 'bob')
+        self.send_direct('alice_1', 'bob', 'cached')
+        with mock.patch.object(user_connections, 'ttl', -1):
+            self.send_direct('alice_1', 'bob', 'expired')
+        # Then: Cached lookup does not know it yet, the one after the ttl does
+        self.assertEqual(len(self.gateway.received['bob_1']), 3)
+        self.assertEqual(len(self.gateway.received['bob_2']), 1)
+
+    def test_message_to_user_offline_is_rejected(self):
+        self.connect('alice_1', 'alice')
+        response = self.send_direct('alice_1', 'nobody')
+        self.assertEqual(response['statusCode'], 404)
+        self.assertEqual(self.gateway.posts, 0)
+
+    def test_message_without_recipient_is_rejected(self):
+        self.connect('alice_1', 'alice')
+        response = direct_message(self.message_event('alice_1', {'action': 'directmessage', 'content': 'hi'}), None)
+        self.assertEqual(response['statusCode'], 400)
+
+    def test_presence_lists_users_online_in_room(self):
+        # Given: Users in two rooms, Bob connected twice
+        self.connect('alice_1', 'alice')
+        self.connect('bob_1', 'bob')
+        self.connect('bob_2', 'bob')
+        self.connect('carol_1', 'carol', room='random')
+        # When: Alice asks who is online in her room
+        response = get_presence(self.message_event('alice_1', {'action': 'getpresence', 'room': 'general'}), None)
+        # Then: Every user of the room is listed once
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(json.loads(self.gateway.received['alice_1'][0]),
+                         {'presence': {'room': 'general', 'users': ['alice', 'bob']}})
+        self.assertNotIn('Scan', self.table.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
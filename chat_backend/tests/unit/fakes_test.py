@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+from botocore.exceptions import ClientError
+from chat_backend.benchmarks.fakes import FakeGateway, build_connection_table, build_message_table
+from chat_backend.benchmarks import BASE_DIR
+from chat_backend.benchmarks.load_test import run_scenario
+
+
+class TestFakes(unittest.TestCase):
+
+    def test_room_index_query_is_paginated(self):
+        # Given: 5 connections in room 'a' and one in room 'b', pages of 2 items
+        table = build_connection_table(page_size=2)
+        for i in range(5):
+            table.put_item(Item={'connectionId': f'conn_{i}', 'room': 'a'})
+        table.put_item(Item={'connectionId': 'other', 'room': 'b'})
+        # When: Room 'a' is queried page by page
+        pages, start = [], None
+        while True:
+            kwargs = {'ExclusiveStartKey': start} if start else {}
+            page = table.query(IndexName='room-index', KeyConditionExpression='room = :room',
+                               ExpressionAttributeValues={':room': 'a'}, **kwargs)
+            pages.append([x['connectionId'] for x in page['Items']])
+            start = page.get('LastEvaluatedKey')
+            if not start:
+                break
+        # Then: Every member is returned exactly once
+        self.assertEqual(pages, [['conn_0', 'conn_1'], ['conn_2', 'conn_3'], ['conn_4']])
+
+    def test_conditions_and_counters(self):
+        table = build_message_table()
+        key = {'room': 'counter#a', 'index': 0}
+        self.assertEqual(table.update_item(Key=key, UpdateExpression='ADD next_index :size',
+                                           ExpressionAttributeValues={':size': 5},
+                                           ReturnValues='UPDATED_NEW')['Attributes']['next_index'], 5)
+        table.put_item(Item={'room': 'a', 'index': 1})
+        with self.assertRaises(ClientError):
+            table.put_item(Item={'room': 'a', 'index': 1}, ConditionExpression='attribute_not_exists(#index)',
+                           ExpressionAttributeNames={'#index': 'index'})
+        newer = table.query(KeyConditionExpression='room = :room AND #index > :since',
+                            ExpressionAttributeNames={'#index': 'index'},
+                            ExpressionAttributeValues={':room': 'a', ':since': 0})
+        self.assertEqual(newer['Count'], 1)
+
+    def test_gateway_reports_gone_connections(self):
+        gateway = FakeGateway(gone={'conn_0'})
+        with self.assertRaises(ClientError) as error:
+            gateway.post_to_connection(ConnectionId='conn_0', Data=b'{}')
+        self.assertEqual(error.exception.response['Error']['Code'], 'GoneException')
+
+
+@mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table", "MESSAGE_TABLE_NAME": "test_message_table"})
+class TestLoadTest(unittest.TestCase):
+
+    def test_small_scenario_runs_without_errors(self):
+        results = {x['operation']: x for x in run_scenario(connections=10, messages=3, gone_rate=0.2)}
+        self.assertEqual(set(results), {'connect', 'send', 'broadcast', 'history'})
+        self.assertTrue(all(x['errors'] == 0 for x in results.values()))
+        self.assertEqual(results['connect']['count'], 10)
+        self.assertGreater(results['broadcast']['deliveries_per_second'], 0)
+
+    def test_benchmark_scripts_start_without_runtests(self):
+        # Given: Clean interpreter started from the repository root, lambda code is not on the path
+        env = {key: value for key, value in os.environ.items() if key != 'PYTHONPATH'}
+        for script in ('load_test', 'write_throughput', 'runtime_comparison'):
+            with self.subTest(script=script):
+                # When: Benchmark is run as a module
+                done = subprocess.run([sys.executable, '-m', f'chat_backend.benchmarks.{script}', '--help'],
+                                      cwd=os.path.dirname(BASE_DIR), env=env, capture_output=True, text=True)
+                # Then: It imports the handlers it drives
+                self.assertEqual(done.returncode, 0, done.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
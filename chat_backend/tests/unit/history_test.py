@@ -0,0 +1,84 @@
+import os
+import json
+import unittest
+from unittest import mock
+import aws_resources
+from history import HistoryCache, history_cache
+from message.app import get_recent_messages
+from utils import put_message_to_db
+from chat_backend.tests.unit.test_data import send_message_event as send_ev
+from chat_backend.tests.unit.test_helpers import FakeClock
+
+
+class TestHistoryCache(unittest.TestCase):
+
+    def test_history_expires_after_ttl(self):
+        # Given: Room history cached at time 0 with 5 seconds ttl
+        clock = FakeClock()
+        cache = HistoryCache(size=3, ttl=5, clock=clock)
+        cache.fill('general', [{'index': 1}])
+        # When: History is read before and after the ttl
+        clock.now = 5
+        fresh = cache.get('general')
+        clock.now = 6
+        expired = cache.get('general')
+        # Then: Only the fresh read is a hit
+        self.assertEqual(fresh, [{'index': 1}])
+        self.assertIsNone(expired)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_write_through_keeps_newest_messages_in_order(self):
+        # Given: Room history of 3 messages is cached
+        cache = HistoryCache(size=3, ttl=5, clock=FakeClock())
+        cache.fill('general', [{'index': i} for i in range(3)])
+        # When: Newer messages are stored, one of them out of order
+        cache.append('general', {'index': 4})
+        cache.append('general', {'index': 3})
+        # Then: Only the 3 newest are kept oldest first
+        self.assertEqual(cache.get('general'), [{'index': i} for i in (2, 3, 4)])
+
+    def test_write_through_skips_rooms_not_cached(self):
+        cache = HistoryCache(size=3, ttl=5, clock=FakeClock())
+        cache.append('general', {'index': 1})
+        self.assertIsNone(cache.get('general'))
+
+
+@mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table"})
+@mock.patch.dict(os.environ, {"MESSAGE_TABLE_NAME": "test_message_table"})
+class TestRecentMessages(unittest.TestCase):
+
+    def setUp(self):
+        aws_resources.clear_cache()
+        history_cache.clear()
+
+    @mock.patch('metrics.METRICS_SAMPLE_RATE', 1.0)
+    @mock.patch('metrics.emit')
+    @mock.patch('aws_resources.boto3.resource')
+    @mock.patch('boto3.client')
+    def test_repeated_requests_are_served_from_cache(self, api_gateway_mock, resource_mock, emit_mock):
+        # Given: Message table with 2 messages in room 'general'
+        message_table = resource_mock.return_value.Table.return_value
+        message_table.query.return_value = {'Items': [
+            {'index': 1, 'username': 'b', 'content': 'second'},
+            {'index': 0, 'username': 'a', 'content': 'first'}]}
+        message_table.update_item.return_value = {'Attributes': {'next_index': 3}}
+        # When: History is requested, a message is stored and history is requested again
+        get_recent_messages(send_ev, "")
+        put_message_to_db('c', {'content': 'third'})
+        response = get_recent_messages(send_ev, "")
+        # Then: The table is queried once and the message stored by the same container is appended
+        self.assertEqual(response['statusCode'], 200)
+        message_table.query.assert_called_once()
+        self.assertEqual((history_cache.hits, history_cache.misses), (1, 1))
+        # Then: Hits and misses are reported as metrics
+        records = [c[0][0] for c in emit_mock.call_args_list]
+        self.assertEqual([(r.get('HistoryCacheMiss', 0), r.get('HistoryCacheHit', 0)) for r in records],
+                         [(1, 0), (0, 1)])
+        sent = api_gateway_mock.return_value.post_to_connection.call_args[1]['Data']
+        self.assertEqual(json.loads(sent)['messages'], [{'username': 'a', 'content': 'first', 'index': 0},
+                                                         {'username': 'b', 'content': 'second', 'index': 1},
+                                                         {'username': 'c', 'content': 'third', 'index': 2}])
+
+
+if __name__ == '__main__':
+    unittest.main()
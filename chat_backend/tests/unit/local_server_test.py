@@ -0,0 +1,56 @@
+import asyncio
+import json
+import os
+import unittest
+from unittest import mock
+import aws_resources
+from chat_backend.local_server import server
+
+try:
+    from websockets.asyncio.client import connect
+except ImportError:
+    connect = None
+
+
+@unittest.skipIf(connect is None, 'websockets is not installed')
+@mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table", "MESSAGE_TABLE_NAME": "test_message_table"})
+class TestLocalServer(unittest.TestCase):
+
+    def tearDown(self):
+        aws_resources.clear_cache()
+
+    def test_message_reaches_room_members_through_sockets(self):
+        async def scenario():
+            chat = await server.ChatServer(port=0).start()
+            url = 'ws://{}'.format(chat.domain_name)
+            try:
+                async with connect(url + '/?username=alice&room=local') as alice, \
+                        connect(url + '/?username=bob&room=local') as bob, \
+                        connect(url + '/?username=carol&room=other') as carol:
+                    await alice.send(json.dumps({'action': 'sendmessage', 'room': 'local', 'content': 'hi'}))
+                    received = json.loads(await asyncio.wait_for(bob.recv(), 5))
+                    own = json.loads(await asyncio.wait_for(alice.recv(), 5))
+                    with self.assertRaises(asyncio.TimeoutError):
+                        await asyncio.wait_for(carol.recv(), 0.2)
+                    await bob.send(json.dumps({'action': 'getrecentmessages', 'room': 'local'}))
+                    history = json.loads(await asyncio.wait_for(bob.recv(), 5))
+                connections = aws_resources.get_table(os.environ['CONNECTION_TABLE_NAME'])
+                for _ in range(50):
+                    if not len(connections):
+                        break
+                    await asyncio.sleep(0.02)
+                return received, own, history, len(connections)
+            finally:
+                await chat.stop()
+
+        received, own, history, connections_left = asyncio.run(scenario())
+        # Then: Both members of the room get the message, the other room does not
+        self.assertEqual(received, {'messages': {'username': 'Mate', 'content': 'hi', 'index': 0}})
+        self.assertEqual(own, received)
+        self.assertEqual(history, {'messages': [{'username': 'Mate', 'content': 'hi', 'index': 0}]})
+        # Then: Closed sockets are removed from connection table
+        self.assertEqual(connections_left, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
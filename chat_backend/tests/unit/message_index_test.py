@@ -0,0 +1,150 @@
+import os
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from botocore.exceptions import ClientError
+import utils
+from utils import put_message_to_db
+
+
+class CounterTable:
+    """Thread safe stand-in of message table supporting calls used for index allocation"""
+
+    def __init__(self, items=()):
+        self.lock = threading.Lock()
+        self.items = {(item['room'], item['index']): dict(item) for item in items}
+        self.round_trips = 0
+
+    def update_item(self, Key, ExpressionAttributeValues, ConditionExpression=None, **_):
+        with self.lock:
+            self.round_trips += 1
+            item = self.items.setdefault((Key['room'], Key['index']), dict(Key))
+            if ':size' in ExpressionAttributeValues:
+                item['next_index'] = item.get('next_index', 0) + ExpressionAttributeValues[':size']
+            elif item.get('next_index', -1) < ExpressionAttributeValues[':next']:
+                item['next_index'] = ExpressionAttributeValues[':next']
+            else:
+                raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+            return {'Attributes': {'next_index': item['next_index']}}
+
+    def put_item(self, Item, **_):
+        with self.lock:
+            self.round_trips += 1
+            key = (Item['room'], Item['index'])
+            if key in self.items:
+                raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+            self.items[key] = dict(Item)
+
+    def query(self, ExpressionAttributeValues, **_):
+        with self.lock:
+            self.round_trips += 1
+            indexes = [index for room, index in self.items if room == ExpressionAttributeValues[':room']]
+            return {'Items': [{'index': max(indexes)}] if indexes else []}
+
+    def messages(self):
+        return [item for (room, _), item in self.items.items() if room == 'general']
+
+
+class ContainerBlocks:
+    """Index blocks kept apart per container, every thread stands for one warm container"""
+
+    def __init__(self):
+        self.containers = {}
+
+    def blocks(self):
+        return self.containers.setdefault(threading.current_thread().name, {})
+
+    def get(self, room):
+        return self.blocks().get(room)
+
+    def __setitem__(self, room, block):
+        self.blocks()[room] = block
+
+    def pop(self, room, default=None):
+        return self.blocks().pop(room, default)
+
+
+@mock.patch.dict(os.environ, {"MESSAGE_TABLE_NAME": "test_message_table"})
+class TestMessageIndex(unittest.TestCase):
+
+    def setUp(self):
+        utils._index_blocks.clear()
+
+    def send_concurrently(self, table, threads=8, messages_per_thread=100):
+        def send(thread_number):
+            for i in range(messages_per_thread):
+                put_message_to_db(f'user_{thread_number}', {'content': f'{thread_number}-{i}'})
+
+        with mock.patch('utils.get_message_table', lambda: table):
+            workers = [threading.Thread(target=send, args=(n,)) for n in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+    def test_concurrent_senders_do_not_lose_messages(self):
+        # Given: Empty message table
+        table = CounterTable()
+        # When: 8 threads send 100 messages each at the same time
+        self.send_concurrently(table)
+        # Then: Every message is stored under its own index
+        messages = table.messages()
+        self.assertEqual(len(messages), 800)
+        self.assertEqual(sorted(m['index'] for m in messages), list(range(800)))
+        # Then: Allocation costs one round trip per message on top of the write
+        self.assertEqual(table.round_trips, 1600)
+
+    @mock.patch('utils._index_blocks', new_callable=ContainerBlocks)
+    def test_messages_of_two_containers_keep_send_order(self, blocks):
+        # Given: Two warm containers taking turns sending to one room
+        table = CounterTable()
+        containers = [ThreadPoolExecutor(1, thread_name_prefix=f'container_{n}') for n in range(2)]
+        stored = []
+        with mock.patch('utils.get_message_table', lambda: table):
+            for i in range(200):
+                future = containers[i % 3 % 2].submit(put_message_to_db, 'Mate', {'content': str(i)})
+                stored.append(future.result())
+                # When: A client syncs after every message
+                cursor = stored[-1]['index']
+                # Then: No message sent before is stored after the cursor
+                self.assertTrue(all(x['index'] <= cursor for x in stored))
+        for container in containers:
+            container.shutdown()
+        # Then: Indexes follow send order across containers and none is lost
+        self.assertEqual(len(blocks.containers), 2)
+        self.assertEqual([x['index'] for x in stored], list(range(200)))
+
+    @mock.patch('utils._index_blocks', new_callable=ContainerBlocks)
+    def test_concurrent_containers_do_not_lose_messages(self, blocks):
+        # Given: Empty message table
+        table = CounterTable()
+        # When: 8 containers send 100 messages each at the same time
+        self.send_concurrently(table)
+        # Then: Every message is stored under its own index
+        self.assertEqual(len(blocks.containers), 8)
+        self.assertEqual(sorted(m['index'] for m in table.messages()), list(range(800)))
+
+    @mock.patch('utils.MESSAGE_INDEX_BLOCK_SIZE', 50)
+    def test_index_blocks_are_served_from_container(self):
+        # Given: Empty message table and indexes reserved in blocks of 50
+        table = CounterTable()
+        # When: 8 threads send 100 messages each at the same time
+        self.send_concurrently(table)
+        # Then: No message is lost and only one counter update per block is made
+        self.assertEqual(len({m['index'] for m in table.messages()}), 800)
+        self.assertEqual(table.round_trips, 800 + 800 // 50)
+
+    def test_counter_recovers_from_messages_stored_before_it(self):
+        # Given: Room holding messages written without the counter
+        table = CounterTable({'room': 'general', 'index': i} for i in range(5))
+        # When: A message is sent
+        with mock.patch('utils.get_message_table', lambda: table):
+            item = put_message_to_db('Mate', {'content': 'hello'})
+        # Then: It is stored after the existing ones without overwriting them
+        self.assertEqual(item['index'], 5)
+        self.assertEqual(len(table.messages()), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
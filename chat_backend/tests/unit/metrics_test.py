@@ -0,0 +1,88 @@
+import os
+import unittest
+from unittest import mock
+import aws_resources
+import metrics
+from metrics import instrumented, stage, count
+from message.app import send_message
+from chat_backend.benchmarks.fakes import FakeGateway, build_connection_table, build_message_table
+from chat_backend.tests.unit.test_data import send_message_event as send_ev
+
+
+@instrumented('test_handler')
+def handler(event, context):
+    with stage('Work'):
+        count('Items', 3)
+    return {'statusCode': 200}
+
+
+class TestMetrics(unittest.TestCase):
+
+    @mock.patch('metrics.emit')
+    def test_record_is_emitted_in_embedded_metric_format(self, emit_mock):
+        # When: Instrumented handler is invoked
+        handler({}, None)
+        # Then: One record with stage duration and counters is emitted
+        record = emit_mock.call_args[0][0]
+        self.assertEqual((record['Handler'], record['StatusCode'], record['Items']), ('test_handler', 200, 3))
+        self.assertIn('WorkTime', record)
+        definition = record['_aws']['CloudWatchMetrics'][0]
+        self.assertEqual(definition['Dimensions'], [['Handler']])
+        units = {x['Name']: x['Unit'] for x in definition['Metrics']}
+        self.assertEqual((units['WorkTime'], units['Items']), ('Milliseconds', 'Count'))
+
+    @mock.patch('metrics.METRICS_SAMPLE_RATE', 0)
+    @mock.patch('metrics.emit')
+    def test_invocations_left_out_by_sampling_emit_nothing(self, emit_mock):
+        self.assertEqual(handler({}, None), {'statusCode': 200})
+        emit_mock.assert_not_called()
+        self.assertFalse(metrics.current().recording)
+
+    def test_consumed_capacity_hooks(self):
+        model = mock.Mock(input_shape=mock.Mock(members={'ReturnConsumedCapacity': None}))
+        recorder = metrics.InvocationMetrics('test')
+        with mock.patch('metrics.current', lambda: recorder):
+            params = {}
+            metrics.request_consumed_capacity(params, model)
+            metrics.record_consumed_capacity({'Count': 4, 'ConsumedCapacity': {'CapacityUnits': 0.5}})
+        self.assertEqual(params, {'ReturnConsumedCapacity': 'TOTAL'})
+        self.assertEqual(recorder.counters, {'ConsumedCapacity': 0.5, 'ItemsRead': 4})
+        # Not recorded invocation does not ask for capacity
+        params = {}
+        metrics.request_consumed_capacity(params, model)
+        self.assertEqual(params, {})
+
+
+@mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table"})
+@mock.patch.dict(os.environ, {"MESSAGE_TABLE_NAME": "test_message_table"})
+class TestHandlerMetrics(unittest.TestCase):
+
+    def setUp(self):
+        aws_resources.clear_cache()
+
+    def tearDown(self):
+        aws_resources.clear_cache()
+
+    @mock.patch('metrics.emit')
+    def test_send_message_reports_stages_and_fan_out(self, emit_mock):
+        # Given: Room with 3 members, one of them gone
+        connections = build_connection_table('test_conn_table')
+        for i in range(3):
+            connections.put_item(Item={'connectionId': f'conn_{i}', 'room': 'general'})
+        aws_resources.register_table('test_conn_table', connections)
+        aws_resources.register_table('test_message_table', build_message_table('test_message_table'))
+        aws_resources.register_gateway_client('https://n166pkl6b5.execute-api.us-east-2.amazonaws.com/Prod',
+                                              FakeGateway(gone={'conn_2'}))
+        # When: Message is sent
+        send_message(send_ev, "")
+        # Then: Every stage of the hot path and fan-out counters are reported
+        record = emit_mock.call_args[0][0]
+        for name in ('ValidateTime', 'AllocateIndexTime', 'EnqueueTime', 'PutItemTime', 'PersistTime',
+                     'BroadcastTime', 'RoomQueryTime', 'EncodeTime', 'FanOutTime', 'RemoveStaleTime'):
+            self.assertIn(name, record)
+        self.assertEqual((record['Connections'], record['Sent'], record['Failed'], record['Stale']),
+                         (3, 2, 0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
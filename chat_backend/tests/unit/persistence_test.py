@@ -0,0 +1,190 @@
+import os
+import threading
+import unittest
+from unittest import mock
+from botocore.exceptions import ClientError
+import aws_resources
+import metrics
+import utils
+from history import history_cache
+from persistence import PersistenceQueue, persistence_queue, enqueue_message, _Pending
+from message.app import send_message
+from chat_backend.benchmarks.fakes import FakeGateway, build_connection_table, build_message_table
+from chat_backend.tests.unit.test_data import send_message_event as send_ev
+
+
+def message_item(index, room='general'):
+    return {'room': room, 'index': index, 'timestamp': 0, 'username': 'a', 'content': f'message {index}'}
+
+
+def persistence_pending(index):
+    return _Pending('general', message_item(index))
+
+
+class BlockingStore:
+    """Single item store waiting until released"""
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.items = []
+
+    def __call__(self, room, item):
+        self.entered.set()
+        self.release.wait(5)
+        self.items.append(item)
+        return item
+
+
+class TestPersistenceQueue(unittest.TestCase):
+
+    def test_items_waiting_together_are_stored_in_groups_of_25(self):
+        # Given: Worker busy storing the first item
+        store = BlockingStore()
+        persistence = PersistenceQueue(store=store)
+        first = persistence.submit('general', message_item(0))
+        store.entered.wait(5)
+        # When: 60 more items are queued meanwhile
+        futures = [persistence.submit('general', message_item(i)) for i in range(1, 61)]
+        store.release.set()
+        persistence.join()
+        # Then: They are stored in concurrent groups of at most 25 items
+        self.assertEqual(first.result(1), message_item(0))
+        self.assertEqual(persistence.batches, 1 + 3)
+        self.assertEqual([f.result(1)['index'] for f in futures], list(range(1, 61)))
+        self.assertEqual(persistence.stats()['written'], 61)
+
+    def test_throttled_items_are_retried_with_backoff(self):
+        # Given: Store throttling 2 of 3 items once
+        calls, delays = [], []
+
+        def store(room, item):
+            calls.append(item['index'])
+            if item['index'] > 0 and calls.count(item['index']) == 1:
+                raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'PutItem')
+            return item
+
+        persistence = PersistenceQueue(store=store, retry_delay=0.01, sleep=delays.append)
+        batch = [persistence_pending(i) for i in range(3)]
+        # When: Batch is flushed
+        persistence.flush(batch)
+        # Then: Only throttled items are stored again and every item is stored
+        self.assertEqual(sorted(calls), [0, 1, 1, 2, 2])
+        self.assertEqual(delays, [0.01])
+        self.assertTrue(all(pending.future.result(0) for pending in batch))
+        self.assertEqual((persistence.retries, persistence.dropped), (1, 0))
+
+    def test_throttled_items_are_given_up_after_max_attempts(self):
+        def store(room, item):
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'PutItem')
+
+        persistence = PersistenceQueue(store=store, max_attempts=3, sleep=lambda _: None)
+        batch = [persistence_pending(i) for i in range(2)]
+        persistence.flush(batch)
+        self.assertEqual(persistence.dropped, 2)
+        with self.assertRaises(RuntimeError):
+            batch[0].future.result(0)
+
+    def test_puts_are_recorded_to_submitting_invocation(self):
+        # Given: Store timing its put and counting capacity like the dynamodb hooks do
+        model = mock.Mock(input_shape=mock.Mock(members={'ReturnConsumedCapacity': None}))
+        asked = []
+
+        def store(room, item):
+            with metrics.stage('PutItem'):
+                params = {}
+                metrics.request_consumed_capacity(params, model)
+                asked.append(params)
+                metrics.record_consumed_capacity({'ConsumedCapacity': {'CapacityUnits': 1.0}})
+            return item
+
+        persistence = PersistenceQueue(store=store)
+        recorder = metrics.InvocationMetrics('send_message')
+        # When: Invocation submits 2 items, stored by worker threads
+        with metrics.recording_to(recorder):
+            futures = [persistence.submit('general', message_item(i)) for i in range(2)]
+        persistence.join()
+        # Then: Put time and consumed capacity are part of the invocation metrics
+        self.assertTrue(all(f.result(1) for f in futures))
+        self.assertIn('PutItem', recorder.stages)
+        self.assertEqual(recorder.counters['ConsumedCapacity'], 2.0)
+        self.assertEqual(asked, [{'ReturnConsumedCapacity': 'TOTAL'}] * 2)
+        self.assertFalse(metrics.current().recording)
+
+
+@mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table"})
+@mock.patch.dict(os.environ, {"MESSAGE_TABLE_NAME": "test_message_table"})
+class TestPersistenceStage(unittest.TestCase):
+
+    def setUp(self):
+        aws_resources.clear_cache()
+        history_cache.clear()
+        utils._index_blocks.clear()
+        self.messages = build_message_table('test_message_table')
+        connections = build_connection_table('test_conn_table')
+        connections.put_item(Item={'connectionId': 'conn_0', 'room': 'general'})
+        self.gateway = FakeGateway()
+        aws_resources.register_table(self.messages.name, self.messages)
+        aws_resources.register_table(connections.name, connections)
+        aws_resources.register_gateway_client(utils.get_endpoint_url(send_ev), self.gateway)
+
+    def tearDown(self):
+        aws_resources.clear_cache()
+
+    def test_batched_items_never_overwrite_stored_messages(self):
+        # Given: Room holding messages the counter does not know about, with its history cached
+        old = [message_item(i) for i in range(5)]
+        for item in old:
+            self.messages.put_item(Item=dict(item, content='old'))
+        history_cache.fill('general', [{'index': x['index'], 'username': 'a', 'content': 'old'} for x in old])
+        # When: Messages get colliding indexes and are stored together while the worker is busy
+        store, batches = BlockingStore(), persistence_queue.batches
+        with mock.patch.object(persistence_queue, 'store', lambda room, item: store(room, item) and
+                               utils.store_message_item(room, item)):
+            futures = [enqueue_message('general', utils.build_message_item('b', {'content': f'new {i}'}))
+                       for i in range(4)]
+            store.entered.wait(5)
+            store.release.set()
+            persistence_queue.join()
+        # Then: Stored messages are kept and the new ones are stored under fresh indexes
+        stored = [f.result(1) for f in futures]
+        self.assertEqual(sum(x.get('content') == 'old' for x in self.messages.items()), 5)
+        self.assertEqual(len({x['index'] for x in stored}), 4)
+        self.assertTrue(all(x['index'] >= 5 for x in stored))
+        self.assertLess(persistence_queue.batches - batches, 4)
+        # Then: History serves every message once under the index it is stored with
+        cached = history_cache.get('general')
+        self.assertEqual([x['index'] for x in cached], sorted({x['index'] for x in cached}))
+        self.assertEqual([x['content'] for x in cached if x['username'] == 'b'],
+                         [x['content'] for x in sorted(stored, key=lambda x: x['index'])])
+
+    @mock.patch('message.app.DURABILITY_MODE', 'enqueue')
+    def test_enqueue_mode_answers_and_broadcasts_before_message_is_stored(self):
+        # Given: Persistence stage is slow
+        store = BlockingStore()
+        with mock.patch.object(persistence_queue, 'store', store):
+            # When: Message is sent
+            response = send_message(send_ev, "")
+            # Then: Sender is answered and room gets the message before it is stored
+            self.assertEqual(response['statusCode'], 200)
+            self.assertEqual(self.gateway.posts, 1)
+            self.assertEqual(store.items, [])
+            store.release.set()
+            persistence_queue.join()
+        self.assertEqual(len(store.items), 1)
+
+    def test_persist_mode_reports_messages_not_stored(self):
+        # Given: Message table rejecting writes
+        def failing_store(room, item):
+            raise ClientError({'Error': {'Code': 'InternalServerError'}}, 'PutItem')
+
+        with mock.patch.object(persistence_queue, 'store', failing_store):
+            # When: Message is sent
+            response = send_message(send_ev, "")
+        # Then: It is still broadcast, but sender learns it was not stored
+        self.assertEqual(response['statusCode'], 500)
+        self.assertEqual(self.gateway.posts, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import json
+import os
+import unittest
+from unittest import mock
+import aws_resources
+import utils
+import rate_limit
+from rate_limit import RateLimiter
+from message.app import send_message
+from chat_backend.benchmarks.fakes import FakeGateway, build_connection_table, build_message_table
+from chat_backend.tests.unit.test_data import send_message_event as send_ev
+from chat_backend.tests.unit.test_helpers import FakeClock
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_bucket_rejects_above_burst_until_refilled(self):
+        # Given: Bucket of 2 tokens refilled at 1 per second, kept in memory only
+        clock = FakeClock()
+        limiter = RateLimiter('connection', rate=1, burst=2, lease_size=0, clock=clock)
+        # When: 3 messages are sent at once and one more a second later
+        first = [limiter.admit('conn_1') for _ in range(3)]
+        other = limiter.admit('conn_2')
+        clock.now = 1
+        later = limiter.admit('conn_1')
+        # Then: Only the third one waits for a refill, other keys are not affected
+        self.assertEqual(first, [0, 0, 1.0])
+        self.assertEqual((other, later), (0, 0))
+        self.assertEqual(limiter.stats()['rejected'], 1)
+
+    @mock.patch.dict(os.environ, {"MESSAGE_TABLE_NAME": "test_message_table"})
+    def test_containers_share_window_budget_through_counter(self):
+        # Given: Two containers limiting a room to 1 message per second over 10 second windows
+        aws_resources.clear_cache()
+        table = build_message_table('test_message_table')
+        aws_resources.register_table(table.name, table)
+        clock = FakeClock()
+        containers = [RateLimiter('room', rate=1, burst=100, window=10, lease_size=3, clock=clock)
+                      for _ in range(2)]
+        # When: Both of them take turns sending 30 messages within a window
+        results = [containers[i % 2].admit('general') for i in range(30)]
+        # Then: Window budget is not exceeded and it costs fewer counter writes than messages
+        self.assertEqual(results.count(0), 10)
+        self.assertLess(table.calls['UpdateItem'], 10)
+        self.assertEqual(table.items()[0]['used'], 10)
+        self.assertEqual(table.items()[0]['room'], 'rate#room#general')
+        aws_resources.clear_cache()
+
+    def test_room_rejection_does_not_charge_connection(self):
+        # Given: Connection allowed 2 messages at once in a room which allows 1
+        clock = FakeClock()
+        connection = RateLimiter('connection', rate=1, burst=2, lease_size=0, clock=clock)
+        room = RateLimiter('room', rate=1, burst=1, lease_size=0, clock=clock)
+        with mock.patch.object(rate_limit, 'connection_limiter', connection), \
+                mock.patch.object(rate_limit, 'room_limiter', room):
+            # When: Sender fills the room and keeps sending to it
+            first = rate_limit.check_rate('conn_1', 'general')
+            rejected = [rate_limit.check_rate('conn_1', 'general') for _ in range(3)]
+            # Then: Only the room rejects and the sender still has its second token for another room
+            self.assertIsNone(first)
+            self.assertEqual({x['scope'] for x in rejected}, {'room'})
+            self.assertIsNone(rate_limit.check_rate('conn_1', 'other'))
+        self.assertEqual(connection.stats()['admitted'], 2)
+
+    def test_refund_returns_token_to_lease(self):
+        # Given: Limiter paying tokens from leases of 3 out of a shared counter
+        clock = FakeClock()
+        reserve = mock.Mock(return_value=True)
+        limiter = RateLimiter('connection', rate=1, burst=10, window=10, lease_size=3, reserve=reserve, clock=clock)
+        # When: 3 messages are admitted and 2 of them refunded
+        limiter.admit('conn_1')
+        for _ in range(2):
+            limiter.admit('conn_1')
+            limiter.refund('conn_1')
+        limiter.admit('conn_1')
+        # Then: Refunded tokens are paid again from the same lease
+        self.assertEqual(reserve.call_count, 1)
+
+
+@mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table"})
+@mock.patch.dict(os.environ, {"MESSAGE_TABLE_NAME": "test_message_table"})
+class TestSlowDown(unittest.TestCase):
+
+    def setUp(self):
+        aws_resources.clear_cache()
+        utils._index_blocks.clear()
+        connections = build_connection_table('test_conn_table')
+        for i in range(3):
+            connections.put_item(Item={'connectionId': f'conn_{i}', 'room': 'general'})
+        self.gateway = FakeGateway()
+        self.gateway.keep_frames = True
+        aws_resources.register_table(connections.name, connections)
+        aws_resources.register_table('test_message_table', build_message_table('test_message_table'))
+        aws_resources.register_gateway_client(utils.get_endpoint_url(send_ev), self.gateway)
+        rate_limit.connection_limiter.clear()
+
+    def tearDown(self):
+        rate_limit.connection_limiter.clear()
+        aws_resources.clear_cache()
+
+    @mock.patch.object(rate_limit.connection_limiter, 'rate', 1)
+    @mock.patch.object(rate_limit.connection_limiter, 'burst', 2)
+    @mock.patch('metrics.METRICS_SAMPLE_RATE', 1.0)
+    @mock.patch('metrics.emit')
+    def test_chatty_connection_is_told_to_slow_down(self, emit_mock):
+        # Given: Connection allowed 2 messages at once
+        # When: It sends 3 messages
+        responses = [send_message(send_ev, "") for _ in range(3)]
+        # Then: Third one is answered with 429 and a slow down frame instead of a broadcast
+        self.assertEqual([r['statusCode'] for r in responses], [200, 200, 429])
+        self.assertEqual(json.loads(responses[2]['body'])['error'], 'slow_down')
+        self.assertEqual(self.gateway.posts, 2 * 3 + 1)
+        sender = send_ev['requestContext']['connectionId']
+        frame = json.loads(self.gateway.received[sender][-1])
+        self.assertEqual(frame['slow_down']['scope'], 'connection')
+        self.assertGreater(frame['slow_down']['retry_after'], 0)
+        # Then: Admitted and rejected messages are reported
+        records = [c[0][0] for c in emit_mock.call_args_list]
+        self.assertEqual([r.get('RateAdmitted', 0) for r in records], [1, 1, 0])
+        self.assertEqual(records[2]['RateRejected'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
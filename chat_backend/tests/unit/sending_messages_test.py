@@ -1,29 +1,49 @@
 import os
+import json
 from message.app import send_message
 from unittest import mock
 from chat_backend.tests.unit.test_data import send_message_event as send_ev
 import unittest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
 from freezegun import freeze_time
+import aws_resources
+import utils
 from utils import get_body
 from message.utils import build_message_data
 
+
+def gone_error():
+    return ClientError({'Error': {'Code': 'GoneException', 'Message': 'Gone'}}, 'PostToConnection')
+
+
+def deleted_connections(connection_table):
+    """Connection ids deleted through batch_write_item of the table mock"""
+    return [request['DeleteRequest']['Key']['connectionId']['S']
+            for call in connection_table.meta.client.batch_write_item.call_args_list
+            for requests in call[1]['RequestItems'].values() for request in requests]
+
 @freeze_time("1970-01-01")
 @mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table"})
 @mock.patch.dict(os.environ, {"MESSAGE_TABLE_NAME": "test_message_table"})
 class TestMessaging(unittest.TestCase):
 
-    @mock.patch('utils.dynamodb.Table')
+    def setUp(self):
+        aws_resources.clear_cache()
+        utils._index_blocks.clear()
+
+    @mock.patch('aws_resources.boto3.resource')
     @mock.patch('boto3.client')
-    def test_sending_successful(self, api_gateway_mock, dynamo_mock):
+    def test_sending_successful(self, api_gateway_mock, resource_mock):
+        dynamo_mock = resource_mock.return_value.Table
         # Given: Api Gateway event with connection Id
         conn_id = send_ev["requestContext"].get("connectionId")
         # Given: Message and connection tables with content inside
         message_index = 5_000_000
         message_content = get_body(send_ev)["content"]
         message_table = mock.Mock(name='mess_table',
-                                  query=lambda *_, **__: {'Items': [{'index': message_index}]})
+                                  update_item=lambda *_, **__: {'Attributes': {'next_index': message_index + 2}})
         connection_table = mock.Mock(name='conn_table',
-                                     scan=lambda*_, **__: {'Items': [{'connectionId': conn_id}]})
+                                     query=lambda*_, **__: {'Items': [{'connectionId': conn_id}]})
         dynamo_mock.side_effect = [message_table, connection_table]
         # When: send message function is called with a valid event
         response = send_message(send_ev, "")
@@ -33,25 +53,28 @@ class TestMessaging(unittest.TestCase):
         message_table.put_item.assert_called_once_with(
             Item={'room': 'general', 'index': message_index+1,
                   'timestamp': 0, 'username': 'Mate',
-                  'content': message_content}
+                  'content': message_content},
+            ConditionExpression='attribute_not_exists(#index)',
+            ExpressionAttributeNames={'#index': 'index'}
         )
         # Then: Message is sent to 1 existing connection
         api_gateway_mock.return_value.post_to_connection.assert_called_once_with(
             ConnectionId=conn_id,
-            Data=build_message_data(username='Mate', body=get_body(send_ev))
+            Data=build_message_data(username='Mate', body=get_body(send_ev), index=message_index+1)
         )
 
-    @mock.patch('utils.dynamodb.Table')
+    @mock.patch('aws_resources.boto3.resource')
     @mock.patch('boto3.client')
-    def test_sending_with_multiple_active_conn(self, api_gateway_mock, dynamo_mock):
+    def test_sending_with_multiple_active_conn(self, api_gateway_mock, resource_mock):
+        dynamo_mock = resource_mock.return_value.Table
         # Given: 10 active clients are connected and writen to connections table
         number_of_active_connections = 10
         connection_table = mock.Mock(name='conn_table',
-                                     scan=lambda *_, **__:
+                                     query=lambda *_, **__:
                                      {'Items':
                                           [{'connectionId': f'conn_{i}'} for i in range(number_of_active_connections)]})
         message_table = mock.Mock(name='mess_table',
-                                  query=lambda *_, **__: {'Items': [{'index': 200}]})
+                                  update_item=lambda *_, **__: {'Attributes': {'next_index': 200}})
 
         dynamo_mock.side_effect = [message_table, connection_table]
         # When: send message function is called with a valid event
@@ -61,6 +84,89 @@ class TestMessaging(unittest.TestCase):
         # Then: Message is sent to exactly 10 clients
         assert number_of_active_connections == api_gateway_mock.return_value.post_to_connection.call_count
 
+    @mock.patch('aws_resources.boto3.resource')
+    @mock.patch('boto3.client')
+    def test_sending_removes_gone_connections(self, api_gateway_mock, resource_mock):
+        dynamo_mock = resource_mock.return_value.Table
+        # Given: 3 connections are stored and 2 of them are already gone
+        connection_table = mock.MagicMock(name='conn_table',
+                                          query=lambda *_, **__:
+                                          {'Items': [{'connectionId': f'conn_{i}'} for i in range(3)]})
+        connection_table.meta.client.batch_write_item.return_value = {}
+        message_table = mock.Mock(name='mess_table',
+                                  update_item=lambda *_, **__: {'Attributes': {'next_index': 1}})
+        dynamo_mock.side_effect = [message_table, connection_table, connection_table]
+
+        def post(ConnectionId, Data):
+            if ConnectionId != 'conn_0':
+                raise gone_error()
+        api_gateway_mock.return_value.post_to_connection.side_effect = post
+        # When: send message function is called with a valid event
+        response = send_message(send_ev, "")
+        # Then: 200 is returned with per outcome counters
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        self.assertEqual((body['sent'], body['stale'], body['failed']), (1, 2, 0))
+        self.assertEqual(body['latency']['count'], 3)
+        # Then: Gone connections are deleted in a batch
+        connection_table.meta.client.batch_write_item.assert_called_once()
+        self.assertEqual(sorted(deleted_connections(connection_table)), ['conn_1', 'conn_2'])
+        # Then: Management api client is created only once
+        api_gateway_mock.assert_called_once()
+
+    @mock.patch('aws_resources.boto3.resource')
+    @mock.patch('boto3.client')
+    def test_unreachable_connections_do_not_abort_broadcast(self, api_gateway_mock, resource_mock):
+        dynamo_mock = resource_mock.return_value.Table
+        # Given: 4 connections, posts to 2 of them fail below api level and 1 is gone
+        connection_table = mock.MagicMock(name='conn_table',
+                                          query=lambda *_, **__:
+                                          {'Items': [{'connectionId': f'conn_{i}'} for i in range(4)]})
+        connection_table.meta.client.batch_write_item.return_value = {}
+        message_table = mock.Mock(name='mess_table',
+                                  update_item=lambda *_, **__: {'Attributes': {'next_index': 1}})
+        dynamo_mock.side_effect = [message_table, connection_table, connection_table]
+
+        def post(ConnectionId, Data):
+            if ConnectionId == 'conn_1':
+                raise EndpointConnectionError(endpoint_url='https://example.com')
+            if ConnectionId == 'conn_2':
+                raise ReadTimeoutError(endpoint_url='https://example.com')
+            if ConnectionId == 'conn_3':
+                raise gone_error()
+        api_gateway_mock.return_value.post_to_connection.side_effect = post
+        # When: Message is sent
+        response = send_message(send_ev, "")
+        # Then: Failed posts are counted and the gone connection is still removed
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        self.assertEqual((body['sent'], body['failed'], body['stale']), (1, 2, 1))
+        self.assertEqual(deleted_connections(connection_table), ['conn_3'])
+
+    @mock.patch('aws_resources.boto3.resource')
+    @mock.patch('boto3.client')
+    def test_sending_to_room_reads_all_pages(self, api_gateway_mock, resource_mock):
+        dynamo_mock = resource_mock.return_value.Table
+        # Given: Room members are returned by connection table in two pages
+        pages = {None: {'Items': [{'connectionId': 'conn_0'}], 'LastEvaluatedKey': {'connectionId': 'conn_0'}},
+                 'conn_0': {'Items': [{'connectionId': 'conn_1'}]}}
+        connection_table = mock.Mock(name='conn_table')
+        connection_table.query.side_effect = \
+            lambda **kwargs: pages[kwargs.get('ExclusiveStartKey', {}).get('connectionId')]
+        message_table = mock.Mock(name='mess_table',
+                                  update_item=lambda *_, **__: {'Attributes': {'next_index': 1}})
+        dynamo_mock.side_effect = [message_table, connection_table]
+        # Given: Message addressed to room 'random'
+        event = dict(send_ev, body='{"action": "sendmessage", "room": "random", "content": "hi"}')
+        # When: send message function is called
+        response = send_message(event, "")
+        # Then: Message is stored in the room and sent to members from both pages
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(message_table.put_item.call_args[1]['Item']['room'], 'random')
+        self.assertEqual(connection_table.query.call_args_list[0][1]['ExpressionAttributeValues'],
+                         {':room': 'random'})
+        self.assertEqual(api_gateway_mock.return_value.post_to_connection.call_count, 2)
+
     def test_sending_broken_body(self):
         # Given: Broken api event
         broken_event = {'some': 'data'}
@@ -0,0 +1,108 @@
+import json
+import os
+import unittest
+from unittest import mock
+from botocore.exceptions import ClientError
+import aws_resources
+import utils
+from history import history_cache
+from message.app import send_message, get_recent_messages
+from chat_backend.ws_connection.app import connection_manager
+from chat_backend.benchmarks.fakes import build_message_table
+from chat_backend.tests.unit.test_data import send_message_event, web_socket_connect_event
+from chat_backend.tests.unit.test_helpers import FakeClock
+
+
+@mock.patch.dict(os.environ, {"MESSAGE_TABLE_NAME": "test_message_table"})
+@mock.patch.dict(utils.MESSAGE_ROOM_SHARDS, {'busy': 4})
+class TestShardedMessages(unittest.TestCase):
+
+    def setUp(self):
+        aws_resources.clear_cache()
+        history_cache.clear()
+        utils._index_blocks.clear()
+        self.table = build_message_table('test_message_table', page_size=3)
+        aws_resources.register_table(self.table.name, self.table)
+
+    def store(self, room, count):
+        for i in range(count):
+            utils.put_message_to_db('a', {'room': room, 'content': f'message {i}'})
+
+    def test_messages_are_spread_over_room_shards(self):
+        # Given: Room with 4 shards and room with the default single shard
+        # When: 8 messages are stored to each
+        self.store('busy', 8)
+        self.store('quiet', 8)
+        # Then: Sharded room messages are split evenly by index, the other room keeps its key
+        partitions = {}
+        for item in self.table.items():
+            partitions.setdefault(item['room'], []).append(item['index'])
+        self.assertEqual(sorted(partitions['busy']), [0, 4])
+        self.assertEqual(sorted(partitions['busy#3']), [3, 7])
+        self.assertEqual(sorted(partitions['quiet']), list(range(8)))
+        self.assertNotIn('quiet#1', partitions)
+
+    def test_history_merges_newest_messages_of_all_shards(self):
+        # Given: 30 messages in a room of 4 shards
+        self.store('busy', 30)
+        history_cache.clear()
+        # When: Recent history is read from the table
+        history = utils.get_recent_history('busy')
+        # Then: Newest messages of all shards are returned oldest first
+        self.assertEqual([x['index'] for x in history], list(range(30 - history_cache.size, 30)))
+
+    def test_sync_merges_shards_in_index_order(self):
+        # Given: 20 messages in a room of 4 shards, read in pages of 3
+        self.store('busy', 20)
+        # When: Messages after index 6 are read
+        indexes = [x['index'] for x in utils.iter_messages_since('busy', 6)]
+        # Then: Every newer message is returned once in order
+        self.assertEqual(indexes, list(range(7, 20)))
+
+    def test_counter_recovers_past_latest_message_of_any_shard(self):
+        # Given: Sharded room written before the counter existed
+        for index in range(6):
+            self.table.put_item(Item={'room': utils.get_message_partition('busy', index), 'index': index,
+                                      'username': 'a', 'content': 'old'})
+        # When: New message is stored
+        item = utils.put_message_to_db('a', {'room': 'busy', 'content': 'new'})
+        # Then: It gets the index after the latest stored one
+        self.assertEqual(item['index'], 6)
+
+    @mock.patch('aws_resources.get_table')
+    def test_rooms_cannot_address_shards_or_counters(self, get_table_mock):
+        # Given: Room names spelling a shard, an index counter and a rate counter key
+        for room in ('busy#1', 'counter#busy', 'rate#room#busy'):
+            with self.subTest(room=room):
+                body = json.dumps({'room': room, 'content': 'hi'})
+                connect = dict(web_socket_connect_event, queryStringParameters={'room': room})
+                # When: They are used to send, read history and connect
+                responses = [send_message(dict(send_message_event, body=body), None),
+                             get_recent_messages(dict(send_message_event, body=body), None),
+                             connection_manager(connect, None)]
+                # Then: Every request is rejected before touching a table
+                self.assertEqual([r['statusCode'] for r in responses], [400, 400, 400])
+                get_table_mock.assert_not_called()
+
+
+class TestPartitionCapacity(unittest.TestCase):
+
+    def test_writes_above_partition_capacity_are_throttled(self):
+        # Given: Table with 2 writes per second per partition
+        clock = FakeClock()
+        table = build_message_table(partition_wcu=2, clock=clock)
+        # When: 3 writes go to one partition within a second
+        table.put_item(Item={'room': 'a', 'index': 1})
+        table.put_item(Item={'room': 'a', 'index': 2})
+        with self.assertRaises(ClientError) as error:
+            table.put_item(Item={'room': 'a', 'index': 3})
+        # Then: Third one is throttled while other partitions and the next second are not
+        self.assertEqual(error.exception.response['Error']['Code'], 'ProvisionedThroughputExceededException')
+        table.put_item(Item={'room': 'b', 'index': 1})
+        clock.now = 1
+        table.put_item(Item={'room': 'a', 'index': 3})
+        self.assertEqual(table.throttled, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import json
+import unittest
+from unittest import mock
+from decimal import Decimal
+import aws_resources
+import utils
+from history import history_cache
+from message.app import sync_messages, send_message, get_recent_messages
+from chat_backend.benchmarks.fakes import FakeGateway, build_connection_table, build_message_table
+from chat_backend.tests.unit.test_data import send_message_event as send_ev
+
+
+class PagedMessageTable:
+    """Stand-in of message table answering index range queries page by page"""
+
+    def __init__(self, count):
+        self.items = [{'room': 'general', 'index': Decimal(i), 'username': 'a', 'content': f'message {i}'}
+                      for i in range(count)]
+        self.reads = 0
+
+    def query(self, ExpressionAttributeValues, Limit, ExclusiveStartKey=None, **_):
+        self.reads += 1
+        start = ExclusiveStartKey['index'] if ExclusiveStartKey else ExpressionAttributeValues[':since']
+        items = [x for x in self.items if x['index'] > start][:Limit]
+        response = {'Items': items}
+        if len(items) == Limit:
+            response['LastEvaluatedKey'] = {'room': 'general', 'index': items[-1]['index']}
+        return response
+
+
+def sync_event(since):
+    return dict(send_ev, body=json.dumps({'action': 'syncmessages', 'since': since}))
+
+
+@mock.patch.dict(os.environ, {"MESSAGE_TABLE_NAME": "test_message_table"})
+@mock.patch('utils.SYNC_PAGE_SIZE', 10)
+class TestSync(unittest.TestCase):
+
+    def sync(self, table, since):
+        aws_resources.clear_cache()
+        with mock.patch('utils.get_message_table', lambda: table), \
+                mock.patch('utils.get_connection_encoding', lambda _: 'json'), \
+                mock.patch('boto3.client') as api_gateway_mock:
+            response = sync_messages(sync_event(since), "")
+        frames = [json.loads(c[1]['Data']) for c in api_gateway_mock.return_value.post_to_connection.call_args_list]
+        return response, frames
+
+    def test_only_missed_messages_are_sent(self):
+        # Given: Room with 100 messages and client which saw message 94
+        table = PagedMessageTable(100)
+        # When: Client syncs
+        response, frames = self.sync(table, 94)
+        # Then: 5 newer messages are sent in one final page
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual([m['index'] for m in frames[0]['messages']], [95, 96, 97, 98, 99])
+        self.assertEqual((frames[0]['cursor'], frames[0]['more']), (99, False))
+        self.assertEqual(table.reads, 1)
+
+    @mock.patch('utils.SYNC_MAX_PAGES', 3)
+    def test_large_gap_is_sent_in_pages_with_cursor(self):
+        # Given: Room with 100 messages and client which saw nothing
+        table = PagedMessageTable(100)
+        # When: Client syncs and then continues from the returned cursor
+        _, first = self.sync(table, -1)
+        _, second = self.sync(table, first[-1]['cursor'])
+        # Then: Pages are capped and every page points to the next one
+        self.assertEqual([len(frame['messages']) for frame in first], [10, 10, 10])
+        self.assertEqual([frame['cursor'] for frame in first], [9, 19, 29])
+        self.assertTrue(all(frame['more'] for frame in first))
+        self.assertEqual(second[0]['messages'][0]['index'], 30)
+
+    @mock.patch('utils.SYNC_PAGE_BYTES', 200)
+    def test_pages_are_capped_by_size(self):
+        # Given: Room with 5 messages larger than a fifth of the page size limit
+        table = PagedMessageTable(5)
+        # When: Client syncs
+        _, frames = self.sync(table, -1)
+        # Then: Every page fits the size limit
+        self.assertGreater(len(frames), 1)
+        self.assertEqual(sum(len(frame['messages']) for frame in frames), 5)
+
+    def test_client_up_to_date_gets_empty_page(self):
+        response, frames = self.sync(PagedMessageTable(3), 2)
+        self.assertEqual(frames, [{'messages': [], 'cursor': 2, 'more': False}])
+
+    def test_invalid_cursor(self):
+        response, _ = self.sync(PagedMessageTable(3), 'latest')
+        self.assertEqual(response['statusCode'], 400)
+
+
+@mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table", "MESSAGE_TABLE_NAME": "test_message_table"})
+class TestLiveCursor(unittest.TestCase):
+
+    def setUp(self):
+        aws_resources.clear_cache()
+        history_cache.clear()
+        utils._index_blocks.clear()
+        utils._connection_items.clear()
+        self.client = send_ev['requestContext']['connectionId']
+        connections = build_connection_table('test_conn_table')
+        connections.put_item(Item={'connectionId': self.client, 'room': 'general'})
+        self.gateway = FakeGateway()
+        self.gateway.keep_frames = True
+        aws_resources.register_table(connections.name, connections)
+        aws_resources.register_table('test_message_table', build_message_table('test_message_table'))
+        aws_resources.register_gateway_client(utils.get_endpoint_url(send_ev), self.gateway)
+
+    def tearDown(self):
+        aws_resources.clear_cache()
+
+    def frames(self):
+        return [json.loads(x) for x in self.gateway.received[self.client]]
+
+    def test_client_syncs_from_index_of_live_and_history_frames(self):
+        # Given: Client which got 3 messages live and then went away
+        for i in range(3):
+            send_message(dict(send_ev, body=json.dumps({'content': f'live {i}'})), "")
+        live_cursor = self.frames()[-1]['messages']['index']
+        get_recent_messages(send_ev, "")
+        history_cursor = self.frames()[-1]['messages'][-1]['index']
+        for i in range(2):
+            utils.put_message_to_db('Mate', {'content': f'missed {i}'})
+        # When: It syncs from the index of the last message it got
+        sync_messages(sync_event(live_cursor), "")
+        # Then: Only messages it missed are sent, history frames carry the same cursor
+        self.assertEqual(history_cursor, live_cursor)
+        self.assertEqual([m['content'] for m in self.frames()[-1]['messages']], ['missed 0', 'missed 1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,8 @@
+class FakeClock:
+    """Clock returning the time set on it, stands in for time.time and time.monotonic"""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
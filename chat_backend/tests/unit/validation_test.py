@@ -0,0 +1,87 @@
+import copy
+import json
+import unittest
+from unittest import mock
+import validation
+from message.app import send_message, get_recent_messages
+from chat_backend.ws_connection.app import connection_manager
+from chat_backend.tests.unit.test_data import send_message_event as send_ev, web_socket_connect_event as ws_conn_ev
+
+
+def with_body(body):
+    return dict(send_ev, body=body if isinstance(body, str) else json.dumps(body))
+
+
+class TestValidation(unittest.TestCase):
+
+    def test_sample_events_pass(self):
+        validation.validate_event(send_ev)
+        validation.validate_event(ws_conn_ev, validation.CONNECTION_EVENT)
+        body = validation.parse_body(send_ev, validation.SEND_MESSAGE)
+        self.assertEqual(body['content'], 'Must be something useful')
+
+    def test_event_without_management_endpoint_is_rejected(self):
+        event = copy.deepcopy(send_ev)
+        del event['requestContext']['domainName']
+        with self.assertRaisesRegex(ValueError, 'domainName'):
+            validation.validate_event(event)
+
+    def test_malformed_bodies_are_rejected(self):
+        for body in ('{"content": ', '["content"]', {'room': 'general'}, {'content': 5},
+                     {'content': 'hi', 'room': 'r' * 100}):
+            with self.subTest(body=body), self.assertRaises(ValueError):
+                validation.parse_body(with_body(body), validation.SEND_MESSAGE)
+
+    def test_names_with_reserved_characters_are_rejected(self):
+        for schema, body in ((validation.SEND_MESSAGE, {'content': 'hi', 'room': 'general#1'}),
+                             (validation.DIRECT_MESSAGE, {'content': 'hi', 'to': 'loha\n'}),
+                             (validation.ROOM_REQUEST, {'room': 'rate#room#general'}),
+                             (validation.SYNC_REQUEST, {'room': 'general#counter', 'since': 3}),
+                             (validation.CONNECT_QUERY, {'username': 'lo#ha'})):
+            with self.subTest(body=body), self.assertRaisesRegex(ValueError, 'not allowed'):
+                schema(body)
+        validation.CONNECT_QUERY({'username': 'Łoha Ko-1.2', 'room': '', 'encoding': 'msgpack'})
+
+    @mock.patch('validation.MAX_BODY_BYTES', 100)
+    def test_body_size_is_counted_in_utf8_bytes(self):
+        # Given: Bodies of 60 characters, one of them 3 bytes each in utf-8
+        ascii_body = json.dumps({'content': 'a' * 48})
+        wide_body = json.dumps({'content': 'ф' * 48}, ensure_ascii=False)
+        # Then: Only the one over 100 bytes is rejected
+        validation.parse_body(with_body(ascii_body))
+        with self.assertRaisesRegex(ValueError, 'larger'):
+            validation.parse_body(with_body(wide_body))
+
+    def test_codecs_decode_alike(self):
+        decoded = {}
+        for codec in ('json', 'orjson'):
+            used = validation.use_codec(codec)
+            decoded[used] = validation.parse_body(send_ev)
+        validation.use_codec(validation.JSON_CODEC)
+        self.assertEqual(len({json.dumps(x, sort_keys=True) for x in decoded.values()}), 1)
+
+
+class TestHandlersRejectBeforeIO(unittest.TestCase):
+
+    @mock.patch('aws_resources.get_table')
+    def test_oversized_message_is_rejected_before_any_table_call(self, get_table_mock):
+        response = send_message(with_body({'content': 'x' * (validation.MAX_CONTENT_LENGTH + 1)}), "")
+        self.assertEqual(response['statusCode'], 400)
+        get_table_mock.assert_not_called()
+
+    @mock.patch('aws_resources.get_table')
+    def test_history_request_with_bad_room_is_rejected(self, get_table_mock):
+        response = get_recent_messages(with_body({'room': ['general']}), "")
+        self.assertEqual(response['statusCode'], 400)
+        get_table_mock.assert_not_called()
+
+    @mock.patch('aws_resources.get_table')
+    def test_connect_with_too_long_username_is_rejected(self, get_table_mock):
+        event = dict(ws_conn_ev, queryStringParameters={'username': 'u' * 100})
+        response = connection_manager(event, "")
+        self.assertEqual(response['statusCode'], 400)
+        get_table_mock.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
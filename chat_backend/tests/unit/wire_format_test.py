@@ -0,0 +1,86 @@
+import os
+import json
+import zlib
+import unittest
+from unittest import mock
+import aws_resources
+import wire_format
+from wire_format import FrameEncoder, encode
+from message.app import send_message
+from chat_backend.tests.unit.test_data import send_message_event as send_ev
+
+history_frame = {'messages': [{'username': f'user_{i}', 'content': 'Must be something useful ' * 4}
+                              for i in range(30)]}
+
+
+class TestWireFormat(unittest.TestCase):
+
+    def test_compact_frame_sends_field_names_once(self):
+        frame = {'messages': [{'username': 'a', 'content': 'hi'}], 'cursor': 3}
+        self.assertEqual(json.loads(encode(frame, 'compact')),
+                         {'cursor': 3, 'f': ['username', 'content'], 'm': [['a', 'hi']]})
+        self.assertLess(len(encode(history_frame, 'compact')), len(encode(history_frame, 'json')))
+
+    def test_compact_sync_page_keeps_message_index(self):
+        frame = {'messages': [{'index': 3, 'username': 'a', 'content': 'x'}], 'cursor': 3, 'more': False}
+        self.assertEqual(json.loads(encode(frame, 'compact')),
+                         {'cursor': 3, 'more': False, 'f': ['username', 'content', 'index'], 'm': [['a', 'x', 3]]})
+
+    def test_compact_leaves_frames_without_messages_alone(self):
+        for frame in ({'slow_down': {'scope': 'room', 'retry_after': 0.5}},
+                      {'presence': {'room': 'general', 'users': ['a']}},
+                      {'reconnect': {'reason': 'expired'}}):
+            with self.subTest(frame=frame):
+                self.assertEqual(json.loads(encode(frame, 'compact')), frame)
+                self.assertLessEqual(len(encode(frame, 'compact')), len(encode(frame, 'json')))
+
+    def test_zlib_compresses_only_large_frames(self):
+        small = {'messages': {'username': 'a', 'content': 'hi'}}
+        self.assertEqual(encode(small, 'zlib'), encode(small, 'json'))
+        compressed = encode(history_frame, 'zlib')
+        self.assertEqual(compressed[0], 0x78)
+        self.assertEqual(json.loads(zlib.decompress(compressed)), history_frame)
+
+    def test_unknown_encoding_falls_back_to_json(self):
+        self.assertEqual(FrameEncoder(history_frame)('xml'), encode(history_frame, 'json'))
+
+    def test_every_encoding_is_produced_once(self):
+        counting = {name: mock.Mock(side_effect=encoder) for name, encoder in wire_format.ENCODERS.items()}
+        with mock.patch.dict(wire_format.ENCODERS, counting):
+            encoder = FrameEncoder(history_frame)
+            for _ in range(3):
+                encoder('json')
+                encoder('compact')
+        self.assertEqual((counting['json'].call_count, counting['compact'].call_count), (1, 1))
+
+
+@mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "test_conn_table"})
+@mock.patch.dict(os.environ, {"MESSAGE_TABLE_NAME": "test_message_table"})
+class TestEncodedBroadcast(unittest.TestCase):
+
+    def setUp(self):
+        aws_resources.clear_cache()
+
+    @mock.patch('aws_resources.boto3.resource')
+    @mock.patch('boto3.client')
+    def test_members_get_frame_in_their_encoding(self, api_gateway_mock, resource_mock):
+        # Given: Room members using json, compact and default encoding
+        table = resource_mock.return_value.Table.return_value
+        table.update_item.return_value = {'Attributes': {'next_index': 1}}
+        table.query.return_value = {'Items': [{'connectionId': 'conn_0', 'encoding': 'json'},
+                                              {'connectionId': 'conn_1', 'encoding': 'compact'},
+                                              {'connectionId': 'conn_2'}]}
+        # When: Message is sent
+        send_message(send_ev, "")
+        # Then: Every member gets the frame encoded as it asked for
+        sent = {c[1]['ConnectionId']: json.loads(c[1]['Data'])
+                for c in api_gateway_mock.return_value.post_to_connection.call_args_list}
+        message = {'username': 'Mate', 'content': 'Must be something useful', 'index': 0}
+        self.assertEqual(sent['conn_0'], {'messages': message})
+        self.assertEqual(sent['conn_2'], {'messages': message})
+        self.assertEqual(sent['conn_1']['f'], ['username', 'content', 'index'])
+        self.assertEqual(sent['conn_1']['m'], [['Mate', 'Must be something useful', 0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,21 @@
 import os
 from chat_backend.ws_connection.app import connection_manager
 from unittest import mock
-from chat_backend.tests.unit.test_data import username_data, web_socket_connect_event as ws_conn_ev
+from chat_backend.tests.unit.test_data import username_data, room_data, web_socket_connect_event as ws_conn_ev
 import unittest
+import aws_resources
 
 
 @mock.patch.dict(os.environ, {"CONNECTION_TABLE_NAME": "testtable"})
 class TestWSConnection(unittest.TestCase):
 
-    @mock.patch('utils.dynamodb.Table')
+    def setUp(self):
+        aws_resources.clear_cache()
+
+    @mock.patch('aws_resources.boto3.resource')
     @mock.patch('uuid.uuid1', lambda: '42')
-    def test_connection_successful(self, dynamo_mock):
+    def test_connection_successful(self, resource_mock):
+        dynamo_mock = resource_mock.return_value.Table
         # Given: Api Gateway event with connection Id
         conn_id = ws_conn_ev["requestContext"].get("connectionId")
         # Given: Table name is passed to environment variables
@@ -23,11 +28,12 @@ class TestWSConnection(unittest.TestCase):
         dynamo_mock.assert_called_once_with(table_name)
         target_table = dynamo_mock.return_value
         # Then: The correct value of connection id is put to the table
-        target_table.put_item.assert_called_once_with(**{'Item': {'connectionId': conn_id, 'username': 'user_42'}})
+        target_table.put_item.assert_called_once_with(**{'Item': {'connectionId': conn_id, 'username': 'user_42', 'room': 'general', 'encoding': 'json'}})
 
     @mock.patch.dict(ws_conn_ev, username_data)
-    @mock.patch('utils.dynamodb.Table')
-    def test_connection_with_username_passed(self, dynamo_mock):
+    @mock.patch('aws_resources.boto3.resource')
+    def test_connection_with_username_passed(self, resource_mock):
+        dynamo_mock = resource_mock.return_value.Table
         # Given: Api Gateway event with connection Id and username as query param
         conn_id = ws_conn_ev["requestContext"].get("connectionId")
         username = ws_conn_ev["queryStringParameters"].get("username")
@@ -41,7 +47,39 @@ class TestWSConnection(unittest.TestCase):
         dynamo_mock.assert_called_once_with(table_name)
         target_table = dynamo_mock.return_value
         # Then: The correct value of connection id is put to the table
-        target_table.put_item.assert_called_once_with(**{'Item': {'connectionId': conn_id, 'username': username}})
+        target_table.put_item.assert_called_once_with(**{'Item': {'connectionId': conn_id, 'username': username, 'room': 'general', 'encoding': 'json'}})
+
+    @mock.patch.dict(ws_conn_ev, room_data)
+    @mock.patch('aws_resources.boto3.resource')
+    def test_connection_to_room(self, resource_mock):
+        target_table = resource_mock.return_value.Table.return_value
+        # Given: Api Gateway event with room passed as query param
+        conn_id = ws_conn_ev["requestContext"].get("connectionId")
+        # When: connect function is called with a valid event
+        response = connection_manager(ws_conn_ev, "")
+        # Then: 200 is returned
+        self.assertEqual(response['statusCode'], 200)
+        # Then: Connection is stored with the room it joined
+        target_table.put_item.assert_called_once_with(**{'Item': {'connectionId': conn_id, 'username': 'loha', 'room': 'random', 'encoding': 'json'}})
+
+    @mock.patch.dict(ws_conn_ev, {'queryStringParameters': {'encoding': 'compact'}})
+    @mock.patch('aws_resources.boto3.resource')
+    def test_connection_with_encoding(self, resource_mock):
+        target_table = resource_mock.return_value.Table.return_value
+        # When: connect function is called with compact encoding asked for
+        response = connection_manager(ws_conn_ev, "")
+        # Then: 200 is returned and the encoding is stored with the connection
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(target_table.put_item.call_args[1]['Item']['encoding'], 'compact')
+
+    @mock.patch.dict(ws_conn_ev, {'queryStringParameters': {'encoding': 'xml'}})
+    @mock.patch('aws_resources.boto3.resource')
+    def test_connection_with_unsupported_encoding(self, resource_mock):
+        # When: connect function is called with unknown encoding
+        response = connection_manager(ws_conn_ev, "")
+        # Then: 400 is returned and nothing is stored
+        self.assertEqual(response['statusCode'], 400)
+        resource_mock.return_value.Table.return_value.put_item.assert_not_called()
 
     @mock.patch.dict(ws_conn_ev, {"requestContext": {"connectionId": None, "eventType": "CONNECT"}})
     def test_connection_with_missing_connection_id(self):
@@ -63,9 +101,10 @@ class TestWSConnection(unittest.TestCase):
         self.assertEqual(response['statusCode'], 500)
         self.assertEqual(response['body'], 'Unrecognized eventType. CONNECT and DISCONNECT are only available.')
 
-    @mock.patch('utils.dynamodb.Table')
+    @mock.patch('aws_resources.boto3.resource')
     @mock.patch.dict(ws_conn_ev, {"requestContext": {"connectionId": 'ASD', "eventType": "DISCONNECT"}})
-    def test_disconnect_successfully(self, dynamo_mock):
+    def test_disconnect_successfully(self, resource_mock):
+        dynamo_mock = resource_mock.return_value.Table
         # Given: Api Gateway disconnect event with connection Id
         assert ws_conn_ev["requestContext"]['eventType'] == 'DISCONNECT'
         conn_id = ws_conn_ev["requestContext"].get("connectionId")
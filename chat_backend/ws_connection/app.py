@@ -1,16 +1,20 @@
 import logging
-from .utils import build_response, get_username
+from .utils import build_response, get_connection_attributes
 from .handlers import handler_map
+from metrics import instrumented, stage
+from validation import validate_event, validate_query, CONNECTION_EVENT
 
 logger = logging.getLogger("handler_logger")
 logger.setLevel(logging.DEBUG)
 
 
+@instrumented('connection_manager')
 def connection_manager(event, context):
     """
     Handles connecting and disconnecting for the Websocket.
     Connect verifes the passed in token, and if successful,
-    adds the connectionID to the database.
+    adds the connectionID to the database together with the room to join
+    and the wire encoding the client asked for.
     Disconnect removes the connectionID from the database.
     """
     connection_id = event["requestContext"].get("connectionId")
@@ -25,5 +29,18 @@ def connection_manager(event, context):
                      .format(event["requestContext"]["eventType"]))
         return build_response(500, "Unrecognized eventType. CONNECT and DISCONNECT are only available.")
 
-    return handler_map[event_type](connection_id, get_username(event), logger)
+    try:
+        with stage('Validate'):
+            validate_event(event, CONNECTION_EVENT)
+            # Only connect stores attributes, disconnect goes by connection id
+            attributes = None
+            if event_type == 'CONNECT':
+                validate_query(event)
+                attributes = get_connection_attributes(event)
+    except ValueError as v_er:
+        logger.error("Failed: {}".format(v_er))
+        return build_response(400, str(v_er))
+
+    with stage(event_type.capitalize()):
+        return handler_map[event_type](connection_id, attributes, logger)
 
@@ -1,16 +1,22 @@
 from utils import get_connection_table, build_response
+from connection_expiry import get_connection_expiry, EXPIRY_ATTRIBUTE
 
 
-def connect(connection_id, username, logger):
-    """Connect client to chat by adding new connection id to db"""
+def connect(connection_id, attributes, logger):
+    """Connect client to chat room by adding new connection id and its attributes to db"""
     logger.info("Connect requested (CID: {})".format(connection_id))
     # Add connectionID to the database
     table = get_connection_table()
-    table.put_item(Item={"connectionId": connection_id, 'username': username})
+    item = dict(attributes, connectionId=connection_id)
+    # Row expires unless the client keeps it alive with heartbeats
+    expires = get_connection_expiry()
+    if expires is not None:
+        item[EXPIRY_ATTRIBUTE] = expires
+    table.put_item(Item=item)
     return build_response(200, "Connect successful.")
 
 
-def disconnect(connection_id, username, logger):
+def disconnect(connection_id, attributes, logger):
     """Remove client from connection table.  """
     logger.info("Disconnect requested (CID: {})".format(connection_id))
     # Remove the connectionID from the database
@@ -1,14 +1,14 @@
-import boto3
 import os
 import json
 import uuid
-
-dynamodb = boto3.resource("dynamodb")
+import aws_resources
+from wire_format import DEFAULT_ENCODING, is_supported
+from validation import DEFAULT_ROOM
 
 
 def get_connection_table():
     """ Returns dynamo table resource to store connection ids"""
-    return dynamodb.Table(os.environ['CONNECTION_TABLE_NAME'])
+    return aws_resources.get_table(os.environ['CONNECTION_TABLE_NAME'])
 
 
 def build_response(status_code, body):
@@ -18,9 +18,36 @@ def build_response(status_code, body):
     return {"statusCode": status_code, "body": body}
 
 
+def get_query_param(event, name):
+    """Gets query string parameter of connect request. Api gateway sends None when there are no params"""
+    return (event.get('queryStringParameters') or {}).get(name)
+
+
 def get_username(event):
     """Gets username from query params if included. Otherwise generate uuid"""
-    usr_nm = event.get('queryStringParameters', {}).get('username')
+    usr_nm = get_query_param(event, 'username')
     if not usr_nm:
         usr_nm = f'user_{uuid.uuid1()}'
     return usr_nm
+
+
+def get_room(event):
+    """Gets room to join from query params. Default room is used if not included"""
+    return get_query_param(event, 'room') or DEFAULT_ROOM
+
+
+def get_encoding(event):
+    """
+    Gets wire encoding the client asked for in query params.
+    Raises:
+        ValueError: in case the encoding is not supported
+    """
+    encoding = get_query_param(event, 'encoding') or DEFAULT_ENCODING
+    if not is_supported(encoding):
+        raise ValueError(f"Unsupported encoding '{encoding}'.")
+    return encoding
+
+
+def get_connection_attributes(event):
+    """Collects attributes stored with the connection from connect request"""
+    return {'username': get_username(event), 'room': get_room(event), 'encoding': get_encoding(event)}